@@ -0,0 +1,111 @@
+"""
+Database profiles, selected with the DB_PROFILE environment variable.
+
+  sqlite        Plain SQLite as originally shipped: rollback journal and a
+                new connection per request. Kept for comparison.
+  sqlite-tuned  (default) WAL so readers never block on the writer,
+                synchronous=NORMAL, a busy timeout instead of immediate
+                "database is locked", a memory-mapped read path and
+                persistent connections.
+  postgres      PostgreSQL through psycopg 3 with Django's connection
+                pool (psycopg_pool), or persistent connections when
+                DB_POOL=0 (e.g. behind PgBouncer).
+
+`manage.py benchmark_db_profiles` compares their concurrent read/write
+throughput.
+
+A read replica (see core.db_router) is added as the 'replica' alias when
+REPLICA_SQLITE_PATH (SQLite profiles; keep it in sync locally with
+`manage.py sync_sqlite_replica`) or POSTGRES_REPLICA_HOST is set.
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+PROFILES = ('sqlite', 'sqlite-tuned', 'postgres')
+DEFAULT_PROFILE = 'sqlite-tuned'
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=134217728',  # 128 MiB
+    'PRAGMA cache_size=-20000',  # ~20 MiB page cache per connection
+    'PRAGMA temp_store=MEMORY',
+)
+
+
+def _int(environ, name, default):
+    return int(environ.get(name) or default)
+
+
+def database_settings(base_dir, environ=os.environ, profile=None):
+    """The DATABASES['default'] dict for `profile` (default: $DB_PROFILE)."""
+    profile = profile or environ.get('DB_PROFILE') or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise ImproperlyConfigured(f"Unknown DB_PROFILE '{profile}'. Use one of: {', '.join(PROFILES)}.")
+
+    if profile == 'sqlite':
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': environ.get('SQLITE_PATH') or base_dir / 'db.sqlite3',
+        }
+
+    if profile == 'sqlite-tuned':
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': environ.get('SQLITE_PATH') or base_dir / 'db.sqlite3',
+            'CONN_MAX_AGE': _int(environ, 'DB_CONN_MAX_AGE', 600),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock (sqlite3 busy timeout)
+                'timeout': _int(environ, 'SQLITE_BUSY_TIMEOUT', 20),
+                # Take the write lock at BEGIN so transactions that read then
+                # write wait on the busy timeout instead of failing on upgrade
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': ';'.join(SQLITE_PRAGMAS),
+            },
+        }
+
+    config = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('POSTGRES_DB', 'apna_dabba'),
+        'USER': environ.get('POSTGRES_USER', 'apna_dabba'),
+        'PASSWORD': environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': environ.get('POSTGRES_PORT', '5432'),
+        'OPTIONS': {},
+    }
+    if environ.get('DB_POOL', '1') != '0':
+        # Django's built-in psycopg_pool integration; requires CONN_MAX_AGE=0
+        config['OPTIONS']['pool'] = {
+            'min_size': _int(environ, 'DB_POOL_MIN_SIZE', 2),
+            'max_size': _int(environ, 'DB_POOL_MAX_SIZE', 10),
+            'timeout': _int(environ, 'DB_POOL_TIMEOUT', 10),
+        }
+    else:
+        config['CONN_MAX_AGE'] = _int(environ, 'DB_CONN_MAX_AGE', 60)
+        config['CONN_HEALTH_CHECKS'] = True
+    return config
+
+
+def replica_settings(primary, environ=os.environ):
+    """DATABASES['replica'] for the primary config, or None without a replica."""
+    if primary['ENGINE'] == 'django.db.backends.sqlite3':
+        if not environ.get('REPLICA_SQLITE_PATH'):
+            return None
+        options = dict(primary.get('OPTIONS', {}))
+        options.pop('transaction_mode', None)
+        # Never write to the replica by accident; WAL is set by the copy
+        options['init_command'] = 'PRAGMA query_only=ON'
+        config = dict(primary, NAME=environ['REPLICA_SQLITE_PATH'], OPTIONS=options)
+    else:
+        if not environ.get('POSTGRES_REPLICA_HOST'):
+            return None
+        config = dict(
+            primary,
+            HOST=environ['POSTGRES_REPLICA_HOST'],
+            PORT=environ.get('POSTGRES_REPLICA_PORT', primary['PORT']),
+        )
+    # Tests read and write one database
+    config['TEST'] = {'MIRROR': 'default'}
+    return config
@@ -10,8 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
+from .db_profiles import database_settings, replica_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,14 +46,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",  # Per-view latency/query metrics for /metrics/
+    "core.middleware.SlowQueryLogMiddleware",  # Only active with SLOW_QUERY_THRESHOLD_MS
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.middleware.UserSnapshotMiddleware",  # request.user from the cache, not auth_user
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "core.middleware.SubscriptionExpiryMiddleware",  # Auto-expiry automation
+    # Read-your-writes for the replica router; last so only the view's own
+    # writes (not the expiry job's) make a client sticky
+    "core.middleware.ReplicaStickinessMiddleware",
 ]
 
 ROOT_URLCONF = "apna_dabba.urls"
@@ -73,14 +84,88 @@ WSGI_APPLICATION = "apna_dabba.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
+# DB_PROFILE selects sqlite, sqlite-tuned (default) or postgres; see
+# apna_dabba/db_profiles.py for the per-profile environment variables.
 
 DATABASES = {
+    "default": database_settings(BASE_DIR),
+}
+_replica = replica_settings(DATABASES["default"])
+if _replica:
+    DATABASES["replica"] = _replica
+
+# Dashboard/catalogue reads go to the replica (when configured); a client
+# that just wrote stays on the primary for this many seconds
+DATABASE_ROUTERS = ["core.db_router.ReplicaRouter"]
+REPLICA_STICKY_SECONDS = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Use a shared backend (e.g. django.core.cache.backends.redis.RedisCache) when
+# running several workers so owner dashboard invalidation reaches all of them.
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "apna-dabba"),
     }
 }
 
+# LocMemCache is private to each worker process: invalidation (logout,
+# role/password changes) would not reach the other workers
+SHARED_CACHE = CACHES["default"]["BACKEND"] != "django.core.cache.backends.locmem.LocMemCache"
+
+# Sessions: "db" (Django's default), "cached_db" (read from the cache,
+# written through to django_session; needs a shared cache) or
+# "signed_cookies" (stored client-side, no session writes). Defaults to
+# cached_db when the cache is shared.
+SESSION_MODE = os.environ.get("SESSION_MODE", "cached_db" if SHARED_CACHE else "db")
+if SESSION_MODE == "cached_db" and not SHARED_CACHE:
+    raise ImproperlyConfigured(
+        "SESSION_MODE=cached_db needs a cache shared by all workers (set CACHE_BACKEND)."
+    )
+SESSION_ENGINE = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}[SESSION_MODE]
+
+# request.user is answered from a cached snapshot (id, username, is_staff,
+# TiffinService id) for up to this many seconds; see core/user_snapshot.py.
+# On by default only with a shared cache, and never used with LocMemCache.
+USER_SNAPSHOT = os.environ.get("USER_SNAPSHOT", "1" if SHARED_CACHE else "0") != "0"
+USER_SNAPSHOT_TIMEOUT = 60 * 60
+
+# Cached owner dashboard sections expire after this many seconds even
+# without an invalidating change
+OWNER_DASHBOARD_CACHE_TIMEOUT = 300
+
+# Merged weekly dishes per menu (Menu weekday fields + DailyMenu) are cached
+# until a Menu/DailyMenu change invalidates them, or for this many seconds
+WEEK_PLAN_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Anonymous home/reviews pages are shared from the cache (and marked public
+# for proxies) for this many seconds; ETags still change immediately
+PAGE_CACHE_TIMEOUT = 60
+
+# Prometheus metrics (/metrics/). With several workers set METRICS_DIR to a
+# shared writable directory so each scrape aggregates all processes. Scrapers
+# send "Authorization: Bearer <METRICS_TOKEN>"; without a token only
+# superusers' sessions may read it.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = 15
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Slow-query log: statements slower than this many milliseconds are written,
+# with their view, call site and query plan, to a rotating JSON-lines log.
+# Unset disables it; summarise with `manage.py slow_query_report`.
+_slow_query_threshold = os.environ.get("SLOW_QUERY_THRESHOLD_MS")
+SLOW_QUERY_THRESHOLD_MS = float(_slow_query_threshold) if _slow_query_threshold else None
+SLOW_QUERY_LOG = BASE_DIR / 'logs' / 'slow_queries.log'
+SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -122,10 +207,40 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Thumbnail/WebP derivatives of uploaded menu images (core.images) are
+# generated on a background thread pool after upload
+IMAGE_DERIVATIVES_ASYNC = True
+
 LOGIN_URL = 'login'
 
 LOGIN_REDIRECT_URL = '/'
 
+# Subscription auto-expiry runs at most once per interval (seconds) across
+# all workers; `manage.py expire_subscriptions` can also run it from cron
+SUBSCRIPTION_EXPIRY_INTERVAL = 300
+
+# DailyMealTracking keeps this many whole months; older rows are folded into
+# MonthlyMealRollup by `manage.py archive_meal_tracking` (run it from cron)
+MEAL_TRACKING_HOT_MONTHS = 6
+
+# Payments are confirmed asynchronously by `manage.py process_payments`
+# workers; set PAYMENTS_ASYNC=0 to confirm inline (no worker needed). The
+# local gateway emulator's latency (seconds) and failure/decline rates make
+# the flow testable offline; point BACKEND at a real gateway in production.
+PAYMENTS_ASYNC = os.environ.get("PAYMENTS_ASYNC", "1") != "0"
+PAYMENT_GATEWAY = {
+    "BACKEND": os.environ.get("PAYMENT_GATEWAY_BACKEND", "core.gateway.LocalGatewayEmulator"),
+    "OPTIONS": {
+        "latency": float(os.environ.get("PAYMENT_GATEWAY_LATENCY", "0.5")),
+        "failure_rate": float(os.environ.get("PAYMENT_GATEWAY_FAILURE_RATE", "0.0")),
+        "decline_rate": float(os.environ.get("PAYMENT_GATEWAY_DECLINE_RATE", "0.0")),
+    },
+}
+PAYMENT_MAX_ATTEMPTS = 5
+PAYMENT_RETRY_BACKOFF = 2
+PAYMENT_LEASE_SECONDS = 60
+PAYMENT_STATUS_POLL_INTERVAL = 2
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TiffinService, Menu, Order, Review
+from .models import TiffinService, Menu, Order, Review, PaymentIntent
 from .models import Menu
 
 # admin.site.register(Menu)
@@ -35,6 +35,13 @@ class ReviewAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'tiffin_service__name')
 
 
+@admin.register(PaymentIntent)
+class PaymentIntentAdmin(admin.ModelAdmin):
+    list_display = ('customer', 'subscription', 'amount', 'status', 'attempts', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('customer__username', 'idempotency_key', 'gateway_reference')
+
+
 
 
 # Register your models here.
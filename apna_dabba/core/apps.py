@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = "core"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Their connection_created handlers instrument every DB connection
+        from . import metrics, slow_queries  # noqa: F401
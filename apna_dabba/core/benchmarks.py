@@ -0,0 +1,200 @@
+"""
+Helpers for benchmark management commands.
+
+Benchmarks run against a throwaway test database so seeding thousands of
+rows never touches the real db.sqlite3.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection, close_old_connections, DatabaseError, OperationalError
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment, CaptureQueriesContext
+)
+from django.utils import timezone
+
+from .models import TiffinService, Menu, Subscription, CustomerSubscription, DailyMealTracking
+
+
+@contextmanager
+def benchmark_database(test_name=None):
+    """
+    Create a fresh test database for the duration of the block.
+
+    Pass test_name to put a SQLite test database in that file instead of
+    memory (needed to measure journal modes and locking).
+    """
+    if test_name:
+        connection.settings_dict['TEST']['NAME'] = test_name
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def seed_subscriptions(owners=5, menus_per_owner=4, customers=2000, expired_ratio=0.0):
+    """
+    Seed owners, menus, plans and one CustomerSubscription per customer.
+
+    Uses bulk_create so seeding stays fast (bypasses CustomerSubscription.save()).
+    Returns the list of created menus.
+    """
+    now = timezone.now()
+    owner_users = User.objects.bulk_create([
+        User(username=f'bench_owner_{i}', is_staff=True) for i in range(owners)
+    ])
+    services = TiffinService.objects.bulk_create([
+        TiffinService(owner=user, name=user.username, address='Bench', phone='0')
+        for user in owner_users
+    ])
+    menus = Menu.objects.bulk_create([
+        Menu(
+            tiffin_service=service,
+            title=f'{service.name} menu {i}',
+            description='Dal, rice, roti and sabzi',
+            monthly_price=Decimal('2500.00'),
+        )
+        for service in services for i in range(menus_per_owner)
+    ])
+    plans = Subscription.objects.bulk_create([
+        Subscription(menu=menu, title='Monthly', duration_in_days=30, price=Decimal('2500.00'))
+        for menu in menus
+    ])
+    customer_users = User.objects.bulk_create([
+        User(username=f'bench_customer_{i}') for i in range(customers)
+    ])
+
+    expired_cutoff = int(customers * expired_ratio)
+    CustomerSubscription.objects.bulk_create([
+        CustomerSubscription(
+            customer=customer,
+            subscription=plans[i % len(plans)],
+            menu=plans[i % len(plans)].menu,
+            start_date=now - timedelta(days=30 if i < expired_cutoff else 5),
+            end_date=now - timedelta(days=1) if i < expired_cutoff else now + timedelta(days=25),
+            is_active=True,
+        )
+        for i, customer in enumerate(customer_users)
+    ], batch_size=1000)
+
+    return menus
+
+
+def seed_meal_tracking(days=15, skip_every=7):
+    """
+    Seed one DailyMealTracking row per active subscription per day for the
+    last `days` days (every `skip_every`-th one Skipped). Returns the row count.
+    """
+    today = date.today()
+    subscription_ids = list(
+        CustomerSubscription.objects.filter(is_active=True).values_list('id', flat=True)
+    )
+    batch = []
+    total = 0
+    for offset in range(1, days + 1):
+        tracking_date = today - timedelta(days=offset)
+        for i, subscription_id in enumerate(subscription_ids):
+            skipped = (i + offset) % skip_every == 0
+            batch.append(DailyMealTracking(
+                subscription_id=subscription_id,
+                date=tracking_date,
+                status='Skipped' if skipped else 'Taken',
+                taken=not skipped,
+            ))
+            if len(batch) >= 5000:
+                DailyMealTracking.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+    DailyMealTracking.objects.bulk_create(batch)
+    return total + len(batch)
+
+
+def requests_per_second(client, path, count):
+    """Issue `count` GET requests and return the achieved rate."""
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get(path)
+    elapsed = time.perf_counter() - started
+    return count / elapsed if elapsed else 0.0
+
+
+def measure(func):
+    """Run func once; returns (wall time in ms, number of SQL queries)."""
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+    return elapsed * 1000, len(queries)
+
+
+def concurrent_load(read, write, readers=8, writers=2, duration=5.0):
+    """
+    Run read() in `readers` threads and write() in `writers` threads for
+    `duration` seconds. Each call is treated as one request: connections
+    are released afterwards exactly as at the end of a real request
+    (closed unless CONN_MAX_AGE keeps them).
+
+    Returns {'reads': {...}, 'writes': {...}} with ops, ops_per_sec,
+    lock_errors, errors and p95_ms for each side. lock_errors counts
+    OperationalError (lock contention, e.g. "database is locked"); errors
+    counts any other DatabaseError.
+    """
+    deadline = time.perf_counter() + duration
+    results = {'reads': [], 'writes': []}
+    lock_errors = {'reads': 0, 'writes': 0}
+    errors = {'reads': 0, 'writes': 0}
+    lock = threading.Lock()
+
+    def worker(kind, func, seed):
+        latencies = []
+        locked = failed = 0
+        iteration = seed
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    func(iteration)
+                    latencies.append(time.perf_counter() - started)
+                except OperationalError:
+                    locked += 1  # e.g. "database is locked"
+                except DatabaseError:
+                    failed += 1
+                iteration += 1
+                close_old_connections()
+        finally:
+            connection.close()
+            with lock:
+                results[kind].extend(latencies)
+                lock_errors[kind] += locked
+                errors[kind] += failed
+
+    threads = [
+        threading.Thread(target=worker, args=('reads', read, i * 100000)) for i in range(readers)
+    ] + [
+        threading.Thread(target=worker, args=('writes', write, i * 100000)) for i in range(writers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    summary = {}
+    for kind, latencies in results.items():
+        latencies.sort()
+        summary[kind] = {
+            'ops': len(latencies),
+            'ops_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+            'lock_errors': lock_errors[kind],
+            'errors': errors[kind],
+            'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+        }
+    return summary
@@ -0,0 +1,106 @@
+"""
+HTTP conditional GET and anonymous page caching for catalogue pages.
+
+ETags are derived from the catalogue state (Menu.updated_at,
+Subscription.created_at, Review.created_at and row counts, so deletions
+change them too) plus the viewer's own state, letting browsers and a
+reverse proxy revalidate with a 304 instead of re-rendering. Anonymous
+responses are additionally kept in a shared page cache keyed by that ETag.
+"""
+import hashlib
+from datetime import date
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db.models import Max, Count
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .models import Menu, Subscription, Review, CustomerSubscription
+
+
+def get_page_cache_timeout():
+    """Seconds anonymous catalogue pages stay cached (PAGE_CACHE_TIMEOUT, default 60)."""
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+
+
+def catalogue_state(request):
+    """
+    (last_modified, fingerprint) of everything public catalogue pages show.
+    Computed once per request.
+    """
+    if not hasattr(request, '_catalogue_state'):
+        aggregates = [
+            Menu.objects.order_by().aggregate(changed=Max('updated_at'), count=Count('id')),
+            Subscription.objects.order_by().aggregate(changed=Max('created_at'), count=Count('id')),
+            Review.objects.order_by().aggregate(changed=Max('created_at'), count=Count('id')),
+        ]
+        last_modified = max((a['changed'] for a in aggregates if a['changed']), default=None)
+        fingerprint = [(a['changed'] and a['changed'].timestamp(), a['count']) for a in aggregates]
+        request._catalogue_state = (last_modified, fingerprint)
+    return request._catalogue_state
+
+
+def viewer_state(request):
+    """Per-user part of the page state (role, own subscriptions, pending messages)."""
+    state = [len(messages.get_messages(request))]
+    user = request.user
+    if not user.is_authenticated:
+        return state + ['anonymous']
+
+    # Days remaining and expiry depend on the date
+    state += [user.pk, user.is_staff, date.today().isoformat()]
+    if not user.is_staff:
+        subscriptions = CustomerSubscription.objects.filter(customer=user).order_by().aggregate(
+            changed=Max('updated_at'), count=Count('id')
+        )
+        state += [subscriptions['changed'] and subscriptions['changed'].timestamp(), subscriptions['count']]
+    return state
+
+
+def page_etag(request, *args, **kwargs):
+    if not hasattr(request, '_page_etag'):
+        state = repr((catalogue_state(request)[1], viewer_state(request)))
+        request._page_etag = hashlib.md5(state.encode()).hexdigest()
+    return request._page_etag
+
+
+def page_last_modified(request, *args, **kwargs):
+    # Only meaningful for anonymous pages; personalised ones rely on the ETag
+    if request.user.is_authenticated:
+        return None
+    return catalogue_state(request)[0]
+
+
+def catalogue_page(view_func):
+    """
+    Conditional GET (ETag/Last-Modified) for a catalogue view, plus a shared
+    page cache for anonymous users.
+
+    Responses that set cookies (e.g. a CSRF token) are never shared.
+    """
+    @wraps(view_func)
+    def _cached_view(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            response = view_func(request, *args, **kwargs)
+            patch_cache_control(response, private=True)
+            return response
+
+        key = 'page:' + hashlib.md5(
+            f'{request.get_full_path()}:{page_etag(request)}'.encode()
+        ).hexdigest()
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        response = view_func(request, *args, **kwargs)
+        patch_vary_headers(response, ['Cookie'])
+        if response.status_code == 200 and not response.streaming and not response.cookies:
+            timeout = get_page_cache_timeout()
+            patch_cache_control(response, public=True, max_age=timeout)
+            cache.set(key, response, timeout)
+        return response
+
+    return condition(etag_func=page_etag, last_modified_func=page_last_modified)(_cached_view)
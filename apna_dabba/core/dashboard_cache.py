@@ -0,0 +1,114 @@
+"""
+Versioned per-owner cache for the owner dashboard.
+
+Every cached value is keyed by the owner's "data version", which signal
+handlers bump whenever a Menu, Subscription or CustomerSubscription row of
+that owner changes. Meal tracking has no receiver (it would block fast
+deletes of tracking rows); the views and bulk helpers that write tracking
+rows bump the version themselves. Bumping the version makes all older entries unreachable, so nothing
+has to be deleted explicitly.
+"""
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .db_router import use_primary
+from .models import TiffinService
+
+# Hit/miss counters per cached section (per process)
+CACHE_STATS = Counter()
+
+
+def _version_key(owner_id):
+    return f'owner-dashboard:{owner_id}:version'
+
+
+def get_dashboard_cache_timeout():
+    """Seconds cached dashboard data lives (OWNER_DASHBOARD_CACHE_TIMEOUT, default 5 min)."""
+    return getattr(settings, 'OWNER_DASHBOARD_CACHE_TIMEOUT', 300)
+
+
+def get_owner_version(owner_id):
+    """Current data version of an owner."""
+    version = cache.get(_version_key(owner_id))
+    if version is None:
+        # Start from a timestamp so an evicted version never reuses old keys
+        cache.add(_version_key(owner_id), int(time.time() * 1000), None)
+        version = cache.get(_version_key(owner_id))
+    return version
+
+
+async def aget_owner_version(owner_id):
+    """Async get_owner_version()."""
+    version = await cache.aget(_version_key(owner_id))
+    if version is None:
+        await cache.aadd(_version_key(owner_id), int(time.time() * 1000), None)
+        version = await cache.aget(_version_key(owner_id))
+    return version
+
+
+def bump_owner_version(owner_id):
+    """Invalidate everything cached for an owner."""
+    try:
+        cache.incr(_version_key(owner_id))
+    except ValueError:
+        get_owner_version(owner_id)
+
+
+def owner_id_for_menu(menu_id):
+    """Owner (User) ID of a menu; cached since menus never change owner."""
+    key = f'menu-owner:{menu_id}'
+    owner_id = cache.get(key)
+    if owner_id is None:
+        owner_id = TiffinService.objects.filter(menu__id=menu_id).values_list('owner_id', flat=True).first()
+        if owner_id is not None:
+            cache.set(key, owner_id, None)
+    return owner_id
+
+
+def _section_key(owner_id, version, name, vary):
+    vary_hash = hashlib.md5(repr(tuple(vary)).encode()).hexdigest()
+    return f'owner-dashboard:{owner_id}:v{version}:{name}:{vary_hash}'
+
+
+def cached_for_owner(owner_id, name, compute, vary=()):
+    """
+    Return compute() cached under the owner's current data version.
+
+    Args:
+        name: section name (also used for the hit/miss counters)
+        vary: extra values the result depends on (filters, cursor, date)
+    """
+    key = _section_key(owner_id, get_owner_version(owner_id), name, vary)
+
+    value = cache.get(key)
+    if value is not None:
+        CACHE_STATS[f'{name}_hits'] += 1
+        return value
+
+    CACHE_STATS[f'{name}_misses'] += 1
+    # Cached under the current version for minutes: never build it from a
+    # replica that may not have the write that bumped the version yet
+    with use_primary():
+        value = compute()
+    cache.set(key, value, get_dashboard_cache_timeout())
+    return value
+
+
+async def acached_for_owner(owner_id, name, acompute, vary=()):
+    """Async cached_for_owner(); acompute is a coroutine function."""
+    key = _section_key(owner_id, await aget_owner_version(owner_id), name, vary)
+
+    value = await cache.aget(key)
+    if value is not None:
+        CACHE_STATS[f'{name}_hits'] += 1
+        return value
+
+    CACHE_STATS[f'{name}_misses'] += 1
+    with use_primary():
+        value = await acompute()
+    await cache.aset(key, value, get_dashboard_cache_timeout())
+    return value
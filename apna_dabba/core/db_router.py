@@ -0,0 +1,128 @@
+"""
+Read-replica routing.
+
+Only views decorated with @replica_reads send their `core` reads to the
+REPLICA_DATABASE alias; everything else (all writes, auth and sessions,
+background jobs) uses the primary. Read-your-writes is kept two ways:
+
+- within a request, once anything is written all further reads go to the
+  primary;
+- after a request that wrote, ReplicaStickinessMiddleware sets a short-lived
+  cookie so that user's next requests (e.g. the dashboard after a payment or
+  meal toggle) stay on the primary for REPLICA_STICKY_SECONDS, which should
+  exceed the replication lag.
+
+Without a 'replica' entry in DATABASES the router always answers 'default'.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DATABASE = 'replica'
+STICKY_COOKIE = 'primary_until'
+
+# May reads use the replica here (set by @replica_reads)
+_replica_allowed = ContextVar('replica_allowed', default=False)
+# Mutable per-request state, so writes made in a worker thread (sync views
+# under ASGI) are still seen by the middleware
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+def get_sticky_seconds():
+    """Seconds a user's reads stay on the primary after a write (REPLICA_STICKY_SECONDS, default 10)."""
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+
+def replica_configured():
+    return REPLICA_DATABASE in connections.settings
+
+
+def is_sticky(request):
+    """Did this client write within the sticky window?"""
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def begin_request():
+    """Start tracking writes for a new request; returns its state."""
+    state = {'wrote': False}
+    _request_state.set(state)
+    return state
+
+
+def _wrote():
+    state = _request_state.get()
+    return state is not None and state['wrote']
+
+
+@contextmanager
+def use_primary():
+    """Force primary reads inside the block."""
+    token = _replica_allowed.set(False)
+    try:
+        yield
+    finally:
+        _replica_allowed.reset(token)
+
+
+def replica_reads(view_func):
+    """
+    Let a read-only view read from the replica (GET/HEAD only, and not for
+    a client inside its sticky-to-primary window).
+    """
+    def allowed(request):
+        return request.method in ('GET', 'HEAD') and not is_sticky(request)
+
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            token = _replica_allowed.set(allowed(request))
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _replica_allowed.reset(token)
+    else:
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            token = _replica_allowed.set(allowed(request))
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                _replica_allowed.reset(token)
+
+    return _wrapped_view
+
+
+class ReplicaRouter:
+    """Route core reads to the replica when allowed; all writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if (
+            _replica_allowed.get()
+            and not _wrote()
+            and model._meta.app_label == 'core'
+            and replica_configured()
+        ):
+            return REPLICA_DATABASE
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replica rows are copies of primary rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica receives its schema through replication
+        return db != REPLICA_DATABASE
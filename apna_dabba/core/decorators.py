@@ -1,44 +1,68 @@
 """
 Custom decorators for role-based access control.
+
+Both decorators accept sync and async views. With
+core.middleware.UserSnapshotMiddleware installed, the user they check comes
+from a cached snapshot, so a role check costs no query.
 """
 from functools import wraps
+from asgiref.sync import iscoroutinefunction
 from django.shortcuts import redirect
 from django.contrib import messages
 
 
+def _role_required(view_func, check):
+    """
+    Wrap view_func so check(request, user) runs first; a non-None result
+    (a redirect) is returned instead of calling the view.
+    """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            denied = check(request, await request.auser())
+            if denied is not None:
+                return denied
+            return await view_func(request, *args, **kwargs)
+    else:
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            denied = check(request, request.user)
+            if denied is not None:
+                return denied
+            return view_func(request, *args, **kwargs)
+
+    return _wrapped_view
+
+
+def _check_owner(request, user):
+    if not user.is_authenticated:
+        messages.error(request, "Please login to access this page.")
+        return redirect('login')
+
+    if not user.is_staff:
+        messages.error(request, "Access denied. Owner privileges required.")
+        return redirect('home')
+
+
+def _check_customer(request, user):
+    if not user.is_authenticated:
+        messages.error(request, "Please login to access this page.")
+        return redirect('login')
+
+    if user.is_staff:
+        messages.error(request, "Access denied. Customer access only.")
+        return redirect('owner_dashboard')
+
+
 def owner_required(view_func):
     """
     Decorator to ensure only owners (is_staff=True) can access a view.
     """
-    @wraps(view_func)
-    def _wrapped_view(request, *args, **kwargs):
-        if not request.user.is_authenticated:
-            messages.error(request, "Please login to access this page.")
-            return redirect('login')
-        
-        if not request.user.is_staff:
-            messages.error(request, "Access denied. Owner privileges required.")
-            return redirect('home')
-        
-        return view_func(request, *args, **kwargs)
-    
-    return _wrapped_view
+    return _role_required(view_func, _check_owner)
 
 
 def customer_required(view_func):
     """
     Decorator to ensure only customers (is_staff=False) can access a view.
     """
-    @wraps(view_func)
-    def _wrapped_view(request, *args, **kwargs):
-        if not request.user.is_authenticated:
-            messages.error(request, "Please login to access this page.")
-            return redirect('login')
-        
-        if request.user.is_staff:
-            messages.error(request, "Access denied. Customer access only.")
-            return redirect('owner_dashboard')
-        
-        return view_func(request, *args, **kwargs)
-    
-    return _wrapped_view
+    return _role_required(view_func, _check_customer)
@@ -0,0 +1,193 @@
+"""
+Streaming CSV / JSON Lines exports for owners.
+
+Rows are read with values_list() projections through
+QuerySet.iterator(chunk_size=EXPORT_CHUNK_SIZE) and sent by a
+StreamingHttpResponse EXPORT_CHUNK_SIZE rows at a time, so memory use does
+not depend on the size of the export. Under ASGI the response is an async
+iterator fetching each chunk in a worker thread.
+"""
+import csv
+import io
+import json
+from datetime import timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import CustomerSubscription, DailyMealTracking, MonthlyMealRollup
+from .utils import MEAL_HISTORY_CODES
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+SUBSCRIBER_COLUMNS = (
+    'customer', 'email', 'menu', 'plan', 'start_date', 'end_date', 'days_remaining', 'status',
+)
+MEAL_HISTORY_COLUMNS = ('date', 'customer', 'menu', 'subscription_id', 'status')
+
+
+def _iter_rows(sources):
+    for queryset, expand in sources:
+        for values in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield from expand(values)
+
+
+def _next_chunk(values_iterator):
+    return list(islice(values_iterator, EXPORT_CHUNK_SIZE))
+
+
+async def _aiter_rows(sources):
+    # What QuerySet.aiterator() does, except that aiterator() runs a
+    # values_list() query on the event loop (SynchronousOnlyOperation);
+    # here the query starts in the worker thread fetching the first chunk
+    for queryset, expand in sources:
+        values_iterator = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        while True:
+            chunk = await sync_to_async(_next_chunk)(values_iterator)
+            for values in chunk:
+                for row in expand(values):
+                    yield row
+            if len(chunk) < EXPORT_CHUNK_SIZE:
+                break
+
+
+class ExportRows:
+    """
+    Rows of an export, read from (queryset, expand) sources in order;
+    expand(values) yields the export rows of one values_list() row.
+
+    Iterable synchronously and, for ASGI responses, asynchronously.
+    """
+    def __init__(self, *sources):
+        self.sources = sources
+
+    def __iter__(self):
+        return _iter_rows(self.sources)
+
+    def __aiter__(self):
+        return _aiter_rows(self.sources)
+
+
+def subscriber_rows(owner):
+    """All of owner's subscriptions, newest first."""
+    today = timezone.localdate()
+    now = timezone.now()
+    queryset = CustomerSubscription.objects.filter(
+        menu__tiffin_service__owner=owner
+    ).order_by('-created_at', '-id').values_list(
+        'customer__username', 'customer__email', 'menu__title', 'subscription__title',
+        'start_date', 'end_date', 'is_active',
+    )
+
+    def expand(values):
+        username, email, menu, plan, start_date, end_date, is_active = values
+        expired = not is_active or end_date < now
+        yield (
+            username, email, menu, plan,
+            timezone.localtime(start_date).date().isoformat(),
+            timezone.localtime(end_date).date().isoformat(),
+            0 if expired else max(0, (timezone.localtime(end_date).date() - today).days),
+            'Expired' if expired else 'Active',
+        )
+
+    return ExportRows((queryset, expand))
+
+
+def meal_history_rows(owner, start_date, end_date):
+    """
+    owner's meal tracking between the dates (inclusive): days from archived
+    months (MonthlyMealRollup) first, then the hot DailyMealTracking rows.
+    """
+    statuses = {code: status for status, code in MEAL_HISTORY_CODES.items()}
+    rollups = MonthlyMealRollup.objects.filter(
+        subscription__menu__tiffin_service__owner=owner,
+        month__range=(start_date.replace(day=1), end_date),
+    ).order_by('month', 'subscription_id').values_list(
+        'month', 'subscription__customer__username', 'subscription__menu__title', 'subscription_id', 'history',
+    )
+
+    def expand_rollup(values):
+        month, username, menu, subscription_id, history = values
+        for offset, code in enumerate(history):
+            day = month + timedelta(days=offset)
+            if code in statuses and start_date <= day <= end_date:
+                yield day.isoformat(), username, menu, subscription_id, statuses[code]
+
+    tracking = DailyMealTracking.objects.filter(
+        subscription__menu__tiffin_service__owner=owner,
+        date__range=(start_date, end_date),
+    ).order_by('date', 'subscription_id').values_list(
+        'date', 'subscription__customer__username', 'subscription__menu__title', 'subscription_id', 'status',
+    )
+
+    def expand_tracking(values):
+        day, username, menu, subscription_id, status = values
+        yield day.isoformat(), username, menu, subscription_id, status
+
+    return ExportRows((rollups, expand_rollup), (tracking, expand_tracking))
+
+
+def _csv_text(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _jsonl_text(columns, rows):
+    return ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+
+def _format_chunk(export_format, columns, rows):
+    return _jsonl_text(columns, rows) if export_format == 'jsonl' else _csv_text(rows)
+
+
+def stream_export(columns, rows, export_format='csv'):
+    """The export as text, yielded EXPORT_CHUNK_SIZE rows at a time."""
+    if export_format == 'csv':
+        yield _csv_text([columns])
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield _format_chunk(export_format, columns, chunk)
+            chunk = []
+    if chunk:
+        yield _format_chunk(export_format, columns, chunk)
+
+
+async def astream_export(columns, rows, export_format='csv'):
+    """Async stream_export() over an async iterable of rows."""
+    if export_format == 'csv':
+        yield _csv_text([columns])
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield _format_chunk(export_format, columns, chunk)
+            chunk = []
+    if chunk:
+        yield _format_chunk(export_format, columns, chunk)
+
+
+def export_response(request, filename, columns, rows, export_format='csv'):
+    """
+    StreamingHttpResponse that downloads rows (ExportRows) as
+    filename.<format>.
+
+    Under ASGI the response streams from an async iterator; Django would
+    otherwise collect a synchronous one into a list before sending it.
+    """
+    if isinstance(request, ASGIRequest):
+        content = astream_export(columns, rows, export_format)
+    else:
+        content = stream_export(columns, rows, export_format)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -0,0 +1,84 @@
+"""
+Payment gateway backends, selected with the PAYMENT_GATEWAY setting.
+
+A backend has one method, charge(amount, reference), returning the
+gateway's transaction reference. It raises PaymentDeclined for a final
+refusal (bad card, insufficient funds) and GatewayError for a transient
+failure worth retrying (timeout, 5xx). `reference` is our idempotency key,
+so a gateway that supports idempotent requests never charges twice.
+
+LocalGatewayEmulator stands in for a real gateway so the whole payment
+pipeline can be run and load-tested offline.
+"""
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class GatewayError(Exception):
+    """Transient gateway failure; the charge may be retried."""
+
+
+class PaymentDeclined(Exception):
+    """The gateway refused the payment; retrying will not help."""
+
+
+class LocalGatewayEmulator:
+    """
+    Offline gateway: sleeps for `latency` seconds (± `jitter`), fails with
+    GatewayError at `failure_rate` and declines at `decline_rate`.
+
+    Charges are remembered per reference, like a real gateway's idempotent
+    requests, so a retried charge returns the original transaction.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, failure_rate=0.0, decline_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self._random = random.Random(seed)
+        self._charges = {}
+
+    def charge(self, amount, reference):
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if reference in self._charges:
+            return self._charges[reference]
+
+        roll = self._random.random()
+        if roll < self.failure_rate:
+            raise GatewayError("Gateway timed out")
+        if roll < self.failure_rate + self.decline_rate:
+            raise PaymentDeclined("Card declined")
+
+        transaction_id = f"emu_{uuid.uuid4().hex[:20]}"
+        self._charges[reference] = transaction_id
+        return transaction_id
+
+
+_gateway = None
+
+
+def get_gateway():
+    """The configured gateway backend (one instance per process)."""
+    global _gateway
+    if _gateway is None:
+        config = getattr(settings, 'PAYMENT_GATEWAY', {})
+        backend = import_string(config.get('BACKEND', 'core.gateway.LocalGatewayEmulator'))
+        _gateway = backend(**config.get('OPTIONS', {}))
+    return _gateway
+
+
+@receiver(setting_changed)
+def _reset_gateway(setting, **kwargs):
+    global _gateway
+    if setting == 'PAYMENT_GATEWAY':
+        _gateway = None
@@ -0,0 +1,157 @@
+"""
+Upload-time image derivatives for Menu.image and DailyMenu.image.
+
+For every original, resized JPEG and WebP variants are written next to it
+(e.g. menu_images/pra.jpg -> menu_images/pra__w400.webp). Generation runs on
+a small thread pool after the upload transaction commits, so requests never
+wait on Pillow; `manage.py generate_image_derivatives` backfills old images.
+
+Which derivatives exist is recorded in the cache when they are generated,
+so rendering an image needs no storage.exists() calls.
+"""
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Card images render ~350px wide; 800 covers 2x displays
+DERIVATIVE_WIDTHS = (400, 800)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 75, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+# Seconds an incomplete set of derivatives is cached before storage is checked again
+PENDING_DERIVATIVES_TIMEOUT = 60
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-derivatives')
+
+
+def derivative_name(name, width, extension):
+    """Storage name of one derivative of the original `name`."""
+    stem, _ = posixpath.splitext(name)
+    return f"{stem}__w{width}.{extension}"
+
+
+def derivative_names(name):
+    """All derivative names of an original: {(width, extension): name}."""
+    return {
+        (width, extension): derivative_name(name, width, extension)
+        for width in DERIVATIVE_WIDTHS
+        for extension in DERIVATIVE_FORMATS
+    }
+
+
+def _available_key(name):
+    return f"image-derivatives:{hashlib.md5(name.encode()).hexdigest()}"
+
+
+def record_available(name, available):
+    """Cache the (width, extension) derivatives of `name` that exist."""
+    complete = len(available) == len(DERIVATIVE_WIDTHS) * len(DERIVATIVE_FORMATS)
+    cache.set(_available_key(name), sorted(available), None if complete else PENDING_DERIVATIVES_TIMEOUT)
+
+
+def available_derivatives(name, storage=default_storage):
+    """
+    (width, extension) pairs of the derivatives of `name` that exist, from
+    the cache; storage is only checked for images not recorded yet.
+    """
+    available = cache.get(_available_key(name))
+    if available is None:
+        available = [key for key, target in derivative_names(name).items() if storage.exists(target)]
+        record_available(name, available)
+    return {tuple(key) for key in available}
+
+
+def generate_derivatives(name, force=False, storage=default_storage):
+    """
+    Write all missing derivatives of the original image `name` and record
+    them as available.
+
+    Returns the list of storage names written.
+    """
+    targets = {
+        key: target for key, target in derivative_names(name).items()
+        if force or not storage.exists(target)
+    }
+    if not targets:
+        record_available(name, derivative_names(name))
+        return []
+
+    with storage.open(name, 'rb') as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    written = []
+    for (width, extension), target in targets.items():
+        resized = image
+        if image.width > width:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+        pil_format, options = DERIVATIVE_FORMATS[extension]
+        buffer = BytesIO()
+        resized.save(buffer, pil_format, **options)
+
+        if storage.exists(target):
+            storage.delete(target)
+        written.append(storage.save(target, ContentFile(buffer.getvalue())))
+
+    record_available(name, derivative_names(name))
+    return written
+
+
+def _generate_safely(name):
+    try:
+        generate_derivatives(name)
+    except Exception:
+        logger.exception("Failed to generate image derivatives for %s", name)
+
+
+def schedule_derivatives(name):
+    """
+    Generate derivatives off the request thread once the current transaction
+    commits (synchronously if IMAGE_DERIVATIVES_ASYNC is False).
+    """
+    if not name:
+        return
+
+    if getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True):
+        transaction.on_commit(lambda: _executor.submit(_generate_safely, name))
+    else:
+        transaction.on_commit(lambda: _generate_safely(name))
+
+
+def responsive_sources(image_field):
+    """
+    srcset strings for an ImageField's derivatives that exist (see
+    available_derivatives()).
+
+    Returns dict with webp/jpg srcset strings (empty if not generated yet).
+    """
+    sources = {'webp': '', 'jpg': ''}
+    if not image_field:
+        return sources
+
+    available = available_derivatives(image_field.name, image_field.storage)
+    for extension in DERIVATIVE_FORMATS:
+        candidates = []
+        for width in DERIVATIVE_WIDTHS:
+            if (width, extension) in available:
+                target = derivative_name(image_field.name, width, extension)
+                candidates.append(f"{image_field.storage.url(target)} {width}w")
+        sources[extension] = ', '.join(candidates)
+
+    return sources
@@ -0,0 +1,22 @@
+"""
+Fold old DailyMealTracking rows into MonthlyMealRollup (see core.meal_archive).
+"""
+from django.core.management.base import BaseCommand
+
+from core.meal_archive import ARCHIVE_CHUNK_SIZE, archive_cutoff, archive_meal_tracking, get_hot_months
+
+
+class Command(BaseCommand):
+    help = "Archive meal tracking rows older than MEAL_TRACKING_HOT_MONTHS into monthly rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=None, help="Whole months to keep (default: MEAL_TRACKING_HOT_MONTHS).")
+        parser.add_argument('--chunk-size', type=int, default=ARCHIVE_CHUNK_SIZE, help="Rows per transaction.")
+
+    def handle(self, *args, **options):
+        months = options['months'] if options['months'] is not None else get_hot_months()
+        cutoff = archive_cutoff(hot_months=months)
+        archived = archive_meal_tracking(cutoff, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} meal tracking row(s) dated before {cutoff:%Y-%m-%d}."
+        ))
@@ -0,0 +1,85 @@
+"""
+Count the queries of authenticated page views per session engine, with and
+without the cached user snapshot (core.user_snapshot), and emit JSON.
+
+For each configuration an owner and a customer log in, each page is
+requested twice to warm the caches, and the third request is measured.
+"django_session/auth_user" counts the queries that only load the session
+and the user. A file-based cache stands in for the shared cache both need.
+"""
+import json
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.benchmarks import benchmark_database, seed_subscriptions
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+PAGES = {
+    'owner': ['owner_dashboard', 'kitchen_manifest', 'select_menu_for_subscription'],
+    'customer': ['menu', 'customer_dashboard'],
+}
+SNAPSHOT_MIDDLEWARE = 'core.middleware.UserSnapshotMiddleware'
+
+
+def is_auth_query(sql):
+    return 'django_session' in sql or ('FROM "auth_user"' in sql and '"auth_user"."id" =' in sql)
+
+
+class Command(BaseCommand):
+    help = "Count DB queries per authenticated request for each session mode, with and without the user snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=200)
+
+    def handle(self, *args, **options):
+        results = {}
+        # The snapshot and cached_db sessions need a cache shared between
+        # workers; a file-based one stands in for Redis/Memcached here
+        with tempfile.TemporaryDirectory() as cache_dir, benchmark_database(), override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir}},
+            USER_SNAPSHOT=True,
+        ):
+            menus = seed_subscriptions(owners=2, menus_per_owner=3, customers=options['customers'])
+            owner = menus[0].tiffin_service.owner
+            customer = User.objects.filter(customer_subscriptions__menu__tiffin_service__owner=owner).first()
+            for user in (owner, customer):
+                user.set_password('bench')
+                user.save()
+
+            without_snapshot = [name for name in settings.MIDDLEWARE if name != SNAPSHOT_MIDDLEWARE]
+            for mode, engine in SESSION_ENGINES.items():
+                for snapshot, middleware in (('off', without_snapshot), ('on', settings.MIDDLEWARE)):
+                    with override_settings(SESSION_ENGINE=engine, MIDDLEWARE=middleware, ALLOWED_HOSTS=['*']):
+                        cache.clear()
+                        results[f'{mode}, snapshot {snapshot}'] = self.measure(owner, customer)
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def measure(self, owner, customer):
+        counts = {}
+        for role, user in (('owner', owner), ('customer', customer)):
+            client = Client()
+            client.login(username=user.username, password='bench')
+            for name in PAGES[role]:
+                url = reverse(name)
+                client.get(url)
+                client.get(url)
+                with CaptureQueriesContext(connection) as queries:
+                    client.get(url)
+                counts[name] = {
+                    'queries': len(queries),
+                    'django_session/auth_user': sum(is_auth_query(query['sql']) for query in queries),
+                }
+        return counts
@@ -0,0 +1,122 @@
+"""
+Concurrent read/write load test of the database profiles (DB_PROFILE).
+
+Each profile runs in its own process (settings are read once at start-up)
+against a fresh, file-backed test database, with reader threads browsing
+the catalogue and writer threads recording skipped meals.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+
+from apna_dabba.db_profiles import PROFILES
+from core.benchmarks import benchmark_database, seed_subscriptions, concurrent_load
+from core.models import Menu, CustomerSubscription, DailyMealTracking
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent read/write throughput of the sqlite, sqlite-tuned and postgres profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles', default='sqlite,sqlite-tuned',
+            help="Comma-separated profiles to compare (postgres needs POSTGRES_* set).",
+        )
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per profile.")
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--run', action='store_true', help="Internal: benchmark the current profile.")
+
+    def handle(self, *args, **options):
+        if options['run']:
+            self.stdout.write(json.dumps(self.run_current(options)))
+            return
+
+        profiles = [p.strip() for p in options['profiles'].split(',') if p.strip()]
+        unknown = set(profiles) - set(PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profile(s): {', '.join(sorted(unknown))}")
+
+        self.stdout.write(
+            f"{options['readers']} readers / {options['writers']} writers, "
+            f"{options['duration']:.0f}s per profile\n"
+        )
+        self.stdout.write(
+            f"{'profile':>14} {'reads/s':>9} {'p95 ms':>8} {'writes/s':>9} {'p95 ms':>8} "
+            f"{'locked':>7} {'errors':>7}"
+        )
+        for profile in profiles:
+            result = self.run_profile(profile, options)
+            if result is None:
+                continue
+            reads, writes = result['reads'], result['writes']
+            self.stdout.write(
+                f"{profile:>14} {reads['ops_per_sec']:9.1f} {reads['p95_ms']:8.1f} "
+                f"{writes['ops_per_sec']:9.1f} {writes['p95_ms']:8.1f} "
+                f"{reads['lock_errors'] + writes['lock_errors']:7d} {reads['errors'] + writes['errors']:7d}"
+            )
+
+    def run_profile(self, profile, options):
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_db_profiles', '--run',
+            '--readers', str(options['readers']), '--writers', str(options['writers']),
+            '--duration', str(options['duration']), '--customers', str(options['customers']),
+        ]
+        env = dict(os.environ, DB_PROFILE=profile)
+        process = subprocess.run(command, env=env, capture_output=True, text=True)
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1:] or ['failed']
+            self.stdout.write(self.style.ERROR(f"{profile:>14} skipped: {error[0]}"))
+            return None
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def run_current(self, options):
+        with tempfile.TemporaryDirectory() as directory:
+            test_name = os.path.join(directory, 'bench.sqlite3') if connection.vendor == 'sqlite' else None
+            with benchmark_database(test_name):
+                seed_subscriptions(customers=options['customers'])
+                subscription_ids = list(CustomerSubscription.objects.values_list('id', flat=True))
+                customer_ids = list(CustomerSubscription.objects.values_list('customer_id', flat=True))
+                return concurrent_load(
+                    self.reader(customer_ids), self.writer(subscription_ids),
+                    readers=options['readers'], writers=options['writers'], duration=options['duration'],
+                )
+
+    @staticmethod
+    def reader(customer_ids):
+        """A catalogue page plus a customer's own subscriptions."""
+        def read(i):
+            list(Menu.objects.select_related('tiffin_service').order_by('-created_at')[:20])
+            list(CustomerSubscription.objects.active().filter(
+                customer_id=customer_ids[i % len(customer_ids)]
+            ).select_related('menu', 'subscription'))
+        return read
+
+    @staticmethod
+    def writer(subscription_ids):
+        """Record a skipped meal and extend the subscription (read, then write)."""
+        today = date.today()
+
+        def write(i):
+            subscription_id = subscription_ids[i % len(subscription_ids)]
+            with transaction.atomic():
+                subscription = CustomerSubscription.objects.get(pk=subscription_id)
+                DailyMealTracking.objects.bulk_create([DailyMealTracking(
+                    subscription=subscription,
+                    date=today - timedelta(days=i // len(subscription_ids)),
+                    status='Skipped',
+                    taken=False,
+                )])
+                CustomerSubscription.objects.filter(pk=subscription_id).update(
+                    end_date=F('end_date') + timedelta(days=1)
+                )
+        return write
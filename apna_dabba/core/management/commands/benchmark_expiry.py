@@ -0,0 +1,28 @@
+"""
+Benchmark request throughput with per-request vs throttled subscription expiry.
+"""
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from core.benchmarks import benchmark_database, seed_subscriptions, requests_per_second
+
+
+class Command(BaseCommand):
+    help = "Compare requests/sec of SubscriptionExpiryMiddleware with and without throttling."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscriptions', type=int, default=5000)
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--path', default='/reviews/')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_subscriptions(customers=options['subscriptions'], expired_ratio=0.01)
+
+            # Interval 0 reproduces the old "UPDATE on every request" behaviour
+            for label, interval in (('per-request', 0), ('throttled', 300)):
+                with override_settings(SUBSCRIPTION_EXPIRY_INTERVAL=interval):
+                    client = Client()
+                    client.get(options['path'])  # Warm up
+                    rate = requests_per_second(client, options['path'], options['requests'])
+                self.stdout.write(f"{label:>12}: {rate:8.1f} req/s")
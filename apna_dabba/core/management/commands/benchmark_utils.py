@@ -0,0 +1,144 @@
+"""
+Microbenchmarks for the core.utils business functions.
+
+Seeds a realistic dataset into a throwaway database, times each function and
+counts its queries, and emits JSON. Pass --compare with a previous run's JSON
+to fail on regressions before deploying.
+"""
+import json
+import statistics
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.benchmarks import benchmark_database, seed_subscriptions, seed_meal_tracking, measure
+from core.models import CustomerSubscription, Subscription
+from core.utils import (
+    deactivate_expired_subscriptions,
+    handle_payment_success,
+    handle_skip_extension,
+    calculate_owner_revenue,
+    get_customer_dashboard_stats,
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark core.utils functions on a seeded dataset and print JSON results."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owners', type=int, default=20)
+        parser.add_argument('--menus-per-owner', type=int, default=5)
+        parser.add_argument('--customers', type=int, default=20000)
+        parser.add_argument('--tracking-days', type=int, default=15)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help="Write the JSON results to this file.")
+        parser.add_argument('--compare', help="Baseline JSON file to check for regressions.")
+        parser.add_argument(
+            '--threshold', type=float, default=0.25,
+            help="Allowed relative slowdown of mean time vs the baseline (default 0.25).",
+        )
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            menus = seed_subscriptions(
+                owners=options['owners'],
+                menus_per_owner=options['menus_per_owner'],
+                customers=options['customers'],
+            )
+            tracking_rows = seed_meal_tracking(days=options['tracking_days'])
+            results = self.run_benchmarks(menus, options['repeat'])
+
+        report = {
+            'dataset': {
+                'owners': options['owners'],
+                'menus': len(menus),
+                'customer_subscriptions': options['customers'],
+                'daily_meal_tracking': tracking_rows,
+            },
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    def run_benchmarks(self, menus, repeat):
+        owner = menus[0].tiffin_service.owner
+        plans = list(Subscription.objects.all())
+        subscriptions = list(
+            CustomerSubscription.objects.filter(is_active=True).select_related('subscription', 'menu')[:repeat]
+        )
+        customer = subscriptions[0].customer
+        today = date.today()
+        # 1% of the seeded subscriptions expire per run
+        expiry_batch = max(1, CustomerSubscription.objects.count() // 100)
+
+        def expire():
+            # Not timed: make 1% of subscriptions due for expiry again
+            due = CustomerSubscription.objects.filter(is_active=True).values_list('id', flat=True)
+            due = list(due[:expiry_batch])
+            CustomerSubscription.objects.filter(id__in=due).update(end_date=timezone.now() - timedelta(days=1))
+            return deactivate_expired_subscriptions
+
+        new_customers = iter(User.objects.bulk_create([
+            User(username=f'bench_payment_{i}') for i in range(repeat)
+        ]))
+        skip_targets = iter(subscriptions)
+
+        # Expiry runs last: it deactivates the active subscriptions the other
+        # cases reuse
+        cases = {
+            'handle_payment_success': lambda: (
+                lambda c=next(new_customers): handle_payment_success(c, plans[c.pk % len(plans)])
+            ),
+            'handle_skip_extension': lambda: (
+                lambda s=next(skip_targets): handle_skip_extension(s, today)
+            ),
+            'calculate_owner_revenue': lambda: (lambda: calculate_owner_revenue(owner)),
+            'get_customer_dashboard_stats': lambda: (
+                lambda: list(get_customer_dashboard_stats(customer)['active_subscriptions'])
+            ),
+            'deactivate_expired_subscriptions': expire,
+        }
+
+        results = {}
+        for name, prepare in cases.items():
+            timings = []
+            query_counts = []
+            for _ in range(repeat):
+                elapsed, queries = measure(prepare())
+                timings.append(elapsed)
+                query_counts.append(queries)
+            results[name] = {
+                'mean_ms': round(statistics.mean(timings), 3),
+                'median_ms': round(statistics.median(timings), 3),
+                'min_ms': round(min(timings), 3),
+                'max_ms': round(max(timings), 3),
+                'queries': max(query_counts),
+            }
+        return results
+
+    def compare(self, results, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)['results']
+
+        regressions = []
+        for name, result in results.items():
+            previous = baseline.get(name)
+            if not previous:
+                continue
+            if result['mean_ms'] > previous['mean_ms'] * (1 + threshold):
+                regressions.append(f"{name}: {previous['mean_ms']} ms -> {result['mean_ms']} ms")
+            if result['queries'] > previous['queries']:
+                regressions.append(f"{name}: {previous['queries']} -> {result['queries']} queries")
+
+        if regressions:
+            raise CommandError("Benchmark regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline."))
@@ -0,0 +1,43 @@
+"""
+Deactivate expired subscriptions (cron job or long-running scheduler).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import metrics
+from core.utils import deactivate_expired_subscriptions, run_expiry_if_due, get_expiry_interval
+
+
+class Command(BaseCommand):
+    help = "Deactivate subscriptions whose end_date has passed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Run now, ignoring the shared last-run marker.",
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help="Keep running, checking once per SUBSCRIPTION_EXPIRY_INTERVAL.",
+        )
+
+    def handle(self, *args, **options):
+        if options['force']:
+            expired = deactivate_expired_subscriptions()
+            metrics.flush()
+            self.stdout.write(self.style.SUCCESS(f"Expired {expired} subscription(s)."))
+            return
+
+        interval = get_expiry_interval()
+        while True:
+            expired = run_expiry_if_due(interval=interval)
+            if expired is None:
+                self.stdout.write("Expiry not due yet (already run by another worker).")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Expired {expired} subscription(s)."))
+
+            metrics.flush()
+            if not options['loop']:
+                break
+            time.sleep(interval)
@@ -0,0 +1,41 @@
+"""
+Backfill thumbnail/WebP derivatives for existing menu images.
+"""
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from core.images import generate_derivatives, derivative_name, DERIVATIVE_WIDTHS
+from core.models import Menu, DailyMenu
+
+
+class Command(BaseCommand):
+    help = "Generate missing image derivatives for Menu.image and DailyMenu.image."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate existing derivatives.")
+
+    def handle(self, *args, **options):
+        names = set(Menu.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True))
+        names |= set(DailyMenu.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True))
+
+        original_bytes = card_bytes = written = 0
+        for name in sorted(names):
+            if not default_storage.exists(name):
+                self.stderr.write(f"Missing original: {name}")
+                continue
+            try:
+                written += len(generate_derivatives(name, force=options['force']))
+            except Exception as exc:
+                self.stderr.write(f"Failed {name}: {exc}")
+                continue
+
+            # Bytes a card downloads: original vs the smallest WebP derivative
+            original_bytes += default_storage.size(name)
+            card_bytes += default_storage.size(derivative_name(name, DERIVATIVE_WIDTHS[0], 'webp'))
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} derivative(s) for {len(names)} image(s)."))
+        if original_bytes:
+            self.stdout.write(
+                f"Image bytes per page: {original_bytes / 1024:.0f} KiB originals -> "
+                f"{card_bytes / 1024:.0f} KiB WebP ({100 * card_bytes / original_bytes:.0f}%)"
+            )
@@ -0,0 +1,45 @@
+"""
+Import an owner's existing customers and subscriptions from a CSV file
+(see core.subscription_import for the columns).
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.subscription_import import IMPORT_BATCH_SIZE, import_subscriptions
+
+
+class Command(BaseCommand):
+    help = "Bulk-import customers and subscriptions for an owner from CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('owner', help="Username of the owner whose menus the rows refer to.")
+        parser.add_argument('csv_file')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Validate and report without writing.")
+        parser.add_argument('--max-errors', type=int, default=50, help="Errors to print (all are counted).")
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'], is_staff=True)
+        except User.DoesNotExist:
+            raise CommandError(f"No owner named '{options['owner']}'.")
+
+        try:
+            with open(options['csv_file'], newline='', encoding='utf-8-sig') as csv_file:
+                result = import_subscriptions(
+                    owner, csv_file, batch_size=options['batch_size'], dry_run=options['dry_run']
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for line, message in result['errors'][:options['max_errors']]:
+            self.stdout.write(self.style.ERROR(f"line {line}: {message}"))
+        if len(result['errors']) > options['max_errors']:
+            self.stdout.write(f"... and {len(result['errors']) - options['max_errors']} more error(s)")
+
+        verb = "Would import" if options['dry_run'] else "Imported"
+        self.stdout.write(
+            f"{verb} {result['created_subscriptions']} subscription(s) and "
+            f"{result['created_customers']} new customer(s) from {result['rows']} row(s); "
+            f"{len(result['errors'])} error(s)."
+        )
@@ -0,0 +1,51 @@
+"""
+Print the kitchen production manifest (see core.manifest) for one owner or
+for every owner on the platform.
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.manifest import build_manifest, parse_day
+
+
+class Command(BaseCommand):
+    help = "Tiffins to cook per menu and plan on a date, net of recorded skips."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="YYYY-MM-DD (default: today).")
+        parser.add_argument('--owner', help="Owner username (default: all owners).")
+        parser.add_argument('--json', action='store_true', help="Print JSON instead of a table.")
+
+    def handle(self, *args, **options):
+        day = parse_day(options['date']) if options['date'] else timezone.localdate()
+        if day is None:
+            raise CommandError(f"Invalid --date '{options['date']}'; use YYYY-MM-DD.")
+
+        owner = None
+        if options['owner']:
+            owner = User.objects.filter(username=options['owner'], is_staff=True).first()
+            if owner is None:
+                raise CommandError(f"No owner named '{options['owner']}'.")
+
+        kitchens = build_manifest(day, owner)
+        if options['json']:
+            self.stdout.write(json.dumps({'date': day.isoformat(), 'kitchens': kitchens}, indent=2))
+            return
+
+        self.stdout.write(f"Kitchen manifest for {day:%A %Y-%m-%d}")
+        if not kitchens:
+            self.stdout.write("No active subscriptions on this day.")
+        for kitchen in kitchens:
+            self.stdout.write(f"\n{kitchen['service']}: {kitchen['to_cook']} to cook")
+            for menu in kitchen['menus']:
+                self.stdout.write(
+                    f"  {menu['title']}: {menu['to_cook']} to cook "
+                    f"({menu['subscribers']} subscribed, {menu['skipped']} skipped)"
+                )
+                if menu['dish']:
+                    self.stdout.write(f"    Dish: {menu['dish']}")
+                for plan in menu['plans']:
+                    self.stdout.write(f"    {plan['title']}: {plan['to_cook']} ({plan['skipped']} skipped)")
@@ -0,0 +1,153 @@
+"""
+Offline load test of the asynchronous payment pipeline.
+
+Against a fresh file-backed test database, customers submit payments
+(creating PaymentIntents, as payment_page does, with some double-submits)
+while worker threads drain the queue through the local gateway emulator.
+Reports submit latency, time to confirmation and outcomes, and checks that
+every customer ends with exactly one active subscription per paid intent.
+"""
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from core.benchmarks import benchmark_database, seed_subscriptions
+from core.models import CustomerSubscription, PaymentIntent, Subscription
+from core.payments import create_payment_intent, run_worker_once
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Load-test payment intents and workers against the local gateway emulator."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--latency', type=float, default=0.05, help="Emulated gateway latency (seconds).")
+        parser.add_argument('--failure-rate', type=float, default=0.1, help="Share of transient gateway errors.")
+        parser.add_argument('--decline-rate', type=float, default=0.02)
+        parser.add_argument('--double-submit-rate', type=float, default=0.2, help="Share of payments submitted twice.")
+        parser.add_argument('--timeout', type=float, default=120.0)
+
+    def handle(self, *args, **options):
+        gateway = {
+            'BACKEND': 'core.gateway.LocalGatewayEmulator',
+            'OPTIONS': {
+                'latency': options['latency'],
+                'jitter': options['latency'] / 2,
+                'failure_rate': options['failure_rate'],
+                'decline_rate': options['decline_rate'],
+            },
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            test_name = os.path.join(directory, 'payments.sqlite3') if connection.vendor == 'sqlite' else None
+            with benchmark_database(test_name), override_settings(
+                PAYMENT_GATEWAY=gateway, PAYMENT_RETRY_BACKOFF=0.05,
+            ):
+                outcome = self.run(options)
+
+        submit, confirm = outcome['submit_ms'], outcome['confirm_s']
+        self.stdout.write(
+            f"{outcome['intents']} intents from {options['customers']} customers "
+            f"({outcome['double_submits']} double-submits) in {outcome['elapsed']:.1f}s"
+        )
+        self.stdout.write(
+            f"submit p50 {_percentile(submit, 0.5):.1f} ms, p95 {_percentile(submit, 0.95):.1f} ms; "
+            f"confirmed p50 {_percentile(confirm, 0.5):.2f} s, p95 {_percentile(confirm, 0.95):.2f} s"
+        )
+        self.stdout.write(', '.join(f"{count} {status}" for status, count in sorted(outcome['statuses'].items())))
+        self.stdout.write(f"{outcome['retried']} intent(s) needed a retry")
+        if outcome['problems']:
+            raise CommandError('; '.join(outcome['problems']))
+        self.stdout.write(self.style.SUCCESS("Invariants hold."))
+
+    def run(self, options):
+        seed_subscriptions(owners=1, menus_per_owner=1, customers=0)
+        plan = Subscription.objects.get()
+        customers = User.objects.bulk_create([
+            User(username=f'load_customer_{i}') for i in range(options['customers'])
+        ])
+
+        submit_ms = []
+        submitted = threading.Event()
+        errors = []
+
+        def work(n):
+            try:
+                # Keep polling until submissions end and the queue is drained
+                while not (submitted.is_set() and not PaymentIntent.objects.exclude(
+                    status__in=('succeeded', 'failed')
+                ).exists()):
+                    if not run_worker_once(f'load-worker-{n}', batch=5):
+                        time.sleep(0.01)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        started = time.monotonic()
+        workers = [threading.Thread(target=work, args=(n,)) for n in range(options['workers'])]
+        for thread in workers:
+            thread.start()
+
+        chooser = random.Random(0)
+        double_submits = 0
+        for customer in customers:
+            key = uuid.uuid4().hex
+            repeats = 2 if chooser.random() < options['double_submit_rate'] else 1
+            double_submits += repeats - 1
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                create_payment_intent(customer, plan, key)
+                submit_ms.append((time.perf_counter() - t0) * 1000)
+        submitted.set()
+
+        deadline = started + options['timeout']
+        for thread in workers:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        elapsed = time.monotonic() - started
+
+        problems = [f"{type(e).__name__}: {e}" for e in errors[:3]]
+        if any(thread.is_alive() for thread in workers):
+            problems.append("queue not drained before --timeout")
+
+        intents = list(PaymentIntent.objects.all())
+        statuses = Counter(intent.status for intent in intents)
+        if len(intents) != len(customers):
+            problems.append("double-submits created extra intents")
+
+        paid = {intent.customer_id for intent in intents if intent.status == 'succeeded'}
+        active = Counter(
+            CustomerSubscription.objects.filter(is_active=True).values_list('customer_id', flat=True)
+        )
+        if set(active) != paid or any(count != 1 for count in active.values()):
+            problems.append("active subscriptions do not match succeeded intents")
+
+        return {
+            'intents': len(intents),
+            'double_submits': double_submits,
+            'elapsed': elapsed,
+            'submit_ms': submit_ms,
+            'confirm_s': [
+                (intent.updated_at - intent.created_at).total_seconds()
+                for intent in intents if intent.is_final
+            ],
+            'statuses': statuses,
+            'retried': sum(1 for intent in intents if intent.attempts > 1),
+            'problems': problems,
+        }
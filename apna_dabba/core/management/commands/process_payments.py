@@ -0,0 +1,37 @@
+"""
+Payment worker: confirm pending PaymentIntents (see core.payments).
+
+Run one or more of these alongside the web workers, e.g.
+`python manage.py process_payments --loop`.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.payments import default_worker_id, run_worker_once
+
+
+class Command(BaseCommand):
+    help = "Charge pending payment intents and activate their subscriptions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new intents.")
+        parser.add_argument('--batch', type=int, default=10, help="Intents claimed per poll.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--worker-id', default=None)
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        while True:
+            close_old_connections()
+            outcome = run_worker_once(worker_id, batch=options['batch'])
+            if outcome:
+                summary = ', '.join(f"{count} {status}" for status, count in sorted(outcome.items()))
+                self.stdout.write(f"Processed {sum(outcome.values())} intent(s): {summary}.")
+            if not options['loop']:
+                if not outcome:
+                    self.stdout.write("No payment intents due.")
+                break
+            if not outcome:
+                time.sleep(options['poll_interval'])
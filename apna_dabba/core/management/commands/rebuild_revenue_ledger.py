@@ -0,0 +1,27 @@
+"""
+Recompute the owner revenue ledger from CustomerSubscription (reconciliation).
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.revenue import rebuild_owner_revenue, rebuild_revenue_ledger
+
+
+class Command(BaseCommand):
+    help = "Rebuild OwnerRevenueSummary / OwnerMonthlyRevenue from subscriptions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', help="Only rebuild this owner's ledger (username).")
+
+    def handle(self, *args, **options):
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError(f"Owner '{options['owner']}' does not exist.")
+            rebuild_owner_revenue(owner.pk)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt revenue ledger for {owner.username}."))
+            return
+
+        count = rebuild_revenue_ledger()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt revenue ledger for {count} owner(s)."))
@@ -0,0 +1,43 @@
+"""
+Summarise the slow-query log: top offenders by total time.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.slow_queries import get_log_path, log_files, read_entries, summarise
+
+
+class Command(BaseCommand):
+    help = "Show the slowest queries from SLOW_QUERY_LOG, grouped by call site."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', help="Log file to read (default: SLOW_QUERY_LOG).")
+        parser.add_argument('--limit', type=int, default=10, help="Number of offenders to show.")
+        parser.add_argument(
+            '--by', choices=('call_site', 'view'), default='call_site',
+            help="Group by Python call site or by view.",
+        )
+        parser.add_argument('--plans', action='store_true', help="Include each query's plan.")
+
+    def handle(self, *args, **options):
+        path = options['log'] or get_log_path()
+        if not log_files(path):
+            raise CommandError(f"No slow-query log at {path}. Is SLOW_QUERY_THRESHOLD_MS set?")
+
+        groups = summarise(read_entries(path), group_by=options['by'])
+        if not groups:
+            self.stdout.write("No slow queries recorded.")
+            return
+
+        self.stdout.write(f"Top {min(options['limit'], len(groups))} of {len(groups)} slow queries by total time:\n")
+        for rank, group in enumerate(groups[:options['limit']], start=1):
+            self.stdout.write(self.style.WARNING(
+                f"{rank}. {group['total_ms']:.1f} ms total, {group['count']} call(s), "
+                f"max {group['max_ms']:.1f} ms - {group[options['by']]}"
+            ))
+            if options['by'] == 'call_site':
+                self.stdout.write(f"   views: {', '.join(sorted(group['views']))}")
+            sql = group['sql'] if len(group['sql']) <= 300 else group['sql'][:300] + '...'
+            self.stdout.write(f"   {sql}")
+            if options['plans']:
+                for step in group['plan']:
+                    self.stdout.write(f"     plan: {step}")
@@ -0,0 +1,116 @@
+"""
+Concurrent-submission stress test for handle_payment_success.
+
+Simulates double-clicks and retries: for every customer, several threads
+submit the same payment at the same moment against a fresh file-backed
+test database, then the invariants are checked (one active subscription
+per customer and menu, retries answered with the same row, and the
+incremental revenue ledger equal to a full rebuild).
+"""
+import os
+import tempfile
+import threading
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from core.benchmarks import benchmark_database, seed_subscriptions
+from core.models import CustomerSubscription, OwnerRevenueSummary, Subscription
+from core.revenue import rebuild_owner_revenue
+from core.utils import handle_payment_success
+
+
+class Command(BaseCommand):
+    help = "Submit the same payment concurrently from many threads and verify no duplicates are created."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=20)
+        parser.add_argument('--submissions', type=int, default=8, help="Concurrent submissions per customer.")
+        parser.add_argument(
+            '--keys', choices=('same', 'distinct'), default='same',
+            help="Share one idempotency key per customer (double-click) or use one per submission.",
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            test_name = os.path.join(directory, 'stress.sqlite3') if connection.vendor == 'sqlite' else None
+            with benchmark_database(test_name):
+                outcome = self.run(options)
+        self.stdout.write(
+            f"{outcome['submissions']} submissions: {outcome['created']} created, "
+            f"{outcome['replayed']} answered from an earlier attempt, "
+            f"{outcome['rejected']} rejected as duplicates, {outcome['errors']} errors"
+        )
+        if outcome['problems']:
+            raise CommandError('; '.join(outcome['problems']))
+        self.stdout.write(self.style.SUCCESS("Invariants hold."))
+
+    def run(self, options):
+        seed_subscriptions(owners=1, menus_per_owner=1, customers=0)
+        plan = Subscription.objects.select_related('menu').get()
+        customers = User.objects.bulk_create([
+            User(username=f'stress_customer_{i}') for i in range(options['customers'])
+        ])
+
+        outcomes = Counter()
+        errors = []
+        lock = threading.Lock()
+
+        def submit(customer, key, barrier):
+            try:
+                barrier.wait()
+                result = handle_payment_success(customer, plan, idempotency_key=key)
+                with lock:
+                    outcomes[(customer.pk, result.pk if result else None)] += 1
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                connections.close_all()
+
+        for customer in customers:
+            barrier = threading.Barrier(options['submissions'])
+            threads = [
+                threading.Thread(target=submit, args=(
+                    customer,
+                    f'pay-{customer.pk}' if options['keys'] == 'same' else f'pay-{customer.pk}-{i}',
+                    barrier,
+                ))
+                for i in range(options['submissions'])
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        problems = [f"{type(e).__name__}: {e}" for e in errors[:3]]
+        per_customer = Counter(
+            CustomerSubscription.objects.filter(is_active=True, customer__in=customers).values_list('customer_id', flat=True)
+        )
+        if any(count != 1 for count in per_customer.values()) or len(per_customer) != len(customers):
+            problems.append("a customer does not have exactly one active subscription")
+
+        returned_ids = {pk for (_, pk) in outcomes if pk is not None}
+        if options['keys'] == 'same' and len(returned_ids) != len(customers):
+            problems.append("retries with the same key returned different subscriptions")
+
+        owner_id = plan.menu.tiffin_service.owner_id
+        incremental = OwnerRevenueSummary.objects.get(owner_id=owner_id)
+        rebuilt = rebuild_owner_revenue(owner_id)
+        if (incremental.total_revenue, incremental.active_subscriptions, incremental.active_subscribers) != (
+            rebuilt.total_revenue, rebuilt.active_subscriptions, rebuilt.active_subscribers
+        ):
+            problems.append("revenue ledger drifted from a full rebuild")
+
+        submitted = sum(outcomes.values())
+        successes = sum(count for (_, pk), count in outcomes.items() if pk is not None)
+        return {
+            'submissions': submitted + len(errors),
+            'created': len(returned_ids),
+            'replayed': successes - len(returned_ids),
+            'rejected': submitted - successes,
+            'errors': len(errors),
+            'problems': problems,
+        }
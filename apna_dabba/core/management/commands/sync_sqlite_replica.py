@@ -0,0 +1,30 @@
+"""
+Keep the local SQLite read replica in sync with the primary (replication stand-in).
+"""
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from core.replication import sqlite_replica_paths, sync_sqlite_replica
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database onto REPLICA_SQLITE_PATH."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep syncing every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Replication lag to simulate.")
+
+    def handle(self, *args, **options):
+        try:
+            primary, replica = sqlite_replica_paths()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        while True:
+            pages = sync_sqlite_replica(primary, replica)
+            self.stdout.write(f"Synced {pages} page(s) to {replica}.")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,105 @@
+"""
+Daily kitchen production manifest: how many tiffins of each menu and plan
+to cook on a date, net of meals already marked Skipped.
+
+The counts come from one grouped aggregate over CustomerSubscription. The
+date's DailyMealTracking row is joined through a FilteredRelation, so the
+join condition itself carries the date (at most one row per subscription,
+found through the (subscription, date) unique index) instead of joining a
+subscription's whole history. The day's dishes come from the cached week
+plans (core.week_plan), so they cost no query once cached.
+"""
+from datetime import date, datetime, time
+
+from django.db.models import Count, F, FilteredRelation, Q
+from django.utils import timezone
+
+from .models import CustomerSubscription
+from .week_plan import WEEKDAYS, get_week_plans
+
+
+def parse_day(value):
+    """
+    A YYYY-MM-DD manifest date, or None if it is invalid or the first or
+    last date of the calendar (which have no previous/next day).
+    """
+    try:
+        day = date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return day if date.min < day < date.max else None
+
+
+def manifest_rows(day, owner=None):
+    """
+    The grouped aggregate: one row per (menu, plan) with the subscriptions
+    running on day and how many of them skipped it. owner=None covers all
+    owners.
+    """
+    subscriptions = CustomerSubscription.objects.filter(
+        is_active=True,
+        start_date__lte=timezone.make_aware(datetime.combine(day, time.max)),
+        end_date__gte=timezone.make_aware(datetime.combine(day, time.min)),
+    )
+    if owner is not None:
+        subscriptions = subscriptions.filter(menu__tiffin_service__owner=owner)
+
+    return subscriptions.annotate(
+        day_tracking=FilteredRelation('daily_tracking', condition=Q(daily_tracking__date=day)),
+    ).order_by().values(
+        'menu_id',
+        plan_id=F('subscription_id'),
+        owner_id=F('menu__tiffin_service__owner_id'),
+        service=F('menu__tiffin_service__name'),
+        menu_title=F('menu__title'),
+        plan_title=F('subscription__title'),
+    ).annotate(
+        subscribers=Count('id'),
+        skipped=Count('day_tracking', filter=Q(day_tracking__status='Skipped')),
+    )
+
+
+def build_manifest(day, owner=None):
+    """
+    Manifest for day, grouped by owner and menu.
+
+    The dish is the DailyMenu entry for the weekday when there is one,
+    otherwise the Menu's weekday field.
+
+    Returns a list of owners (sorted by service name), each a dict with
+    owner_id, service, to_cook and menus; a menu has menu_id, title, dish,
+    subscribers, skipped, to_cook and plans (plan_id, title, subscribers,
+    skipped, to_cook).
+    """
+    rows = list(manifest_rows(day, owner))
+    week_plans = get_week_plans(row['menu_id'] for row in rows)
+    weekday = WEEKDAYS[day.weekday()]
+
+    owners, menus = {}, {}
+    for row in sorted(rows, key=lambda row: (row['service'], row['menu_title'], row['plan_title'])):
+        kitchen = owners.get(row['owner_id'])
+        if kitchen is None:
+            kitchen = owners[row['owner_id']] = {
+                'owner_id': row['owner_id'], 'service': row['service'], 'to_cook': 0, 'menus': [],
+            }
+        menu = menus.get(row['menu_id'])
+        if menu is None:
+            menu = menus[row['menu_id']] = {
+                'menu_id': row['menu_id'],
+                'title': row['menu_title'],
+                'dish': week_plans.get(row['menu_id'], {}).get(weekday, {}).get('dish', ''),
+                'subscribers': 0, 'skipped': 0, 'to_cook': 0, 'plans': [],
+            }
+            kitchen['menus'].append(menu)
+
+        to_cook = row['subscribers'] - row['skipped']
+        menu['plans'].append({
+            'plan_id': row['plan_id'], 'title': row['plan_title'],
+            'subscribers': row['subscribers'], 'skipped': row['skipped'], 'to_cook': to_cook,
+        })
+        menu['subscribers'] += row['subscribers']
+        menu['skipped'] += row['skipped']
+        menu['to_cook'] += to_cook
+        kitchen['to_cook'] += to_cook
+
+    return list(owners.values())
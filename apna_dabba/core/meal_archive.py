@@ -0,0 +1,134 @@
+"""
+Monthly rollups and archival of DailyMealTracking.
+
+DailyMealTracking gains a row per subscriber per day. Rows older than
+MEAL_TRACKING_HOT_MONTHS whole months are folded into MonthlyMealRollup
+(taken/skipped counts plus the month's compact history string) and deleted
+from the hot table by `manage.py archive_meal_tracking`, in chunks so the
+write lock is held briefly.
+
+Readers combine both (see utils.get_meal_history and
+utils.get_owner_meal_report): a day's hot row, if any, wins over the
+rollup. A meal recorded late for an already archived month stays in the
+hot table until the next archival run merges it into the rollup; until
+then owner reports count that day from both.
+"""
+import calendar
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import DailyMealTracking, MonthlyMealRollup
+from .utils import MEAL_HISTORY_CODES, MEAL_HISTORY_EMPTY, shift_months
+
+ARCHIVE_CHUNK_SIZE = 5000
+
+
+def get_hot_months():
+    """Whole months kept in DailyMealTracking (MEAL_TRACKING_HOT_MONTHS, default 6)."""
+    return getattr(settings, 'MEAL_TRACKING_HOT_MONTHS', 6)
+
+
+def archive_cutoff(today=None, hot_months=None):
+    """Rows dated before this (a month start) are archived."""
+    if today is None:
+        today = timezone.localdate()
+    if hot_months is None:
+        hot_months = get_hot_months()
+    return shift_months(today.replace(day=1), -hot_months)
+
+
+def days_in_month(month):
+    return calendar.monthrange(month.year, month.month)[1]
+
+
+def overlay_history(history, rows, month):
+    """Set the days of rows ((date, status) pairs) in a month's history string."""
+    days = bytearray(history.ljust(days_in_month(month), MEAL_HISTORY_EMPTY).encode())
+    for tracked_date, status in rows:
+        days[tracked_date.day - 1] = ord(MEAL_HISTORY_CODES[status])
+    return days.decode()
+
+
+def _count(history):
+    return history.count(MEAL_HISTORY_CODES['Taken']), history.count(MEAL_HISTORY_CODES['Skipped'])
+
+
+def _archive_chunk(cutoff, after_pk, chunk_size):
+    """
+    Fold one chunk of old rows into rollups and delete them.
+
+    Returns: (rows archived, last primary key)
+    """
+    with transaction.atomic():
+        rows = list(
+            DailyMealTracking.objects.filter(date__lt=cutoff, pk__gt=after_pk)
+            .order_by('pk')
+            .values_list('pk', 'subscription_id', 'date', 'status')[:chunk_size]
+        )
+        if not rows:
+            return 0, after_pk
+
+        by_month = defaultdict(list)
+        for _, subscription_id, tracked_date, status in rows:
+            by_month[(subscription_id, tracked_date.replace(day=1))].append((tracked_date, status))
+
+        # A subscription-month may already be rolled up (an earlier chunk, or
+        # meals recorded after it was archived): merge into it
+        subscription_ids = {subscription_id for subscription_id, _ in by_month}
+        existing = {
+            (rollup.subscription_id, rollup.month): rollup
+            for rollup in MonthlyMealRollup.objects.filter(
+                subscription_id__in=subscription_ids,
+                month__in={month for _, month in by_month},
+            )
+            if (rollup.subscription_id, rollup.month) in by_month
+        }
+
+        to_create, to_update = [], []
+        for (subscription_id, month), month_rows in by_month.items():
+            rollup = existing.get((subscription_id, month))
+            if rollup is None:
+                rollup = MonthlyMealRollup(subscription_id=subscription_id, month=month, history='')
+                to_create.append(rollup)
+            else:
+                to_update.append(rollup)
+            rollup.history = overlay_history(rollup.history, month_rows, month)
+            rollup.taken, rollup.skipped = _count(rollup.history)
+
+        MonthlyMealRollup.objects.bulk_create(to_create, batch_size=500)
+        MonthlyMealRollup.objects.bulk_update(to_update, ['history', 'taken', 'skipped'], batch_size=500)
+
+        pks = [row[0] for row in rows]
+        db = router.db_for_write(DailyMealTracking)
+        table = connections[db].ops.quote_name(DailyMealTracking._meta.db_table)
+        for i in range(0, len(pks), 500):
+            # A plain DELETE, without fetching each row for the post_delete
+            # signal: archiving changes no totals the owner dashboard caches
+            chunk = pks[i:i + 500]
+            with connections[db].cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk
+                )
+
+    return len(rows), pks[-1]
+
+
+def archive_meal_tracking(cutoff=None, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Move DailyMealTracking rows dated before cutoff (default:
+    archive_cutoff()) into MonthlyMealRollup, one chunk per transaction.
+
+    Returns: number of rows archived
+    """
+    if cutoff is None:
+        cutoff = archive_cutoff()
+
+    archived, after_pk = 0, 0
+    while True:
+        count, after_pk = _archive_chunk(cutoff, after_pk, chunk_size)
+        if not count:
+            return archived
+        archived += count
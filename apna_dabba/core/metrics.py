@@ -0,0 +1,234 @@
+"""
+Lightweight Prometheus-format metrics.
+
+Each worker process aggregates into fixed in-memory counters (no per-request
+allocation beyond a few floats). When METRICS_DIR is set, every process
+periodically writes its totals to METRICS_DIR/metrics-<pid>.json and the
+/metrics/ endpoint sums all files, so a scrape of any worker covers all of
+them. Files of workers that have exited are removed when merging.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PREFIX = 'apna_dabba'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Business event counters: name -> help text
+EVENTS = {
+    'payments': 'Successful subscription payments.',
+    'payment_failures': 'Payment intents that failed (declined, retries exhausted or already subscribed).',
+    'meal_skips': 'Meals marked Skipped (each extends a subscription by a day).',
+    'subscription_expiries': 'Subscriptions deactivated by the expiry job.',
+}
+
+# Per-view series layout: latency bucket counts, then these totals
+_TOTALS = ('count', 'duration', 'queries', 'db_time', 'bytes')
+
+_lock = threading.Lock()
+_views = {}
+_responses = Counter()
+_events = Counter()
+_next_flush = 0
+
+
+# [queries, db_time] of the request being measured. A ContextVar, so queries
+# run in sync_to_async() threads under ASGI count towards their request.
+_query_stats = ContextVar('metrics_query_stats', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    db_stats = _query_stats.get()
+    if db_stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        db_stats[0] += 1
+        db_stats[1] += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    """Route every connection's queries through the request query counter."""
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+@contextmanager
+def count_queries(db_stats):
+    """Add the number of queries and DB time inside the block to db_stats."""
+    token = _query_stats.set(db_stats)
+    try:
+        yield db_stats
+    finally:
+        _query_stats.reset(token)
+
+
+def observe_request(view, status, duration, queries, db_time, size):
+    """Record one finished request."""
+    bucket = bisect_left(LATENCY_BUCKETS, duration)
+    with _lock:
+        series = _views.get(view)
+        if series is None:
+            series = _views[view] = [0] * (len(LATENCY_BUCKETS) + 1 + len(_TOTALS))
+        series[bucket] += 1
+        offset = len(LATENCY_BUCKETS) + 1
+        series[offset] += 1
+        series[offset + 1] += duration
+        series[offset + 2] += queries
+        series[offset + 3] += db_time
+        series[offset + 4] += size
+        _responses[(view, status // 100)] += 1
+    flush_if_due()
+
+
+def inc_event(name, amount=1):
+    """Increment a business event counter (see EVENTS)."""
+    if amount:
+        with _lock:
+            _events[name] += amount
+
+
+def snapshot():
+    """JSON-serialisable copy of this process's metrics."""
+    with _lock:
+        return {
+            'views': {view: list(series) for view, series in _views.items()},
+            'responses': [[view, status_class, count] for (view, status_class), count in _responses.items()],
+            'events': dict(_events),
+        }
+
+
+def merge(snapshots):
+    """Sum several snapshots into one."""
+    merged = {'views': {}, 'responses': Counter(), 'events': Counter()}
+    for snap in snapshots:
+        for view, series in snap['views'].items():
+            total = merged['views'].setdefault(view, [0] * len(series))
+            for i, value in enumerate(series):
+                total[i] += value
+        for view, status_class, count in snap['responses']:
+            merged['responses'][(view, status_class)] += count
+        merged['events'].update(snap['events'])
+    return merged
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def flush():
+    """Write this process's snapshot to METRICS_DIR (no-op if unset)."""
+    global _next_flush
+    directory = _metrics_dir()
+    if not directory:
+        return
+    _next_flush = time.monotonic() + getattr(settings, 'METRICS_FLUSH_INTERVAL', 15)
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+
+def flush_if_due():
+    if _metrics_dir() and time.monotonic() >= _next_flush:
+        flush()
+
+
+def _process_alive(pid):
+    """Whether a process with this PID runs on this host."""
+    if pid == os.getpid() or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, owned by another user
+    return True
+
+
+def collect():
+    """Merged metrics of all worker processes (or just this one)."""
+    directory = _metrics_dir()
+    if not directory:
+        return merge([snapshot()])
+
+    flush()
+    snapshots = []
+    for name in os.listdir(directory):
+        if name.startswith('metrics-') and name.endswith('.json'):
+            path = os.path.join(directory, name)
+            pid = name[len('metrics-'):-len('.json')]
+            if pid.isdigit() and not _process_alive(int(pid)):
+                # Left behind by a worker that has exited (or restarted)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Being replaced by its worker
+    return merge(snapshots)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(metrics):
+    """Prometheus text exposition format (0.0.4)."""
+    lines = []
+    offset = len(LATENCY_BUCKETS) + 1
+    views = sorted(metrics['views'].items())
+
+    name = f'{PREFIX}_http_request_duration_seconds'
+    lines += [f'# HELP {name} Request latency by URL name.', f'# TYPE {name} histogram']
+    for view, series in views:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, series):
+            cumulative += count
+            lines.append(f'{name}_bucket{{view="{_label(view)}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{view="{_label(view)}",le="+Inf"}} {series[offset]}')
+        lines.append(f'{name}_sum{{view="{_label(view)}"}} {series[offset + 1]}')
+        lines.append(f'{name}_count{{view="{_label(view)}"}} {series[offset]}')
+
+    summaries = (
+        ('db_queries_per_request', 'Database queries per request.', 2),
+        ('db_time_seconds', 'Database time per request.', 3),
+        ('response_size_bytes', 'Response body size.', 4),
+    )
+    for suffix, help_text, index in summaries:
+        name = f'{PREFIX}_{suffix}'
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} summary']
+        for view, series in views:
+            lines.append(f'{name}_sum{{view="{_label(view)}"}} {series[offset + index]}')
+            lines.append(f'{name}_count{{view="{_label(view)}"}} {series[offset]}')
+
+    name = f'{PREFIX}_http_responses_total'
+    lines += [f'# HELP {name} Responses by URL name and status class.', f'# TYPE {name} counter']
+    for (view, status_class), count in sorted(metrics['responses'].items()):
+        lines.append(f'{name}{{view="{_label(view)}",status="{status_class}xx"}} {count}')
+
+    for event, help_text in EVENTS.items():
+        name = f'{PREFIX}_{event}_total'
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines.append(f'{name} {metrics["events"].get(event, 0)}')
+
+    return '\n'.join(lines) + '\n'
@@ -1,20 +1,187 @@
 """
 Middleware for business logic automation.
+
+Every middleware here supports both sync (WSGI) and async (ASGI) stacks, so
+the async dashboard views run without a thread hop per request.
 """
-from .utils import deactivate_expired_subscriptions
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, user_snapshot
+from .db_router import begin_request, get_sticky_seconds, STICKY_COOKIE
+from .slow_queries import capture_slow_queries, get_threshold
+from .utils import run_expiry_if_due, get_expiry_interval
+
+
+class HybridMiddleware:
+    """Base for middleware that adapts to a sync or async get_response."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
 
 
-class SubscriptionExpiryMiddleware:
+class SubscriptionExpiryMiddleware(HybridMiddleware):
     """
-    Automatically deactivate expired subscriptions on each request.
-    This ensures subscriptions are always up-to-date.
+    Periodically deactivate expired subscriptions.
+
+    Instead of an UPDATE on every request, each worker process only checks
+    the shared ScheduledJob marker once per SUBSCRIPTION_EXPIRY_INTERVAL, and
+    only the worker that claims the marker runs the expiry query.
+    Static/media requests are never used to trigger it.
     """
     def __init__(self, get_response):
-        self.get_response = get_response
+        super().__init__(get_response)
+        self.interval = get_expiry_interval()
+        self.next_check = 0
+        self.skip_prefixes = tuple(
+            '/' + prefix.lstrip('/')
+            for prefix in (settings.STATIC_URL, settings.MEDIA_URL)
+            if prefix
+        )
+
+    def expiry_due(self, request):
+        if time.monotonic() >= self.next_check and not request.path.startswith(self.skip_prefixes):
+            self.next_check = time.monotonic() + self.interval
+            return True
+        return False
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        # Run throttled auto-expiry check before processing request
+        if self.expiry_due(request):
+            run_expiry_if_due(interval=self.interval)
+
+        response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        if self.expiry_due(request):
+            await sync_to_async(run_expiry_if_due)(interval=self.interval)
+
+        return await self.get_response(request)
+
+
+class UserSnapshotMiddleware(HybridMiddleware):
+    """
+    Resolve request.user from a cached snapshot instead of an auth_user
+    query (see core.user_snapshot). Place it right after
+    AuthenticationMiddleware; not used unless USER_SNAPSHOT is on and the
+    cache is shared between workers (not LocMemCache).
+    """
+    def __init__(self, get_response):
+        if not user_snapshot.snapshot_enabled():
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        user_snapshot.install(request)
+        return self.get_response(request)
 
+    async def __acall__(self, request):
+        user_snapshot.install(request)
+        return await self.get_response(request)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Record per-URL-name latency, DB query count, DB time and response size
+    for the /metrics/ endpoint (see core.metrics). Place it first in
+    MIDDLEWARE so the whole middleware stack is timed.
+    """
     def __call__(self, request):
-        # Run auto-expiry check before processing request
-        deactivate_expired_subscriptions()
-        
+        if self.is_async:
+            return self.__acall__(request)
+
+        db_stats = [0, 0.0]
+        started = time.perf_counter()
+        with metrics.count_queries(db_stats):
+            response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started, db_stats)
+        return response
+
+    async def __acall__(self, request):
+        db_stats = [0, 0.0]
+        started = time.perf_counter()
+        with metrics.count_queries(db_stats):
+            response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - started, db_stats)
+        return response
+
+    @staticmethod
+    def observe(request, response, duration, db_stats):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        size = 0 if response.streaming else len(response.content)
+        metrics.observe_request(view, response.status_code, duration, db_stats[0], db_stats[1], size)
+
+
+class SlowQueryLogMiddleware(HybridMiddleware):
+    """
+    Log statements slower than SLOW_QUERY_THRESHOLD_MS, labelled with the
+    URL name of the view that issued them (see core.slow_queries).
+    Disabled entirely when the threshold is unset.
+    """
+    def __init__(self, get_response):
+        if get_threshold() is None:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    @staticmethod
+    def source(request):
+        def source():
+            match = request.resolver_match
+            return (match.url_name or match.view_name) if match else request.path
+        return source
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        with capture_slow_queries(self.source(request)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with capture_slow_queries(self.source(request)):
+            return await self.get_response(request)
+
+
+class ReplicaStickinessMiddleware(HybridMiddleware):
+    """
+    Track writes per request for core.db_router and, when a request wrote,
+    keep that client's reads on the primary for REPLICA_STICKY_SECONDS.
+    """
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        state = begin_request()
         response = self.get_response(request)
+        return self.mark_sticky(response, state)
+
+    async def __acall__(self, request):
+        state = begin_request()
+        response = await self.get_response(request)
+        return self.mark_sticky(response, state)
+
+    @staticmethod
+    def mark_sticky(response, state):
+        if state['wrote']:
+            window = get_sticky_seconds()
+            response.set_cookie(
+                STICKY_COOKIE, f'{time.time() + window:.3f}', max_age=window,
+                httponly=True, samesite='Lax',
+            )
         return response
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_dailymealtracking_alter_customersubscription_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
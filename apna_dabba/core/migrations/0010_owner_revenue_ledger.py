@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_scheduledjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OwnerRevenueSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('active_subscriptions', models.IntegerField(default=0)),
+                ('active_subscribers', models.IntegerField(default=0)),
+                ('total_menus', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='revenue_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OwnerMonthlyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('active_subscriptions', models.IntegerField(default=0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_revenue', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-month'],
+                'unique_together': {('owner', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_owner_revenue_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customersubscription',
+            index=models.Index(fields=['menu', 'is_active', '-created_at', '-id'], name='custsub_menu_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Creates the FTS5 index used by core.search (SQLite only)
+
+from django.db import migrations, OperationalError
+
+WEEKDAY_FIELDS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def create_menu_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS core_menu_fts USING fts5("
+            "title, description, week, daily, service, tokenize='porter unicode61')"
+        )
+    except OperationalError:
+        return  # SQLite built without FTS5; core.search falls back to icontains
+
+    Menu = apps.get_model('core', 'Menu')
+    DailyMenu = apps.get_model('core', 'DailyMenu')
+    daily = {}
+    for menu_id, description in DailyMenu.objects.values_list('menu_id', 'food_description'):
+        daily.setdefault(menu_id, []).append(description)
+
+    with schema_editor.connection.cursor() as cursor:
+        for menu in Menu.objects.select_related('tiffin_service'):
+            cursor.execute(
+                "INSERT INTO core_menu_fts (rowid, title, description, week, daily, service) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                [
+                    menu.pk,
+                    menu.title,
+                    menu.description,
+                    '\n'.join(getattr(menu, field) for field in WEEKDAY_FIELDS),
+                    '\n'.join(daily.get(menu.pk, [])),
+                    menu.tiffin_service.name,
+                ],
+            )
+
+
+def drop_menu_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS core_menu_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_customersubscription_keyset_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_menu_fts, drop_menu_fts),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_paymentintent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyMealRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('taken', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('history', models.CharField(max_length=31)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meal_rollups', to='core.customersubscription')),
+            ],
+            options={
+                'ordering': ['-month'],
+                'indexes': [models.Index(fields=['month'], name='core_monthl_month_188b36_idx')],
+                'unique_together': {('subscription', 'month')},
+            },
+        ),
+    ]
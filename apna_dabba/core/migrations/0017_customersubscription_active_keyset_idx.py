@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_monthlymealrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customersubscription',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at', '-id'], name='custsub_active_keyset_idx'),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta, date
+from datetime import timedelta
 from django.core.exceptions import ValidationError
 
 
@@ -16,6 +16,15 @@ class TiffinService(models.Model):
         return self.name
 
 
+class MenuQuerySet(models.QuerySet):
+    def owned_by(self, owner):
+        """
+        Menus of owner's TiffinService, with the service joined in, so
+        fetching a menu through this loads and authorizes it in one query.
+        """
+        return self.filter(tiffin_service__owner=owner).select_related('tiffin_service')
+
+
 class Menu(models.Model):
     tiffin_service = models.ForeignKey(TiffinService, on_delete=models.CASCADE)
     title = models.CharField(max_length=100)
@@ -34,6 +43,8 @@ class Menu(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    objects = MenuQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
 
@@ -62,7 +73,7 @@ class Review(models.Model):
     tiffin_service = models.ForeignKey(TiffinService, on_delete=models.CASCADE)
     rating = models.IntegerField()
     comment = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return f"{self.user.username} - {self.rating}⭐"
@@ -108,6 +119,21 @@ class DailyMenu(models.Model):
         return f"{self.menu.title} - {self.day}"
 
 
+class CustomerSubscriptionQuerySet(models.QuerySet):
+    def active(self):
+        """
+        Active subscriptions whose end_date has not passed yet.
+
+        The expiry job only flips is_active periodically, so reads must also
+        treat end_date < now as expired between runs.
+        """
+        return self.filter(is_active=True, end_date__gte=timezone.now())
+
+    def for_owner(self, owner):
+        """Subscriptions to owner's menus (authorized by the same query's join)."""
+        return self.filter(menu__tiffin_service__owner=owner)
+
+
 class CustomerSubscription(models.Model):
     """
     Tracks customer subscriptions with auto-expiry and business logic.
@@ -120,10 +146,15 @@ class CustomerSubscription(models.Model):
     end_date = models.DateTimeField()
     is_active = models.BooleanField(default=True)
     payment_status = models.CharField(max_length=20, default="Paid")
+    # Client-supplied key of the payment that created this subscription;
+    # retries with the same key return this row instead of a new one
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    objects = CustomerSubscriptionQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         # Prevent duplicate active subscriptions per customer per menu
@@ -134,6 +165,16 @@ class CustomerSubscription(models.Model):
                 name='unique_active_subscription_per_customer_menu'
             )
         ]
+        indexes = [
+            # Keyset pagination of subscriber lists on (created_at, id)
+            models.Index(fields=['menu', 'is_active', '-created_at', '-id'], name='custsub_menu_keyset_idx'),
+            # The owner-wide list (all menus) walks active rows in that order
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(is_active=True),
+                name='custsub_active_keyset_idx',
+            ),
+        ]
 
     def clean(self):
         """Validate that only one active subscription exists per customer per menu."""
@@ -148,8 +189,13 @@ class CustomerSubscription(models.Model):
                     f"Customer already has an active subscription for {self.menu.title}"
                 )
 
-    def save(self, *args, **kwargs):
-        """Override save to enforce business rules."""
+    def save(self, *args, validate=True, **kwargs):
+        """
+        Override save to enforce business rules.
+
+        validate=False skips full_clean() for callers that rely on the
+        database constraints instead (see utils.handle_payment_success).
+        """
         # Set end_date if not provided
         if not self.end_date:
             self.end_date = timezone.now() + timedelta(
@@ -161,21 +207,27 @@ class CustomerSubscription(models.Model):
             self.is_active = False
         
         # Validate before saving
-        self.full_clean()
+        if validate:
+            self.full_clean()
         super().save(*args, **kwargs)
 
+    @property
+    def is_expired(self):
+        """True if deactivated or end_date has passed (even before the expiry job runs)."""
+        return not self.is_active or self.end_date < timezone.now()
+
     @property
     def days_remaining(self):
         """Calculate days remaining in subscription."""
-        if not self.is_active:
+        if self.is_expired:
             return 0
-        remaining = (self.end_date.date() - date.today()).days
+        remaining = (timezone.localtime(self.end_date).date() - timezone.localdate()).days
         return max(0, remaining)
 
     @property
     def status(self):
         """Get human-readable status."""
-        if not self.is_active:
+        if self.is_expired:
             return "Expired"
         if self.days_remaining == 0:
             return "Expiring Today"
@@ -228,3 +280,129 @@ class DailyMealTracking(models.Model):
 
     def __str__(self):
         return f"{self.subscription.customer.username} - {self.date} - {self.status}"
+
+
+class MonthlyMealRollup(models.Model):
+    """
+    One subscription's DailyMealTracking for one month, after archival
+    (`manage.py archive_meal_tracking`) moved the daily rows out of the hot
+    table. `history` holds one character per day of the month in the
+    compact meal history encoding ('T', 'S', '-').
+    """
+    subscription = models.ForeignKey(
+        'CustomerSubscription',
+        on_delete=models.CASCADE,
+        related_name='meal_rollups'
+    )
+    month = models.DateField()  # First day of the month
+    taken = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    history = models.CharField(max_length=31)
+
+    class Meta:
+        unique_together = ('subscription', 'month')
+        ordering = ['-month']
+        indexes = [
+            # Owner reports aggregate by month
+            models.Index(fields=['month']),
+        ]
+
+    def __str__(self):
+        return f"{self.subscription_id} - {self.month:%Y-%m} - {self.taken}T/{self.skipped}S"
+
+
+class ScheduledJob(models.Model):
+    """
+    Cross-process "last run" marker for periodic maintenance jobs
+    (e.g. subscription expiry), so N workers don't all fire at once.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.last_run_at}"
+
+
+class OwnerRevenueSummary(models.Model):
+    """
+    Incrementally maintained revenue totals per owner (see core.revenue).
+    Reconcile with `manage.py rebuild_revenue_ledger`.
+    """
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, related_name='revenue_summary')
+    total_revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    active_subscriptions = models.IntegerField(default=0)
+    active_subscribers = models.IntegerField(default=0)
+    total_menus = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.owner.username} - ₹{self.total_revenue}"
+
+
+class OwnerMonthlyRevenue(models.Model):
+    """
+    Revenue of still-active subscriptions per owner, bucketed by the month
+    they were created in.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_revenue')
+    month = models.DateField()  # First day of the month
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    active_subscriptions = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('owner', 'month')
+        ordering = ['-month']
+
+    def __str__(self):
+        return f"{self.owner.username} - {self.month:%b %Y} - ₹{self.revenue}"
+
+
+class PaymentIntent(models.Model):
+    """
+    A customer's payment for a plan, confirmed asynchronously.
+
+    The table doubles as the work queue: `manage.py process_payments`
+    workers claim pending intents with a conditional UPDATE (see
+    core.payments), charge the gateway and activate the subscription.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payment_intents')
+    subscription = models.ForeignKey('Subscription', on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Same key as the resulting CustomerSubscription: resubmits map to one intent
+    idempotency_key = models.CharField(max_length=64, unique=True)
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Retry backoff
+    locked_until = models.DateTimeField(null=True, blank=True)  # Worker lease
+    claimed_by = models.CharField(max_length=64, blank=True)
+
+    gateway_reference = models.CharField(max_length=64, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    customer_subscription = models.ForeignKey(
+        'CustomerSubscription', on_delete=models.SET_NULL, null=True, blank=True
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Queue scan: oldest claimable intents first
+            models.Index(fields=['status', 'available_at'], name='paymentintent_queue_idx'),
+        ]
+
+    @property
+    def is_final(self):
+        return self.status in ('succeeded', 'failed')
+
+    def __str__(self):
+        return f"{self.customer.username} - {self.subscription.title} - {self.status}"
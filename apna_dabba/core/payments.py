@@ -0,0 +1,202 @@
+"""
+Asynchronous payment confirmation.
+
+payment_page only records a PaymentIntent and returns; the PaymentIntent
+table is the work queue. Workers (`manage.py process_payments`) claim due
+intents, charge the gateway (core.gateway) and activate the subscription
+with handle_payment_success, using the intent's idempotency key for both so
+a retried intent never charges twice or creates a second subscription.
+
+Claiming is a conditional UPDATE per intent, as with the ScheduledJob
+marker, so any number of workers can share the queue. A claim is a lease:
+an intent whose worker died is picked up again once locked_until passes.
+Transient gateway errors are retried with exponential backoff up to
+PAYMENT_MAX_ATTEMPTS.
+"""
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .gateway import GatewayError, PaymentDeclined, get_gateway
+from .metrics import inc_event
+from .models import CustomerSubscription, PaymentIntent
+from .utils import handle_payment_success
+
+
+def get_max_attempts():
+    """Gateway attempts before an intent fails (PAYMENT_MAX_ATTEMPTS, default 5)."""
+    return getattr(settings, 'PAYMENT_MAX_ATTEMPTS', 5)
+
+
+def get_retry_backoff():
+    """Seconds before the first retry, doubled per attempt (PAYMENT_RETRY_BACKOFF, default 2)."""
+    return getattr(settings, 'PAYMENT_RETRY_BACKOFF', 2)
+
+
+def get_lease_seconds():
+    """Seconds a worker owns a claimed intent (PAYMENT_LEASE_SECONDS, default 60)."""
+    return getattr(settings, 'PAYMENT_LEASE_SECONDS', 60)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"[:64]
+
+
+def create_payment_intent(customer, subscription, idempotency_key):
+    """
+    Record a payment to be confirmed by a worker. Resubmitting the same key
+    returns the existing intent.
+
+    Returns: PaymentIntent, or None if the customer already has an active
+    subscription for the menu (or the key belongs to another customer)
+    """
+    intent = PaymentIntent.objects.filter(idempotency_key=idempotency_key).first()
+    if intent is None:
+        # Refuse before anything is charged; a race past this check is
+        # caught by handle_payment_success in the worker
+        if CustomerSubscription.objects.active().filter(
+            customer=customer, menu_id=subscription.menu_id
+        ).exists():
+            return None
+        intent, _ = PaymentIntent.objects.get_or_create(
+            idempotency_key=idempotency_key,
+            defaults={
+                'customer': customer,
+                'subscription': subscription,
+                'amount': subscription.price,
+            },
+        )
+    if intent.customer_id != customer.pk:
+        return None
+    return intent
+
+
+def _claimable(now):
+    """Pending intents that are due, and processing ones whose lease expired."""
+    return (
+        Q(status='pending', available_at__lte=now)
+        | Q(status='processing', locked_until__lt=now)
+    )
+
+
+def _claim(pk, worker_id, now):
+    return PaymentIntent.objects.filter(_claimable(now), pk=pk).update(
+        status='processing',
+        locked_until=now + timedelta(seconds=get_lease_seconds()),
+        claimed_by=worker_id,
+        attempts=F('attempts') + 1,
+        updated_at=now,
+    )
+
+
+def claim_intents(worker_id, limit=10, now=None):
+    """
+    Claim up to `limit` due intents for worker_id, oldest first.
+
+    Returns: list of claimed PaymentIntents (customer and plan loaded)
+    """
+    if now is None:
+        now = timezone.now()
+    candidates = PaymentIntent.objects.filter(_claimable(now)).order_by(
+        'available_at'
+    ).values_list('pk', flat=True)[:limit]
+    # Another worker may win some of these; it then owns them
+    claimed = [pk for pk in list(candidates) if _claim(pk, worker_id, now)]
+    return list(
+        PaymentIntent.objects.filter(pk__in=claimed)
+        .select_related('customer', 'subscription')
+        .order_by('available_at')
+    )
+
+
+def claim_intent(intent, worker_id):
+    """Claim one specific intent (inline processing); returns it reloaded, or None."""
+    if not _claim(intent.pk, worker_id, timezone.now()):
+        return None
+    return PaymentIntent.objects.select_related('customer', 'subscription').get(pk=intent.pk)
+
+
+def _finish(intent, **fields):
+    """Store the outcome, unless the lease was lost to another worker meanwhile."""
+    fields['updated_at'] = timezone.now()
+    updated = PaymentIntent.objects.filter(
+        pk=intent.pk, status='processing', claimed_by=intent.claimed_by,
+    ).update(locked_until=None, **fields)
+    for name, value in fields.items():
+        setattr(intent, name, value)
+    return bool(updated)
+
+
+def process_intent(intent, gateway=None):
+    """
+    Charge a claimed intent and activate its subscription.
+
+    Returns: the intent's new status
+    """
+    gateway = gateway or get_gateway()
+    try:
+        reference = gateway.charge(intent.amount, intent.idempotency_key)
+    except PaymentDeclined as e:
+        _finish(intent, status='failed', error=str(e)[:255])
+        inc_event('payment_failures')
+        return intent.status
+    except GatewayError as e:
+        if intent.attempts >= get_max_attempts():
+            _finish(intent, status='failed', error=str(e)[:255])
+            inc_event('payment_failures')
+        else:
+            delay = get_retry_backoff() * 2 ** (intent.attempts - 1)
+            _finish(
+                intent, status='pending', error=str(e)[:255],
+                available_at=timezone.now() + timedelta(seconds=delay),
+            )
+        return intent.status
+
+    customer_subscription = handle_payment_success(
+        intent.customer, intent.subscription, idempotency_key=intent.idempotency_key
+    )
+    if customer_subscription is None:
+        # Charged, but the customer already holds an active subscription
+        # for this menu; the charge is left for a refund
+        _finish(
+            intent, status='failed', gateway_reference=reference,
+            error='You already have an active subscription for this menu.',
+        )
+        inc_event('payment_failures')
+    else:
+        _finish(
+            intent, status='succeeded', gateway_reference=reference, error='',
+            customer_subscription=customer_subscription,
+        )
+    return intent.status
+
+
+def run_worker_once(worker_id=None, batch=10, gateway=None):
+    """
+    Claim and process one batch of intents.
+
+    Returns: dict of status -> number of intents that ended in it
+    """
+    worker_id = worker_id or default_worker_id()
+    outcome = {}
+    for intent in claim_intents(worker_id, limit=batch):
+        status = process_intent(intent, gateway)
+        outcome[status] = outcome.get(status, 0) + 1
+    return outcome
+
+
+def confirm_inline(intent):
+    """
+    Process an intent within the request (PAYMENTS_ASYNC = False), e.g. for
+    development without a worker running.
+    """
+    claimed = claim_intent(intent, default_worker_id())
+    if claimed is not None:
+        process_intent(claimed)
+        return claimed
+    intent.refresh_from_db()
+    return intent
@@ -0,0 +1,36 @@
+"""
+Replication stand-in for local development and tests.
+
+Copies the primary SQLite database onto the replica file with SQLite's
+online backup API, so a second file lags the primary exactly as long as
+the sync interval - enough to exercise core.db_router locally.
+"""
+import sqlite3
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+from .db_router import REPLICA_DATABASE
+
+
+def sqlite_replica_paths():
+    """(primary, replica) file paths from DATABASES."""
+    if REPLICA_DATABASE not in connections.settings:
+        raise ImproperlyConfigured("No 'replica' database configured (set REPLICA_SQLITE_PATH).")
+    primary = connections.settings['default']
+    replica = connections.settings[REPLICA_DATABASE]
+    if 'sqlite3' not in primary['ENGINE'] or 'sqlite3' not in replica['ENGINE']:
+        raise ImproperlyConfigured("The replication stand-in only supports SQLite.")
+    return str(primary['NAME']), str(replica['NAME'])
+
+
+def sync_sqlite_replica(primary_path, replica_path):
+    """Copy a consistent snapshot of the primary onto the replica; returns pages copied."""
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path, timeout=20)
+    try:
+        source.backup(target)
+        return target.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
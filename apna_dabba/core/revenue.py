@@ -0,0 +1,197 @@
+"""
+Incrementally maintained owner revenue ledger.
+
+OwnerRevenueSummary / OwnerMonthlyRevenue are updated with F() deltas when a
+subscription is activated or deactivated, so the owner dashboard reads two
+rows instead of aggregating the whole subscription history.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, Count, F
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .dashboard_cache import owner_id_for_menu
+from .models import (
+    CustomerSubscription, Menu, TiffinService, OwnerRevenueSummary, OwnerMonthlyRevenue
+)
+
+
+def month_start(value):
+    """First day of the month containing a datetime."""
+    return timezone.localtime(value).date().replace(day=1)
+
+
+def rebuild_owner_revenue(owner_id):
+    """
+    Recompute an owner's ledger rows from CustomerSubscription.
+
+    Returns the OwnerRevenueSummary.
+    """
+    active = CustomerSubscription.objects.filter(
+        menu__tiffin_service__owner_id=owner_id,
+        is_active=True
+    ).order_by()
+
+    with transaction.atomic():
+        totals = active.aggregate(
+            revenue=Sum('subscription__price'),
+            subscriptions=Count('id'),
+            subscribers=Count('customer', distinct=True),
+        )
+        summary, _ = OwnerRevenueSummary.objects.update_or_create(
+            owner_id=owner_id,
+            defaults={
+                'total_revenue': totals['revenue'] or Decimal('0.00'),
+                'active_subscriptions': totals['subscriptions'],
+                'active_subscribers': totals['subscribers'],
+                'total_menus': Menu.objects.filter(tiffin_service__owner_id=owner_id).count(),
+            }
+        )
+
+        monthly = active.exclude(created_at__isnull=True).annotate(
+            month=TruncMonth('created_at')
+        ).values('month').annotate(
+            revenue=Sum('subscription__price'),
+            subscriptions=Count('id'),
+        )
+        OwnerMonthlyRevenue.objects.filter(owner_id=owner_id).delete()
+        OwnerMonthlyRevenue.objects.bulk_create([
+            OwnerMonthlyRevenue(
+                owner_id=owner_id,
+                month=row['month'].date(),
+                revenue=row['revenue'],
+                active_subscriptions=row['subscriptions'],
+            )
+            for row in monthly
+        ])
+
+    return summary
+
+
+def rebuild_revenue_ledger():
+    """Recompute the ledger for every owner. Returns the number of owners."""
+    owner_ids = list(TiffinService.objects.values_list('owner_id', flat=True))
+    for owner_id in owner_ids:
+        rebuild_owner_revenue(owner_id)
+    return len(owner_ids)
+
+
+def _ensure_summaries(owner_ids):
+    """
+    Build ledger rows for owners that have none yet.
+
+    Returns the owner IDs that were rebuilt; their ledgers already reflect the
+    current state, so callers must not apply deltas to them.
+    """
+    existing = set(
+        OwnerRevenueSummary.objects.filter(owner_id__in=owner_ids).values_list('owner_id', flat=True)
+    )
+    missing = set(owner_ids) - existing
+    for owner_id in missing:
+        rebuild_owner_revenue(owner_id)
+    return missing
+
+
+def _apply_delta(owner_id, month, revenue, subscriptions, subscribers):
+    """
+    Add deltas to an owner's summary and monthly rows.
+
+    Returns False, changing nothing, if the owner has no summary row yet.
+    """
+    updated = OwnerRevenueSummary.objects.filter(owner_id=owner_id).update(
+        total_revenue=F('total_revenue') + revenue,
+        active_subscriptions=F('active_subscriptions') + subscriptions,
+        active_subscribers=F('active_subscribers') + subscribers,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        return False
+
+    if month is None:
+        return True
+    # One UPDATE in the common case; the month's row is created on first use
+    monthly = OwnerMonthlyRevenue.objects.filter(owner_id=owner_id, month=month)
+    deltas = {
+        'revenue': F('revenue') + revenue,
+        'active_subscriptions': F('active_subscriptions') + subscriptions,
+    }
+    if not monthly.update(**deltas):
+        OwnerMonthlyRevenue.objects.get_or_create(owner_id=owner_id, month=month)
+        monthly.update(**deltas)
+    return True
+
+
+def record_subscription_activated(customer_subscription):
+    """Add a newly created active subscription to its owner's ledger."""
+    owner_id = owner_id_for_menu(customer_subscription.menu_id)
+
+    is_new_subscriber = not CustomerSubscription.objects.filter(
+        customer_id=customer_subscription.customer_id,
+        menu__tiffin_service__owner_id=owner_id,
+        is_active=True
+    ).exclude(pk=customer_subscription.pk).exists()
+
+    # No savepoint: callers (handle_payment_success) already hold a transaction
+    with transaction.atomic(savepoint=False):
+        applied = _apply_delta(
+            owner_id,
+            month_start(customer_subscription.created_at) if customer_subscription.created_at else None,
+            customer_subscription.subscription.price,
+            1,
+            1 if is_new_subscriber else 0,
+        )
+        if not applied:
+            # First ledger use for this owner: the rebuild already counts it
+            rebuild_owner_revenue(owner_id)
+
+
+def record_subscriptions_deactivated(rows):
+    """
+    Remove deactivated subscriptions from their owners' ledgers.
+
+    Args:
+        rows: dicts with customer_id, created_at, price and owner_id
+              (as selected by utils.deactivate_subscriptions)
+    """
+    if not rows:
+        return
+
+    deltas = defaultdict(lambda: [Decimal('0.00'), 0])
+    lost_pairs = set()
+    for row in rows:
+        month = month_start(row['created_at']) if row['created_at'] else None
+        deltas[(row['owner_id'], month)][0] += row['price']
+        deltas[(row['owner_id'], month)][1] += 1
+        lost_pairs.add((row['owner_id'], row['customer_id']))
+
+    # Customers that still have another active subscription with the owner
+    still_active = set(
+        CustomerSubscription.objects.filter(
+            is_active=True,
+            menu__tiffin_service__owner_id__in={owner_id for owner_id, _ in lost_pairs},
+            customer_id__in={customer_id for _, customer_id in lost_pairs},
+        ).order_by().values_list('menu__tiffin_service__owner_id', 'customer_id').distinct()
+    )
+    lost_subscribers = defaultdict(int)
+    for pair in lost_pairs - still_active:
+        lost_subscribers[pair[0]] += 1
+
+    with transaction.atomic():
+        rebuilt = _ensure_summaries({owner_id for owner_id, _ in deltas})
+        for (owner_id, month), (revenue, subscriptions) in deltas.items():
+            if owner_id in rebuilt:
+                continue
+            _apply_delta(owner_id, month, -revenue, -subscriptions, -lost_subscribers.pop(owner_id, 0))
+
+
+def record_menu_added(owner_id):
+    """Increment an owner's menu count."""
+    if _ensure_summaries([owner_id]):
+        return
+    OwnerRevenueSummary.objects.filter(owner_id=owner_id).update(
+        total_menus=F('total_menus') + 1,
+        updated_at=timezone.now(),
+    )
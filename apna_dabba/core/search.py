@@ -0,0 +1,104 @@
+"""
+Ranked full-text menu search.
+
+On SQLite the core_menu_fts FTS5 table (created by migration 0012) indexes
+each menu's title, description, weekly dishes (monday..sunday), DailyMenu
+descriptions and tiffin service name, and results are ordered by BM25.
+Other backends (or SQLite builds without FTS5) fall back to icontains.
+"""
+import re
+
+from django.db import connection, OperationalError
+from django.db.models import Q, Case, When
+
+from .models import Menu
+
+FTS_TABLE = 'core_menu_fts'
+FTS_COLUMNS = ['title', 'description', 'week', 'daily', 'service']
+# bm25() weights per column: dishes served this week count almost as much as the title
+FTS_WEIGHTS = (5.0, 2.0, 3.0, 3.0, 1.0)
+MAX_RESULTS = 200
+
+WEEKDAY_FIELDS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+_fts_available = {}
+
+
+def fts_available():
+    """True if the FTS5 index exists on the default database."""
+    if connection.vendor != 'sqlite':
+        return False
+    if connection.alias not in _fts_available:
+        _fts_available[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[connection.alias]
+
+
+def build_fts_query(text):
+    """Turn user input into an FTS5 query: every word must match (as a prefix)."""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def menu_document(menu, daily_descriptions, service_name):
+    """Column values indexed for a menu."""
+    return [
+        menu.title,
+        menu.description,
+        '\n'.join(getattr(menu, field) for field in WEEKDAY_FIELDS),
+        '\n'.join(daily_descriptions),
+        service_name,
+    ]
+
+
+def index_menu(menu_id):
+    """(Re)index one menu, or drop it from the index if it no longer exists."""
+    if not fts_available():
+        return
+
+    menu = Menu.objects.filter(pk=menu_id).select_related('tiffin_service').first()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [menu_id])
+        if menu is None:
+            return
+        daily = menu.daily_menus.values_list('food_description', flat=True)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s)",
+            [menu.pk] + menu_document(menu, daily, menu.tiffin_service.name),
+        )
+
+
+def search_menus(queryset, text):
+    """
+    Filter a Menu queryset by a free-text query, best matches first.
+
+    Returns a queryset (ranked by BM25 when FTS5 is available).
+    """
+    if fts_available():
+        fts_query = build_fts_query(text)
+        if not fts_query:
+            return queryset.none()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                    f"ORDER BY bm25({FTS_TABLE}, {', '.join(map(str, FTS_WEIGHTS))}) LIMIT %s",
+                    [fts_query, MAX_RESULTS],
+                )
+                ranked_ids = [row[0] for row in cursor.fetchall()]
+        except OperationalError:
+            ranked_ids = None
+
+        if ranked_ids is not None:
+            if not ranked_ids:
+                return queryset.none()
+            return queryset.filter(id__in=ranked_ids).order_by(
+                Case(*[When(id=pk, then=rank) for rank, pk in enumerate(ranked_ids)])
+            )
+
+    # Fallback: unranked substring match over the same fields
+    condition = Q(title__icontains=text) | Q(description__icontains=text)
+    condition |= Q(tiffin_service__name__icontains=text)
+    condition |= Q(daily_menus__food_description__icontains=text)
+    for field in WEEKDAY_FIELDS:
+        condition |= Q(**{f'{field}__icontains': text})
+    return queryset.filter(condition).distinct()
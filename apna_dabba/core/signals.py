@@ -0,0 +1,210 @@
+"""
+Signal handlers keeping derived data in sync with core models.
+"""
+from django.db import transaction
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    Menu, CustomerSubscription, TiffinService, DailyMenu, Subscription
+)
+from .dashboard_cache import bump_owner_version, owner_id_for_menu
+from .revenue import (
+    record_menu_added, rebuild_owner_revenue, record_subscription_activated, record_subscriptions_deactivated
+)
+from .search import index_menu
+from .images import schedule_derivatives
+from .week_plan import invalidate_week_plan
+from .user_snapshot import invalidate_user_snapshot
+
+
+@receiver(post_save, sender=Menu)
+def menu_saved(sender, instance, created, **kwargs):
+    """Count new menus in the owner's revenue ledger."""
+    if created:
+        owner_id = TiffinService.objects.filter(
+            pk=instance.tiffin_service_id
+        ).values_list('owner_id', flat=True).get()
+        record_menu_added(owner_id)
+
+
+def _queue_revenue_rebuild(owner_id, using):
+    """
+    Rebuild the owner's revenue ledger once the current transaction commits.
+
+    Owners are collected per transaction so a cascade deleting many
+    subscriptions registers a single on_commit hook and rebuilds each owner
+    once.
+    """
+    connection = transaction.get_connection(using)
+    queued = getattr(connection, '_revenue_rebuilds', None)
+    # A rolled back transaction drops its on_commit hooks, so only reuse the
+    # queue while its flush hook is still pending
+    if queued is not None and any(func is queued['flush'] for _, func, _ in connection.run_on_commit):
+        queued['owners'].add(owner_id)
+        return
+    queued = {'owners': {owner_id}}
+
+    def flush():
+        connection._revenue_rebuilds = None
+        for queued_owner_id in queued['owners']:
+            rebuild_owner_revenue(queued_owner_id)
+
+    queued['flush'] = flush
+    connection._revenue_rebuilds = queued
+    transaction.on_commit(flush, using=using)
+
+
+@receiver(pre_delete, sender=Menu)
+def menu_deleted(sender, instance, using, **kwargs):
+    """Deleting a menu cascades to its subscriptions; rebuild the owner's ledger."""
+    _queue_revenue_rebuild(instance.tiffin_service.owner_id, using)
+
+
+@receiver(pre_save, sender=CustomerSubscription)
+def customer_subscription_saving(sender, instance, raw, using, **kwargs):
+    """Remember the stored ledger entry of an active subscription being updated."""
+    instance._ledger_row = None
+    if raw or instance._state.adding:
+        return
+    instance._ledger_row = CustomerSubscription.objects.using(using).filter(
+        pk=instance.pk, is_active=True
+    ).values(
+        'customer_id', 'created_at', 'menu_id', 'subscription_id',
+        price=F('subscription__price'),
+        owner_id=F('menu__tiffin_service__owner_id'),
+    ).first()
+
+
+@receiver(post_save, sender=CustomerSubscription)
+def customer_subscription_saved(sender, instance, raw, **kwargs):
+    """
+    Follow is_active transitions in the owner's revenue ledger, including
+    save() deactivating a subscription whose end_date has passed.
+    """
+    if raw:
+        return
+    old = instance._ledger_row
+    moved = old is not None and (old['menu_id'], old['subscription_id']) != (
+        instance.menu_id, instance.subscription_id
+    )
+    if old is not None and (moved or not instance.is_active):
+        record_subscriptions_deactivated([old])
+    if instance.is_active and (old is None or moved):
+        record_subscription_activated(instance)
+
+
+@receiver(pre_delete, sender=CustomerSubscription)
+def customer_subscription_deleted(sender, instance, using, origin=None, **kwargs):
+    """Deleting an active subscription removes its revenue; rebuild the owner's ledger."""
+    if not instance.is_active:
+        return
+    if isinstance(origin, Menu) or getattr(origin, 'model', None) is Menu:
+        return  # Cascade of a menu delete, which queues the owner itself
+    owner_id = owner_id_for_menu(instance.menu_id)
+    if owner_id is not None:
+        _queue_revenue_rebuild(owner_id, using)
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def menu_changed_reindex(sender, instance, **kwargs):
+    """Keep the menu search index in sync."""
+    index_menu(instance.pk)
+
+
+@receiver(post_save, sender=DailyMenu)
+@receiver(post_delete, sender=DailyMenu)
+def daily_menu_changed_reindex(sender, instance, **kwargs):
+    """Daily dishes are part of their menu's search document."""
+    index_menu(instance.menu_id)
+
+
+@receiver(post_save, sender=TiffinService)
+def tiffin_service_saved_reindex(sender, instance, created, **kwargs):
+    """The service name is part of each of its menus' search documents."""
+    if created:
+        return
+    for menu_id in Menu.objects.filter(tiffin_service=instance).values_list('id', flat=True):
+        index_menu(menu_id)
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_save, sender=DailyMenu)
+def image_saved(sender, instance, **kwargs):
+    """Generate thumbnail/WebP derivatives of uploaded images off the request thread."""
+    if instance.image:
+        schedule_derivatives(instance.image.name)
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=CustomerSubscription)
+@receiver(post_delete, sender=CustomerSubscription)
+def owner_data_changed(sender, instance, **kwargs):
+    """Invalidate the owner's cached dashboard."""
+    if sender is Menu:
+        owner_id = TiffinService.objects.filter(
+            pk=instance.tiffin_service_id
+        ).values_list('owner_id', flat=True).first()
+    else:
+        owner_id = owner_id_for_menu(instance.menu_id)
+    if owner_id is not None:
+        bump_owner_version(owner_id)
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def menu_changed_week_plan(sender, instance, using, **kwargs):
+    """
+    The weekday fields are part of the menu's cached week plan. Dropped on
+    commit so a concurrent reader cannot re-cache the uncommitted plan.
+    """
+    menu_id = instance.pk
+    transaction.on_commit(lambda: invalidate_week_plan(menu_id), using=using)
+
+
+@receiver(post_save, sender=DailyMenu)
+@receiver(post_delete, sender=DailyMenu)
+def daily_menu_changed_week_plan(sender, instance, using, **kwargs):
+    """Daily dishes override the menu's weekday fields in its cached week plan."""
+    menu_id = instance.menu_id
+    transaction.on_commit(lambda: invalidate_week_plan(menu_id), using=using)
+
+
+@receiver(post_save, sender=DailyMenu)
+@receiver(post_delete, sender=DailyMenu)
+def daily_menu_changed_touch_menu(sender, instance, **kwargs):
+    """
+    Catalogue pages show today's dish, but DailyMenu has no timestamp of its
+    own for the page ETags to include; bump Menu.updated_at instead so the
+    ETag (and the anonymous page cache keyed by it) changes with the dish.
+    """
+    Menu.objects.filter(pk=instance.menu_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed_snapshot(sender, instance, **kwargs):
+    """Role, username and password changes must reach request.user."""
+    invalidate_user_snapshot(instance.pk)
+
+
+@receiver(post_save, sender=TiffinService)
+@receiver(post_delete, sender=TiffinService)
+def tiffin_service_changed_snapshot(sender, instance, **kwargs):
+    """The owner's snapshot carries their TiffinService id."""
+    invalidate_user_snapshot(instance.owner_id)
+
+
+@receiver(user_logged_out)
+def user_logged_out_snapshot(sender, request, user, **kwargs):
+    """Logging out drops the snapshot; the next login rebuilds it."""
+    if user is not None:
+        invalidate_user_snapshot(user.pk)
@@ -0,0 +1,207 @@
+"""
+Slow-query log.
+
+Every SQL statement slower than SLOW_QUERY_THRESHOLD_MS is written as one
+JSON line to a rotating log (SLOW_QUERY_LOG) together with the view that
+issued it, the project call site (e.g. the loop in core/views.py that
+triggered it) and the database's query plan (EXPLAIN QUERY PLAN on SQLite).
+`manage.py slow_query_report` summarises the log by total time.
+"""
+import json
+import logging
+import os
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger('core.slow_queries')
+
+# Query execution enters Django here; call sites are searched above it
+_DB_PATH = os.path.join('django', 'db', '')
+# Frames from these paths are never reported as the call site
+_IGNORED_PATHS = (os.path.abspath(__file__), os.sep + 'site-packages' + os.sep, os.sep + 'django' + os.sep)
+
+
+def get_threshold():
+    """Threshold in milliseconds, or None when the slow-query log is disabled."""
+    return getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+
+
+def get_log_path():
+    return str(getattr(settings, 'SLOW_QUERY_LOG', None) or os.path.join(settings.BASE_DIR, 'logs', 'slow_queries.log'))
+
+
+def log_files(path=None):
+    """The log and its rotated backups (slow_queries.log, .1, .2, ...)."""
+    path = path or get_log_path()
+    files = [path] if os.path.exists(path) else []
+    index = 1
+    while os.path.exists(f'{path}.{index}'):
+        files.append(f'{path}.{index}')
+        index += 1
+    return files
+
+
+def _handler_for(path):
+    """Lazily attach a RotatingFileHandler for `path` (replacing any other)."""
+    for handler in logger.handlers:
+        if getattr(handler, 'baseFilename', None) == os.path.abspath(path):
+            return
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    handler = RotatingFileHandler(
+        path,
+        maxBytes=getattr(settings, 'SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024),
+        backupCount=getattr(settings, 'SLOW_QUERY_LOG_BACKUPS', 5),
+        encoding='utf-8',
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def call_site():
+    """
+    Innermost project frame that issued the query, e.g.
+    'core/views.py:120 in menu'. Frames below Django's cursor (other
+    execute_wrappers such as the metrics middleware) are skipped.
+    """
+    base_dir = str(settings.BASE_DIR)
+    below_cursor = True
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if _DB_PATH in filename:
+            below_cursor = False
+            continue
+        if below_cursor or not filename.startswith(base_dir) or any(part in filename for part in _IGNORED_PATHS):
+            continue
+        return f'{os.path.relpath(filename, base_dir)}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+def explain(connection, sql, params):
+    """Query plan rows for a SELECT (empty for anything else or on error)."""
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return []
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except Exception:  # The plan is diagnostic only; never break the request
+        return []
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+# (threshold in seconds, source) of the block capturing slow queries. A
+# ContextVar, so queries run in sync_to_async() threads under ASGI are seen.
+_capture = ContextVar('slow_query_capture', default=None)
+
+
+class SlowQueryRecorder:
+    """execute_wrapper that logs statements over the capturing threshold."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        capture = _capture.get()
+        if capture is None or self.explaining:
+            return execute(sql, params, many, context)
+
+        threshold, source = capture
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        if duration >= threshold:
+            self.record(sql, params, many, duration, source)
+        return result
+
+    def record(self, sql, params, many, duration, source):
+        self.explaining = True
+        try:
+            plan = [] if many else explain(self.connection, sql, params)
+        finally:
+            self.explaining = False
+
+        _handler_for(get_log_path())
+        logger.info(json.dumps({
+            'time': time.time(),
+            'duration_ms': round(duration * 1000, 3),
+            'database': self.connection.alias,
+            'view': source() if callable(source) else source,
+            'call_site': call_site(),
+            'sql': sql,
+            'plan': plan,
+        }))
+
+
+@receiver(connection_created)
+def install_recorder(sender, connection, **kwargs):
+    """Give every connection a SlowQueryRecorder (idle outside capture_slow_queries())."""
+    if not any(isinstance(wrapper, SlowQueryRecorder) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(SlowQueryRecorder(connection))
+
+
+@contextmanager
+def capture_slow_queries(source):
+    """
+    Log slow queries issued inside the block. `source` labels them (a view
+    name, a command name or a callable returning one).
+    """
+    threshold = get_threshold()
+    if threshold is None:
+        yield
+        return
+
+    token = _capture.set((threshold / 1000, source))
+    try:
+        yield
+    finally:
+        _capture.reset(token)
+
+
+def read_entries(path=None):
+    """Parsed entries from the log and its rotated backups."""
+    for filename in log_files(path):
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # Partially written line
+
+
+def summarise(entries, group_by='call_site'):
+    """
+    Aggregate entries per (call site or view, SQL), sorted by total time.
+    Django parametrises queries, so identical SQL text means the same query.
+    """
+    groups = {}
+    for entry in entries:
+        key = (entry.get(group_by) or 'unknown', entry['sql'])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                group_by: key[0], 'sql': entry['sql'], 'count': 0,
+                'total_ms': 0.0, 'max_ms': 0.0, 'views': set(), 'plan': entry.get('plan', []),
+            }
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        group['views'].add(entry.get('view') or '-')
+    return sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
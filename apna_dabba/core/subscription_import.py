@@ -0,0 +1,262 @@
+"""
+Bulk import of an owner's existing customers and subscriptions from CSV.
+
+Kitchens moving from spreadsheets bring hundreds or thousands of customers,
+so rows are validated in memory and written with bulk_create in batches
+instead of CustomerSubscription.save() (a full_clean() and uniqueness
+query per row). The one-active-subscription-per-customer-per-menu rule is
+checked against the database once per batch and against earlier rows of
+the same file; the database constraint remains the final guard.
+
+Columns (header row required, names case-insensitive):
+
+  username    required; an existing account is reused if it already
+              subscribes to one of the owner's menus or has the row's
+              email, otherwise the row is an error (the username belongs
+              to someone else). New customers are created with an unusable
+              password (they set one via password reset)
+  email, first_name, last_name
+              optional, used only for new customers
+  menu        required; title or ID of one of the owner's menus
+  plan        title or ID of a plan of that menu (optional when the menu
+              has exactly one plan)
+  start_date  optional, YYYY-MM-DD (default today)
+
+end_date is start_date + the plan's duration_in_days; rows that have
+already ended are imported as inactive history.
+"""
+import csv
+import secrets
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .dashboard_cache import bump_owner_version
+from .models import CustomerSubscription, Menu, Subscription
+from .revenue import rebuild_owner_revenue
+
+IMPORT_BATCH_SIZE = 2000
+REQUIRED_COLUMNS = ('username', 'menu')
+MAX_USERNAME_LENGTH = User._meta.get_field('username').max_length
+validate_username = UnicodeUsernameValidator()
+
+
+class ImportRowError(Exception):
+    """A CSV row that cannot be imported."""
+
+
+def _lookup(by_key, value, what):
+    """Resolve a title (case-insensitive) or ID through by_key."""
+    match = by_key.get(value.strip().lower())
+    if match is None:
+        raise ImportRowError(f"Unknown {what} '{value}'.")
+    return match
+
+
+def _catalogue(owner):
+    """The owner's menus and plans, keyed by lower-cased title and by ID."""
+    menus, plans = {}, {}
+    for menu in Menu.objects.filter(tiffin_service__owner=owner):
+        menus[menu.title.lower()] = menus[str(menu.id)] = menu
+        plans[menu.id] = {}
+    for plan in Subscription.objects.filter(menu__tiffin_service__owner=owner):
+        plans[plan.menu_id][plan.title.lower()] = plans[plan.menu_id][str(plan.id)] = plan
+    return menus, plans
+
+
+@lru_cache(maxsize=4096)
+def _start_date(value, today):
+    """Midnight (local time) of a YYYY-MM-DD value; files repeat few dates."""
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d').date() if value else today
+    except ValueError:
+        raise ImportRowError(f"start_date '{value}' is not YYYY-MM-DD.")
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _parse_row(row, menus, plans, today):
+    """Validate one CSV row; returns a dict of cleaned values."""
+    username = (row.get('username') or '').strip()
+    if not username:
+        raise ImportRowError("username is required.")
+    if len(username) > MAX_USERNAME_LENGTH:
+        raise ImportRowError(f"username is longer than {MAX_USERNAME_LENGTH} characters.")
+    email = (row.get('email') or '').strip()
+    try:
+        validate_username(username)
+        if email:
+            validate_email(email)
+    except ValidationError as e:
+        raise ImportRowError(' '.join(e.messages))
+
+    menu = _lookup(menus, row.get('menu') or '', 'menu')
+    menu_plans = plans[menu.id]
+    if (row.get('plan') or '').strip():
+        plan = _lookup(menu_plans, row['plan'], f'plan for {menu.title}')
+    elif len(set(menu_plans.values())) == 1:
+        plan = next(iter(menu_plans.values()))
+    else:
+        raise ImportRowError(f"plan is required: {menu.title} has {len(set(menu_plans.values()))} plans.")
+
+    start_date = _start_date((row.get('start_date') or '').strip(), today)
+
+    return {
+        'username': username,
+        'email': email,
+        'first_name': (row.get('first_name') or '').strip()[:150],
+        'last_name': (row.get('last_name') or '').strip()[:150],
+        'menu': menu,
+        'plan': plan,
+        'start_date': start_date,
+        'end_date': start_date + timedelta(days=plan.duration_in_days),
+    }
+
+
+def _import_batch(owner, batch, active_pairs, planned_users, now, dry_run):
+    """
+    Validate a batch of parsed rows against the database and insert it.
+    active_pairs (subscriptions imported by earlier batches) and
+    planned_users (new usernames of a dry run) carry state between batches.
+
+    Returns: (customers created, subscriptions created, [(line, error)],
+    (username, menu ID) pairs of the active subscriptions created)
+    """
+    errors = []
+    usernames = {values['username'] for _, values in batch}
+    users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+
+    # The owner's existing customers and the active subscriptions they hold
+    customers, batch_pairs = set(), set()
+    for username, menu_id, is_active in CustomerSubscription.objects.filter(
+        customer__username__in=list(users), menu__tiffin_service__owner=owner
+    ).values_list('customer__username', 'menu_id', 'is_active'):
+        customers.add(username)
+        if is_active:
+            batch_pairs.add((username, menu_id))
+
+    accepted = []
+    for line, values in batch:
+        user = users.get(values['username'])
+        if user is not None and user.is_staff:
+            errors.append((line, f"'{values['username']}' is an owner account, not a customer."))
+            continue
+        if user is not None and user.username not in customers and not (
+            values['email'] and values['email'].lower() == user.email.lower()
+        ):
+            errors.append((line, f"'{values['username']}' is taken by another account; give its email to reuse it."))
+            continue
+        is_active = values['end_date'] >= now
+        pair = (values['username'], values['menu'].id)
+        if is_active:
+            if pair in active_pairs or pair in batch_pairs:
+                errors.append((line, f"'{values['username']}' already has an active subscription for {values['menu'].title}."))
+                continue
+            batch_pairs.add(pair)
+        accepted.append((values, is_active))
+    created_pairs = {
+        (values['username'], values['menu'].id) for values, is_active in accepted if is_active
+    }
+
+    new_users = {}
+    for values, _ in accepted:
+        username = values['username']
+        if username not in users and username not in new_users and username not in planned_users:
+            new_users[username] = User(
+                username=username,
+                email=values['email'],
+                first_name=values['first_name'],
+                last_name=values['last_name'],
+                # Same as make_password(None), without 40 secrets.choice() calls per row
+                password=UNUSABLE_PASSWORD_PREFIX + secrets.token_urlsafe(30),
+            )
+    if dry_run:
+        planned_users.update(new_users)
+        return len(new_users), len(accepted), errors, created_pairs
+
+    # bulk_create sets primary keys on SQLite 3.35+ and PostgreSQL
+    User.objects.bulk_create(new_users.values())
+    users.update(new_users)
+    CustomerSubscription.objects.bulk_create([
+        CustomerSubscription(
+            customer_id=users[values['username']].pk,
+            subscription_id=values['plan'].pk,
+            menu_id=values['menu'].pk,
+            start_date=values['start_date'],
+            end_date=values['end_date'],
+            is_active=is_active,
+            payment_status='Paid',
+        )
+        for values, is_active in accepted
+    ])
+    return len(new_users), len(accepted), errors, created_pairs
+
+
+def import_subscriptions(owner, csv_file, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+    """
+    Import customers and CustomerSubscriptions for owner from a CSV text
+    stream. Each batch is committed on its own, so a conflict with a
+    concurrent payment only fails that batch's rows.
+
+    Returns: dict with rows, created_customers, created_subscriptions and
+    errors (a list of (line number, message))
+    """
+    result = {'rows': 0, 'created_customers': 0, 'created_subscriptions': 0, 'errors': []}
+    reader = csv.DictReader(csv_file)
+    if reader.fieldnames is None:
+        result['errors'].append((1, "The file is empty."))
+        return result
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    missing = [column for column in REQUIRED_COLUMNS if column not in reader.fieldnames]
+    if missing:
+        result['errors'].append((1, f"Missing column(s): {', '.join(missing)}."))
+        return result
+
+    menus, plans = _catalogue(owner)
+    now = timezone.now()
+    today = timezone.localdate()
+    active_pairs, planned_users = set(), set()
+
+    def flush(batch):
+        try:
+            with transaction.atomic():
+                customers, subscriptions, errors, created_pairs = _import_batch(
+                    owner, batch, active_pairs, planned_users, now, dry_run
+                )
+        except IntegrityError:
+            result['errors'].extend(
+                (line, "Conflicts with a concurrent change; re-run the import for this row.")
+                for line, _ in batch
+            )
+            return
+        # Only once committed: a rolled back batch must not block later rows
+        active_pairs.update(created_pairs)
+        result['created_customers'] += customers
+        result['created_subscriptions'] += subscriptions
+        result['errors'].extend(errors)
+
+    batch = []
+    for row in reader:
+        result['rows'] += 1
+        try:
+            batch.append((reader.line_num, _parse_row(row, menus, plans, today)))
+        except ImportRowError as e:
+            result['errors'].append((reader.line_num, str(e)))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    result['errors'].sort()
+    if result['created_subscriptions'] and not dry_run:
+        # bulk_create bypasses signals and the incremental ledger
+        rebuild_owner_revenue(owner.id)
+        bump_owner_version(owner.id)
+    return result
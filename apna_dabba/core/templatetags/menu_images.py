@@ -0,0 +1,24 @@
+"""
+Template tags for rendering menu images with their derivatives.
+"""
+from django import template
+
+from core.images import responsive_sources
+
+register = template.Library()
+
+
+@register.inclusion_tag('core/responsive_image.html')
+def responsive_image(image, alt='', css_class='', sizes='(max-width: 600px) 100vw, 400px', style=''):
+    """
+    <picture> with WebP/JPEG srcsets and lazy loading; falls back to the
+    original upload until its derivatives are generated.
+    """
+    return {
+        'image': image,
+        'sources': responsive_sources(image),
+        'alt': alt,
+        'css_class': css_class,
+        'sizes': sizes,
+        'style': style,
+    }
@@ -1,3 +1,1466 @@
-from django.test import TestCase
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import tracemalloc
+import subprocess
+import sys
+from pathlib import Path
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    TiffinService, Menu, Subscription, CustomerSubscription, DailyMealTracking, DailyMenu,
+    OwnerRevenueSummary, PaymentIntent, MonthlyMealRollup,
+)
+from .revenue import rebuild_owner_revenue
+from .search import search_menus, fts_available
+from . import search
+from .images import DERIVATIVE_FORMATS, DERIVATIVE_WIDTHS, derivative_name, responsive_sources
+from .dashboard_cache import CACHE_STATS
+from . import metrics
+from .slow_queries import read_entries
+from .db_router import REPLICA_DATABASE, STICKY_COOKIE
+from .replication import sync_sqlite_replica
+from .gateway import GatewayError, PaymentDeclined
+from .payments import create_payment_intent, claim_intents, process_intent, run_worker_once
+from .subscription_import import import_subscriptions
+from .meal_archive import archive_cutoff, archive_meal_tracking
+from .manifest import build_manifest
+from .week_plan import WEEKDAYS, attach_todays_dish, get_week_plans
+from .user_snapshot import SnapshotUser
+from PIL import Image
+from apna_dabba.db_profiles import database_settings
+from .utils import (
+    run_expiry_if_due, get_meal_history, handle_payment_success, calculate_owner_revenue,
+    deactivate_expired_subscriptions, get_owner_subscriptions_page, bulk_mark_meals,
+    get_customer_dashboard_stats, acalculate_owner_revenue, aget_customer_dashboard_stats,
+    aget_meal_history, get_owner_meal_report,
+)
+
+
+# A cache shared between processes, as the user snapshot and cached_db
+# sessions require (they are not used with LocMemCache)
+SHARED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'apna-dabba-test-cache'),
+    }
+}
+CACHED_SESSIONS = {
+    'CACHES': SHARED_CACHES,
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+    'USER_SNAPSHOT': True,
+}
+
+# Local gateway emulator without latency or failures
+INSTANT_GATEWAY = {'BACKEND': 'core.gateway.LocalGatewayEmulator', 'OPTIONS': {'latency': 0}}
+
+
+def make_owner_menu(username='owner', title='Veg Thali'):
+    """Create an owner with a TiffinService, one Menu and one monthly plan."""
+    owner = User.objects.create_user(username=username, password='pass', is_staff=True)
+    service = TiffinService.objects.create(owner=owner, name=username, address='-', phone='-')
+    menu = Menu.objects.create(
+        tiffin_service=service, title=title, description='Dal rice', monthly_price=Decimal('2000')
+    )
+    plan = Subscription.objects.create(
+        menu=menu, title='Monthly', duration_in_days=30, price=Decimal('2000')
+    )
+    return owner, menu, plan
+
+
+def make_customer_subscription(customer, plan, **kwargs):
+    """Create a CustomerSubscription bypassing save() validation."""
+    now = timezone.now()
+    defaults = {
+        'start_date': now,
+        'end_date': now + timedelta(days=plan.duration_in_days),
+        'is_active': True,
+    }
+    defaults.update(kwargs)
+    return CustomerSubscription.objects.bulk_create([
+        CustomerSubscription(customer=customer, subscription=plan, menu=plan.menu, **defaults)
+    ])[0]
+
+
+class SubscriptionExpiryTests(TestCase):
+    def setUp(self):
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.lapsed = make_customer_subscription(
+            self.customer, self.plan, end_date=timezone.now() - timedelta(days=1)
+        )
+
+    def test_expiry_runs_once_per_interval(self):
+        self.assertEqual(run_expiry_if_due(interval=300), 1)
+        self.assertIsNone(run_expiry_if_due(interval=300))
+
+        later = timezone.now() + timedelta(seconds=301)
+        self.assertEqual(run_expiry_if_due(now=later, interval=300), 0)
+
+    def test_lapsed_subscription_treated_as_expired_before_job_runs(self):
+        self.lapsed.refresh_from_db()
+        self.assertTrue(self.lapsed.is_active)
+        self.assertEqual(self.lapsed.status, 'Expired')
+        self.assertEqual(self.lapsed.days_remaining, 0)
+        self.assertFalse(CustomerSubscription.objects.active().exists())
+
+    def test_middleware_does_not_expire_on_static_requests(self):
+        self.client.get('/static/css/style.css')
+        self.lapsed.refresh_from_db()
+        self.assertTrue(self.lapsed.is_active)
+
+        self.client.get('/reviews/')
+        self.lapsed.refresh_from_db()
+        self.assertFalse(self.lapsed.is_active)
+
+
+class CustomerDashboardCalendarTests(TestCase):
+    def setUp(self):
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.subscription = make_customer_subscription(
+            self.customer, self.plan, start_date=timezone.now() - timedelta(days=400)
+        )
+        today = timezone.localdate()
+        DailyMealTracking.objects.bulk_create([
+            DailyMealTracking(subscription=self.subscription, date=today, status='Taken', taken=True),
+            DailyMealTracking(
+                subscription=self.subscription, date=today - timedelta(days=2),
+                status='Skipped', taken=False
+            ),
+        ])
+        self.client.login(username='customer', password='pass')
+
+    def test_meal_history_is_compact_string(self):
+        today = timezone.localdate()
+        history = get_meal_history(self.subscription, today - timedelta(days=3), today)
+        self.assertEqual(history, '-S-T')
+
+    def test_query_count_independent_of_window(self):
+        self.client.get(reverse('customer_dashboard'))  # Warm up session/expiry marker
+        with CaptureQueriesContext(connection) as short_window:
+            response = self.client.get(reverse('customer_dashboard'), {'days': '30'})
+        self.assertEqual(len(response.context['grid_data']), 31)
+
+        with CaptureQueriesContext(connection) as full_history:
+            response = self.client.get(reverse('customer_dashboard'), {'days': 'all'})
+        self.assertEqual(len(response.context['grid_data']), 401)
+        self.assertEqual(len(short_window), len(full_history))
+
+
+class MenuCatalogueQueryTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.client.login(username='customer', password='pass')
+
+    def add_menus(self, count):
+        for i in range(count):
+            owner, menu, plan = make_owner_menu(username=f'owner{Menu.objects.count()}')
+            Subscription.objects.create(menu=menu, title='Weekly', duration_in_days=7, price=Decimal('600'))
+            make_customer_subscription(self.customer, plan)
+
+    def test_query_count_independent_of_catalogue_size(self):
+        self.add_menus(2)
+        self.client.get(reverse('menu'))  # Warm up session/expiry marker
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('menu'))
+
+        self.add_menus(10)
+        self.client.get(reverse('menu'))  # Caches the new menus' week plans
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('menu'))
+
+        self.assertEqual(len(small), len(large))
+        flags = [sub.is_subscribed for menu in response.context['menus'] for sub in menu.subscriptions.all()]
+        self.assertEqual(flags.count(True), 12)
+        self.assertEqual(flags.count(False), 12)
+
+
+class OwnerRevenueLedgerTests(TestCase):
+    def setUp(self):
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+
+    def ledger(self):
+        summary = OwnerRevenueSummary.objects.get(owner=self.owner)
+        return (summary.total_revenue, summary.active_subscriptions, summary.active_subscribers)
+
+    def test_payment_and_expiry_update_ledger_incrementally(self):
+        calculate_owner_revenue(self.owner)  # Builds the (empty) ledger
+        handle_payment_success(self.customer, self.plan)
+        handle_payment_success(self.other, self.plan)
+        self.assertEqual(self.ledger(), (Decimal('4000'), 2, 2))
+
+        CustomerSubscription.objects.filter(customer=self.other).update(
+            end_date=timezone.now() - timedelta(days=1)
+        )
+        deactivate_expired_subscriptions()
+        self.assertEqual(self.ledger(), (Decimal('2000'), 1, 1))
+
+        stats = calculate_owner_revenue(self.owner)
+        self.assertEqual(stats['total_revenue'], Decimal('2000'))
+        self.assertEqual(stats['monthly_revenue'], Decimal('2000'))
+        self.assertEqual(stats['total_menus'], 1)
+
+        incremental = self.ledger()
+        rebuild_owner_revenue(self.owner.pk)
+        self.assertEqual(self.ledger(), incremental)
+
+    def test_save_past_end_date_leaves_ledger(self):
+        calculate_owner_revenue(self.owner)
+        subscription = handle_payment_success(self.customer, self.plan)
+        subscription.end_date = timezone.now() - timedelta(days=1)
+        subscription.save()
+        self.assertFalse(subscription.is_active)
+        self.assertEqual(self.ledger(), (Decimal('0.00'), 0, 0))
+
+        subscription.end_date = timezone.now() + timedelta(days=7)
+        subscription.is_active = True
+        subscription.save()
+        self.assertEqual(self.ledger(), (Decimal('2000'), 1, 1))
+        incremental = self.ledger()
+        rebuild_owner_revenue(self.owner.pk)
+        self.assertEqual(self.ledger(), incremental)
+
+    def test_lapsed_subscriptions_are_not_counted(self):
+        calculate_owner_revenue(self.owner)
+        handle_payment_success(self.customer, self.plan)
+        handle_payment_success(self.other, self.plan)
+        # Lapsed, but the expiry job has not run yet
+        CustomerSubscription.objects.filter(customer=self.other).update(
+            end_date=timezone.now() - timedelta(days=1)
+        )
+        stats = calculate_owner_revenue(self.owner)
+        self.assertEqual(stats['total_revenue'], Decimal('2000'))
+        self.assertEqual(stats['active_subscribers'], 1)
+        self.assertEqual(stats['active_subscribers'], CustomerSubscription.objects.active().count())
+
+    def test_dashboard_revenue_reads_constant_queries(self):
+        calculate_owner_revenue(self.owner)
+        # Lapsed subscription check, then the two ledger rows
+        with self.assertNumQueries(3):
+            calculate_owner_revenue(self.owner)
+
+    def test_deletes_rebuild_ledger_once_per_owner(self):
+        calculate_owner_revenue(self.owner)
+        handle_payment_success(self.customer, self.plan)
+        handle_payment_success(self.other, self.plan)
+        handle_payment_success(User.objects.create_user(username='third'), self.plan)
+        with mock.patch('core.signals.rebuild_owner_revenue', wraps=rebuild_owner_revenue) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                CustomerSubscription.objects.exclude(customer=self.customer).delete()
+            rebuild.assert_called_once_with(self.owner.pk)
+            self.assertEqual(self.ledger(), (Decimal('2000'), 1, 1))
+
+            rebuild.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.menu.delete()
+            rebuild.assert_called_once_with(self.owner.pk)
+        self.assertEqual(self.ledger(), (Decimal('0.00'), 0, 0))
+
+
+class OwnerSubscriberPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        _, self.other_menu, self.other_plan = make_owner_menu(username='owner2')
+        now = timezone.now()
+        for i in range(5):
+            customer = User.objects.create_user(username=f'customer{i}', password='pass')
+            # Two subscriptions share a created_at to exercise the id tie-breaker
+            sub = make_customer_subscription(customer, self.plan, end_date=now + timedelta(days=3 + i * 5))
+            CustomerSubscription.objects.filter(pk=sub.pk).update(created_at=now - timedelta(hours=min(i, 3)))
+
+    def test_keyset_pages_cover_all_rows_once(self):
+        seen = []
+        cursor = None
+        while True:
+            page = get_owner_subscriptions_page(self.owner, cursor=cursor, page_size=2)
+            seen.extend(sub.pk for sub in page['subscriptions'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), set(CustomerSubscription.objects.values_list('pk', flat=True)))
+
+    def test_expiring_soon_filter(self):
+        page = get_owner_subscriptions_page(self.owner, expiring_soon=True)
+        self.assertEqual(len(page['subscriptions']), 1)
+
+    @override_settings(TIME_ZONE='Asia/Kolkata')
+    def test_expiring_soon_uses_local_dates(self):
+        CustomerSubscription.objects.all().delete()
+        # Local midnight eight days from now: 7 days remaining just before it
+        midnight = timezone.make_aware(datetime.combine(timezone.localdate() + timedelta(days=8), datetime.min.time()))
+        for i, end_date in enumerate((midnight - timedelta(minutes=1), midnight + timedelta(minutes=1))):
+            customer = User.objects.create_user(username=f'edge{i}')
+            make_customer_subscription(customer, self.plan, end_date=end_date)
+
+        page = get_owner_subscriptions_page(self.owner, expiring_soon=True)
+        self.assertEqual([sub.customer.username for sub in page['subscriptions']], ['edge0'])
+        self.assertEqual(page['subscriptions'][0].status, 'Expiring Soon')
+        self.assertEqual(CustomerSubscription.objects.get(customer__username='edge1').status, 'Active')
+
+    def test_dashboard_renders_filtered_page(self):
+        self.client.login(username='owner', password='pass')
+        response = self.client.get(reverse('owner_dashboard'), {'menu': self.menu.pk, 'expiring': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['subscriptions']), 1)
+
+
+class BulkMarkMealsTests(TestCase):
+    def setUp(self):
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.subscriptions = [
+            make_customer_subscription(User.objects.create_user(username=f'customer{i}'), self.plan)
+            for i in range(20)
+        ]
+        self.ids = [sub.pk for sub in self.subscriptions]
+
+    def test_bulk_skip_extends_each_subscription_once(self):
+        end_dates = dict(CustomerSubscription.objects.values_list('pk', 'end_date'))
+        with self.assertNumQueries(6):
+            result = bulk_mark_meals(self.owner, self.ids, 'Skipped')
+        self.assertEqual(result, {'created': 20, 'updated': 0, 'extended': 20})
+
+        result = bulk_mark_meals(self.owner, self.ids, 'Skipped')
+        self.assertEqual(result['extended'], 0)
+        for pk, end_date in CustomerSubscription.objects.values_list('pk', 'end_date'):
+            self.assertEqual(end_date, end_dates[pk] + timedelta(days=1))
+
+        result = bulk_mark_meals(self.owner, self.ids[:5], 'Taken')
+        self.assertEqual(result, {'created': 0, 'updated': 5, 'extended': 0})
+        self.assertEqual(DailyMealTracking.objects.filter(taken=True).count(), 5)
+
+    def test_other_owners_subscriptions_are_ignored(self):
+        other_owner, _, _ = make_owner_menu(username='owner2')
+        result = bulk_mark_meals(other_owner, self.ids, 'Taken')
+        self.assertEqual(result['created'], 0)
+
+    def test_endpoint_marks_selected(self):
+        self.client.login(username='owner', password='pass')
+        response = self.client.post(reverse('bulk_mark_meals'), {
+            'subscription_ids': self.ids[:3], 'status': 'Taken',
+        })
+        self.assertRedirects(response, reverse('owner_dashboard'))
+        self.assertEqual(DailyMealTracking.objects.count(), 3)
+
+
+class MenuSearchTests(TestCase):
+    def setUp(self):
+        _, self.plain, _ = make_owner_menu(username='owner1', title='Simple Thali')
+        _, self.weekly, _ = make_owner_menu(username='owner2', title='Home Meals')
+        self.weekly.wednesday = 'Paneer butter masala, roti'
+        self.weekly.save()
+        _, self.titled, _ = make_owner_menu(username='paneer_house', title='Paneer Special')
+
+    def search(self, text):
+        return list(search_menus(Menu.objects.all(), text))
+
+    def test_fts_ranks_title_and_weekly_dishes(self):
+        self.assertTrue(fts_available())
+        self.assertEqual(self.search('paneer'), [self.titled, self.weekly])
+
+    def test_index_follows_daily_menu_and_delete(self):
+        DailyMenu.objects.create(menu=self.plain, day='Monday', food_description='Rajma chawal')
+        self.assertEqual(self.search('rajma'), [self.plain])
+
+        self.plain.delete()
+        self.assertEqual(self.search('rajma'), [])
+
+    def test_fallback_without_fts(self):
+        with mock.patch.dict(search._fts_available, {'default': False}):
+            self.assertEqual(set(self.search('paneer')), {self.titled, self.weekly})
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.owner, self.menu, _ = make_owner_menu()
+
+    def upload(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 1200), 'orange').save(buffer, 'JPEG')
+        return SimpleUploadedFile('thali.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_generates_derivatives_used_by_templates(self):
+        with override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVES_ASYNC=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.menu.image = self.upload()
+                self.menu.save()
+
+            storage = self.menu.image.storage
+            thumb = derivative_name(self.menu.image.name, 400, 'webp')
+            self.assertTrue(storage.exists(thumb))
+            with storage.open(thumb) as f:
+                self.assertEqual(Image.open(f).size, (400, 300))
+
+            self.client.login(username='owner', password='pass')
+            response = self.client.get(reverse('owner_dashboard'))
+            self.assertContains(response, '__w400.webp 400w')
+            self.assertContains(response, 'loading="lazy"')
+
+    def test_rendering_reads_availability_from_the_cache(self):
+        with override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVES_ASYNC=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.menu.image = self.upload()
+                self.menu.save()
+
+            with mock.patch.object(FileSystemStorage, 'exists') as exists:
+                sources = responsive_sources(self.menu.image)
+            exists.assert_not_called()
+            self.assertEqual(sources['jpg'].count('w,') + 1, len(DERIVATIVE_WIDTHS))
+
+    def test_missing_derivatives_are_checked_once(self):
+        with override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVES_ASYNC=False):
+            self.menu.image = self.upload()
+            self.menu.save()  # Outside a captured commit: nothing generated
+            with mock.patch.object(FileSystemStorage, 'exists', return_value=False) as exists:
+                self.assertEqual(responsive_sources(self.menu.image), {'webp': '', 'jpg': ''})
+                responsive_sources(self.menu.image)
+            self.assertEqual(exists.call_count, len(DERIVATIVE_WIDTHS) * len(DERIVATIVE_FORMATS))
+
+
+class OwnerDashboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        make_customer_subscription(User.objects.create_user(username='customer'), self.plan)
+        self.client.login(username='owner', password='pass')
+
+    def test_cache_hit_skips_dashboard_queries(self):
+        self.client.get(reverse('owner_dashboard'))
+        hits = CACHE_STATS['revenue_stats_hits']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('owner_dashboard'))
+        self.assertContains(response, 'customer')
+        self.assertEqual(CACHE_STATS['revenue_stats_hits'], hits + 1)
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('core_customersubscription', tables)
+        self.assertNotIn('core_ownerrevenuesummary', tables)
+
+    def test_menu_change_invalidates(self):
+        self.client.get(reverse('owner_dashboard'))
+        self.menu.title = 'Jain Thali'
+        self.menu.save()
+        misses = CACHE_STATS['menus_misses']
+        response = self.client.get(reverse('owner_dashboard'))
+        self.assertEqual(CACHE_STATS['menus_misses'], misses + 1)
+        self.assertContains(response, 'Jain Thali')
+
+
+class ConditionalCatalogueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+
+    def test_anonymous_home_is_shared_and_revalidated(self):
+        first = self.client.get(reverse('home'))
+        self.assertIn('public', first['Cache-Control'])
+        self.assertIn('Cookie', first['Vary'])
+        self.assertTrue(first.has_header('Last-Modified'))
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(reverse('home'))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(len(queries), 3)  # Only the catalogue state aggregates
+
+        not_modified = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_catalogue_change_changes_etag(self):
+        etag = self.client.get(reverse('home'))['ETag']
+        DailyMenu.objects.create(menu=self.menu, day='Monday', food_description='Poha')
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.menu.delete()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_customer_menu_etag_follows_own_subscriptions(self):
+        customer = User.objects.create_user(username='customer', password='pass')
+        self.client.login(username='customer', password='pass')
+        response = self.client.get(reverse('menu'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(
+            self.client.get(reverse('menu'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304
+        )
+
+        handle_payment_success(customer, self.plan)
+        self.assertEqual(
+            self.client.get(reverse('menu'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200
+        )
+
+
+class MetricsTests(TestCase):
+    def test_metrics_endpoint_reports_views_and_events(self):
+        owner, menu, plan = make_owner_menu()
+        customer = User.objects.create_user(username='customer', password='pass')
+        handle_payment_success(customer, plan)
+        self.client.get(reverse('reviews'))
+
+        User.objects.create_superuser(username='admin', password='pass')
+        self.client.login(username='admin', password='pass')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('apna_dabba_http_request_duration_seconds_count{view="reviews"}', body)
+        self.assertIn('apna_dabba_db_queries_per_request_sum{view="reviews"}', body)
+        self.assertRegex(body, r'apna_dabba_payments_total [1-9]')
+
+    async def test_async_view_queries_are_counted(self):
+        owner, menu, plan = await sync_to_async(make_owner_menu)()
+        await self.async_client.aforce_login(owner)
+        queries = len(metrics.LATENCY_BUCKETS) + 1 + 2
+        before = metrics.snapshot()['views'].get('owner_dashboard', [0] * (queries + 1))[queries]
+
+        # The async ORM runs the view's queries in sync_to_async() threads
+        response = await self.async_client.get(reverse('owner_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(metrics.snapshot()['views']['owner_dashboard'][queries], before)
+
+    def test_metrics_are_aggregated_across_processes(self):
+        # Another live worker (the parent process) and one that has exited
+        dead = subprocess.Popen([sys.executable, '-c', ''])
+        dead.wait()
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            for pid in (os.getppid(), dead.pid):
+                with open(f'{directory}/metrics-{pid}.json', 'w') as f:
+                    f.write('{"views": {"home": [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 7, 0.5, 21, 0.1, 700]},'
+                            ' "responses": [["home", 2, 7]], "events": {"payments": 3}}')
+            merged = metrics.collect()
+            self.assertFalse(os.path.exists(f'{directory}/metrics-{dead.pid}.json'))
+        count = len(metrics.LATENCY_BUCKETS) + 1
+        local = metrics.snapshot()['views'].get('home', [0] * (count + 1))[count]
+        self.assertEqual(merged['views']['home'][count], local + 7)
+        self.assertGreaterEqual(merged['events']['payments'], 3)
+
+    def test_metrics_denied_by_default(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        make_owner_menu()
+        self.client.login(username='owner', password='pass')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reverse('metrics'), '/metrics/')
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir, ignore_errors=True)
+        self.log_path = os.path.join(self.log_dir, 'slow.log')
+        make_owner_menu()
+
+    def test_slow_queries_are_logged_with_view_call_site_and_plan(self):
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG=self.log_path):
+            self.client.get(reverse('home'))
+
+        entries = list(read_entries(self.log_path))
+        menu_queries = [e for e in entries if 'FROM "core_menu"' in e['sql'] and e['view'] == 'home']
+        self.assertTrue(menu_queries)
+        self.assertTrue(menu_queries[0]['call_site'].startswith(os.path.join('core', '')))
+        self.assertTrue(menu_queries[0]['plan'])
+
+        out = StringIO()
+        call_command('slow_query_report', log=self.log_path, plans=True, stdout=out)
+        self.assertIn('slow queries by total time', out.getvalue())
+        self.assertIn('plan:', out.getvalue())
+
+    async def test_async_view_queries_are_logged(self):
+        owner = await User.objects.aget(username='owner')
+        await self.async_client.aforce_login(owner)
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG=self.log_path):
+            response = await self.async_client.get(reverse('owner_dashboard'))
+        self.assertEqual(response.status_code, 200)
+
+        views = {entry['view'] for entry in read_entries(self.log_path)}
+        self.assertIn('owner_dashboard', views)
+
+    def test_disabled_without_threshold(self):
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=None, SLOW_QUERY_LOG=self.log_path):
+            self.client.get(reverse('home'))
+        self.assertFalse(os.path.exists(self.log_path))
+
+    def test_report_reads_rotated_logs(self):
+        entry = {'duration_ms': 50.0, 'view': 'menu', 'call_site': 'core/views.py:1 in menu', 'sql': 'SELECT 1', 'plan': []}
+        for path in (self.log_path, self.log_path + '.1'):
+            with open(path, 'w') as f:
+                f.write(json.dumps(entry) + '\n')
+
+        out = StringIO()
+        call_command('slow_query_report', log=self.log_path, by='view', stdout=out)
+        self.assertIn('100.0 ms total, 2 call(s)', out.getvalue())
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_tuned_profile(self):
+        config = database_settings(Path('/srv'), environ={})
+        self.assertEqual(config['NAME'], Path('/srv/db.sqlite3'))
+        self.assertGreater(config['CONN_MAX_AGE'], 0)
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertIn('PRAGMA journal_mode=WAL', config['OPTIONS']['init_command'])
+        self.assertIn('PRAGMA synchronous=NORMAL', config['OPTIONS']['init_command'])
+
+    def test_legacy_sqlite_profile(self):
+        config = database_settings(Path('/srv'), environ={'DB_PROFILE': 'sqlite'})
+        self.assertNotIn('OPTIONS', config)
+
+    def test_postgres_profile(self):
+        config = database_settings(Path('/srv'), environ={'DB_PROFILE': 'postgres', 'DB_POOL_MAX_SIZE': '20'})
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(config['OPTIONS']['pool']['max_size'], 20)
+        self.assertNotIn('CONN_MAX_AGE', config)
+
+        config = database_settings(Path('/srv'), environ={'DB_PROFILE': 'postgres', 'DB_POOL': '0'})
+        self.assertNotIn('pool', config['OPTIONS'])
+        self.assertGreater(config['CONN_MAX_AGE'], 0)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ImproperlyConfigured):
+            database_settings(Path('/srv'), environ={'DB_PROFILE': 'mysql'})
+
+
+@override_settings(PAYMENTS_ASYNC=False, PAYMENT_GATEWAY=INSTANT_GATEWAY)
+class ReadReplicaRouterTests(TransactionTestCase):
+    """The replica alias mirrors the test database; tests check which alias served reads."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        replica = dict(connections['default'].settings_dict)
+        replica['TEST'] = dict(replica['TEST'], MIRROR='default')
+        connections.settings[REPLICA_DATABASE] = replica
+        cls.databases = {'default', REPLICA_DATABASE}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.databases = {'default'}
+        connections[REPLICA_DATABASE].close()
+        del connections[REPLICA_DATABASE]
+        del connections.settings[REPLICA_DATABASE]
+
+    def setUp(self):
+        cache.clear()
+        owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.client.login(username='customer', password='pass')
+
+    def replica_queries(self, path):
+        with CaptureQueriesContext(connections[REPLICA_DATABASE]) as replica:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(replica)
+
+    def test_dashboard_and_catalogue_read_from_replica(self):
+        self.assertGreater(self.replica_queries(reverse('customer_dashboard')), 0)
+        self.assertGreater(self.replica_queries(reverse('menu')), 0)
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        response = self.client.post(
+            reverse('payment_page', args=[self.plan.id]),
+            {'card_number': '4111', 'expiry': '12/30', 'cvv': '123'},
+        )
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.replica_queries(reverse('customer_dashboard')), 0)
+
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            self.client.post(
+                reverse('payment_page', args=[self.plan.id]),
+                {'card_number': '4111', 'expiry': '12/30', 'cvv': '123'},
+            )
+        self.client.cookies[STICKY_COOKIE] = '0'
+        self.assertGreater(self.replica_queries(reverse('customer_dashboard')), 0)
+
+    def test_unmarked_views_use_primary(self):
+        with CaptureQueriesContext(connections[REPLICA_DATABASE]) as replica:
+            self.client.get(reverse('payment_page', args=[self.plan.id]))
+        self.assertEqual(len(replica), 0)
+
+
+class SqliteReplicationStandInTests(TestCase):
+    def test_replica_lags_until_synced(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        primary_path = os.path.join(directory, 'primary.sqlite3')
+        replica_path = os.path.join(directory, 'replica.sqlite3')
+
+        primary = sqlite3.connect(primary_path)
+        primary.execute('CREATE TABLE payment (id INTEGER PRIMARY KEY)')
+        primary.execute('INSERT INTO payment VALUES (1)')
+        primary.commit()
+        sync_sqlite_replica(primary_path, replica_path)
+
+        primary.execute('INSERT INTO payment VALUES (2)')
+        primary.commit()
+        primary.close()
+
+        replica = sqlite3.connect(replica_path)
+        self.assertEqual(replica.execute('SELECT COUNT(*) FROM payment').fetchone()[0], 1)
+        replica.close()
+
+        sync_sqlite_replica(primary_path, replica_path)
+        replica = sqlite3.connect(replica_path)
+        self.assertEqual(replica.execute('SELECT COUNT(*) FROM payment').fetchone()[0], 2)
+        replica.close()
+
+
+class AsyncDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        make_customer_subscription(self.customer, self.plan)
+
+    async def test_owner_dashboard_over_asgi(self):
+        await self.async_client.alogin(username='owner', password='pass')
+        response = await self.async_client.get(reverse('owner_dashboard'))
+        self.assertContains(response, 'customer')
+        self.assertContains(response, 'Veg Thali')
+
+    async def test_customer_dashboard_over_asgi(self):
+        await self.async_client.alogin(username='customer', password='pass')
+        response = await self.async_client.get(reverse('customer_dashboard'))
+        self.assertContains(response, 'Veg Thali')
+        self.assertEqual(response.context['total_subscriptions'], 1)
+
+    async def test_async_helpers_match_sync_versions(self):
+        self.assertEqual(
+            await acalculate_owner_revenue(self.owner),
+            await sync_to_async(calculate_owner_revenue)(self.owner),
+        )
+        stats = await aget_customer_dashboard_stats(self.customer)
+        sync_stats = await sync_to_async(get_customer_dashboard_stats)(self.customer)
+        self.assertEqual(stats['total_subscriptions'], sync_stats['total_subscriptions'])
+        self.assertEqual(stats['primary_subscription'], sync_stats['primary_subscription'])
+        self.assertEqual(len(stats['active_subscriptions']), 1)
+
+
+class PaymentCommitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        # Warm the ledger and menu-owner cache the way earlier payments would
+        handle_payment_success(User.objects.create_user(username='other'), self.plan)
+
+    def test_payment_commit_query_budget(self):
+        # (SAVEPOINT around the call,) SAVEPOINT, INSERT, RELEASE,
+        # new-subscriber check, two ledger UPDATEs, (RELEASE)
+        with self.assertNumQueries(8):
+            created = handle_payment_success(self.customer, self.plan, idempotency_key='k-1')
+        self.assertTrue(created.is_active)
+        self.assertEqual(created.idempotency_key, 'k-1')
+
+    def test_retry_with_same_key_returns_same_subscription(self):
+        first = handle_payment_success(self.customer, self.plan, idempotency_key='k-1')
+        retry = handle_payment_success(self.customer, self.plan, idempotency_key='k-1')
+        self.assertEqual(retry, first)
+        self.assertEqual(CustomerSubscription.objects.filter(customer=self.customer).count(), 1)
+        self.assertEqual(calculate_owner_revenue(self.owner)['total_revenue'], Decimal('4000'))
+
+    def test_duplicate_without_matching_key_is_rejected(self):
+        handle_payment_success(self.customer, self.plan, idempotency_key='k-1')
+        self.assertIsNone(handle_payment_success(self.customer, self.plan))
+        self.assertIsNone(handle_payment_success(self.customer, self.plan, idempotency_key='k-2'))
+
+    def test_key_of_another_customer_is_not_returned(self):
+        handle_payment_success(self.customer, self.plan, idempotency_key='k-1')
+        intruder = User.objects.create_user(username='intruder')
+        self.assertIsNone(handle_payment_success(intruder, self.plan, idempotency_key='k-1'))
+
+    def test_lapsed_subscription_is_replaced(self):
+        lapsed = make_customer_subscription(
+            self.customer, self.plan, end_date=timezone.now() - timedelta(days=1)
+        )
+        created = handle_payment_success(self.customer, self.plan)
+        self.assertIsNotNone(created)
+        lapsed.refresh_from_db()
+        self.assertFalse(lapsed.is_active)
+
+    @override_settings(PAYMENTS_ASYNC=False, PAYMENT_GATEWAY=INSTANT_GATEWAY)
+    def test_double_submitted_form_shows_success(self):
+        self.client.login(username='customer', password='pass')
+        form = {'card_number': '4111', 'expiry': '12/30', 'cvv': '123', 'idempotency_key': 'form-1'}
+        url = reverse('payment_page', args=[self.plan.id])
+        self.client.post(url, form)
+        response = self.client.post(url, form, follow=True)
+        self.assertContains(response, 'Payment successful')
+        self.assertEqual(CustomerSubscription.objects.filter(customer=self.customer).count(), 1)
+
+
+class ConcurrentPaymentTests(SimpleTestCase):
+    """
+    Runs `manage.py stress_payments` in a subprocess: real concurrency needs a
+    file-backed database, not the suite's in-memory one.
+    """
+
+    def stress(self, keys):
+        return subprocess.run(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'stress_payments',
+             '--customers', '5', '--submissions', '6', '--keys', keys],
+            capture_output=True, text=True, env=dict(os.environ, DB_PROFILE='sqlite-tuned'),
+        )
+
+    def test_concurrent_double_submit_with_one_key(self):
+        result = self.stress('same')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('30 submissions: 5 created, 25 answered from an earlier attempt', result.stdout)
+
+    def test_concurrent_distinct_submissions_create_one_subscription(self):
+        result = self.stress('distinct')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('5 created, 0 answered from an earlier attempt, 25 rejected as duplicates, 0 errors', result.stdout)
+
+
+class FlakyGateway:
+    """Fails each charge with the given errors first, then succeeds."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.charges = 0
+
+    def charge(self, amount, reference):
+        self.charges += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return f'ref-{reference}'
+
+
+@override_settings(PAYMENT_GATEWAY=INSTANT_GATEWAY)
+class PaymentPipelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.client.login(username='customer', password='pass')
+        self.form = {'card_number': '4111', 'expiry': '12/30', 'cvv': '123', 'idempotency_key': 'form-1'}
+
+    def test_submit_returns_before_payment_is_confirmed(self):
+        response = self.client.post(reverse('payment_page', args=[self.plan.id]), self.form)
+        intent = PaymentIntent.objects.get()
+        self.assertRedirects(response, reverse('payment_status', args=[intent.id]))
+        self.assertEqual(intent.status, 'pending')
+        self.assertFalse(CustomerSubscription.objects.exists())
+
+        status = self.client.get(reverse('payment_status_json', args=[intent.id])).json()
+        self.assertEqual(status, {'status': 'pending', 'final': False, 'error': ''})
+        self.assertContains(self.client.get(response.url), 'Confirming your payment')
+
+    def test_worker_activates_subscription(self):
+        self.client.post(reverse('payment_page', args=[self.plan.id]), self.form)
+        self.client.post(reverse('payment_page', args=[self.plan.id]), self.form)
+        self.assertEqual(PaymentIntent.objects.count(), 1)
+
+        self.assertEqual(run_worker_once('test-worker'), {'succeeded': 1})
+        intent = PaymentIntent.objects.get()
+        self.assertEqual(intent.customer_subscription.idempotency_key, 'form-1')
+        self.assertTrue(intent.gateway_reference)
+
+        response = self.client.get(reverse('payment_status', args=[intent.id]), follow=True)
+        self.assertRedirects(response, reverse('customer_dashboard'))
+        self.assertContains(response, 'Payment successful')
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        intent = create_payment_intent(self.customer, self.plan, 'k-1')
+        gateway = FlakyGateway(GatewayError('timeout'))
+
+        [claimed] = claim_intents('w1')
+        self.assertEqual(process_intent(claimed, gateway), 'pending')
+        self.assertEqual(claim_intents('w1'), [])  # Backing off
+
+        [claimed] = claim_intents('w1', now=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(process_intent(claimed, gateway), 'succeeded')
+        intent.refresh_from_db()
+        self.assertEqual(intent.attempts, 2)
+        self.assertEqual(CustomerSubscription.objects.filter(customer=self.customer).count(), 1)
+
+    @override_settings(PAYMENT_MAX_ATTEMPTS=1)
+    def test_declined_and_exhausted_payments_fail(self):
+        declined = create_payment_intent(self.customer, self.plan, 'k-1')
+        [claimed] = claim_intents('w1')
+        self.assertEqual(process_intent(claimed, FlakyGateway(PaymentDeclined('Card declined'))), 'failed')
+
+        other = User.objects.create_user(username='other')
+        create_payment_intent(other, self.plan, 'k-2')
+        [claimed] = claim_intents('w1')
+        self.assertEqual(process_intent(claimed, FlakyGateway(GatewayError('timeout'))), 'failed')
+        self.assertFalse(CustomerSubscription.objects.exists())
+
+        response = self.client.get(reverse('payment_status', args=[declined.id]))
+        self.assertContains(response, 'Card declined')
+
+    def test_expired_lease_is_reclaimed(self):
+        create_payment_intent(self.customer, self.plan, 'k-1')
+        [stuck] = claim_intents('dead-worker')
+        self.assertEqual(claim_intents('w2'), [])
+
+        later = timezone.now() + timedelta(minutes=5)
+        [claimed] = claim_intents('w2', now=later)
+        self.assertEqual(process_intent(claimed, FlakyGateway()), 'succeeded')
+        # The dead worker's late result is discarded
+        process_intent(stuck, FlakyGateway(PaymentDeclined('late')))
+        self.assertEqual(PaymentIntent.objects.get().status, 'succeeded')
+
+    def test_already_subscribed_customer_is_refused(self):
+        make_customer_subscription(self.customer, self.plan)
+        self.assertIsNone(create_payment_intent(self.customer, self.plan, 'k-1'))
+
+    def test_status_is_private_to_its_customer(self):
+        intent = create_payment_intent(self.customer, self.plan, 'k-1')
+        User.objects.create_user(username='intruder', password='pass')
+        self.client.login(username='intruder', password='pass')
+        self.assertEqual(self.client.get(reverse('payment_status_json', args=[intent.id])).status_code, 404)
+        self.assertIsNone(create_payment_intent(User.objects.get(username='intruder'), self.plan, 'k-1'))
+
+    def test_process_payments_command(self):
+        create_payment_intent(self.customer, self.plan, 'k-1')
+        out = StringIO()
+        call_command('process_payments', stdout=out)
+        self.assertIn('Processed 1 intent(s): 1 succeeded.', out.getvalue())
+
+
+class SubscriptionImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        _, self.other_menu, _ = make_owner_menu(username='other_owner', title='Other Thali')
+        self.existing = User.objects.create_user(username='existing', password='pass')
+        make_customer_subscription(self.existing, self.plan)
+
+    def run_import(self, text, **kwargs):
+        return import_subscriptions(self.owner, StringIO(text), batch_size=2, **kwargs)
+
+    def test_imports_rows_in_batches_and_reports_errors(self):
+        result = self.run_import(
+            'Username,Email,Menu,Plan,Start_Date\n'
+            'asha,asha@example.com,Veg Thali,Monthly,\n'
+            'ravi,,veg thali,,\n'
+            'asha,,Veg Thali,,\n'                   # second active row for asha
+            'existing,,Veg Thali,,\n'               # already active in the database
+            'meera,,Other Thali,,\n'                # another owner's menu
+            'bad name,,Veg Thali,,\n'
+            'kiran,,Veg Thali,,31/12/2026\n'
+            'lapsed,,Veg Thali,,2020-01-01\n'       # ended: imported as history
+        )
+        self.assertEqual(result['rows'], 8)
+        self.assertEqual(result['created_subscriptions'], 3)
+        self.assertEqual(result['created_customers'], 3)
+        self.assertEqual([line for line, _ in result['errors']], [4, 5, 6, 7, 8])
+        self.assertIn('already has an active subscription', result['errors'][0][1])
+
+        ravi = CustomerSubscription.objects.get(customer__username='ravi')
+        self.assertEqual(ravi.end_date - ravi.start_date, timedelta(days=self.plan.duration_in_days))
+        self.assertFalse(User.objects.get(username='ravi').has_usable_password())
+        self.assertFalse(CustomerSubscription.objects.get(customer__username='lapsed').is_active)
+
+        # The ledger is rebuilt after the bulk insert
+        summary = OwnerRevenueSummary.objects.get(owner=self.owner)
+        self.assertEqual(summary.active_subscriptions, 3)
+        self.assertEqual(summary.total_revenue, Decimal('6000'))
+
+    def test_usernames_of_other_accounts_are_not_reused(self):
+        User.objects.create_user(username='stranger', email='stranger@example.com')
+        User.objects.create_user(username='moved', email='moved@example.com')
+        result = self.run_import(
+            'username,email,menu\n'
+            'stranger,,Veg Thali\n'                   # someone else's account
+            'moved,MOVED@example.com,Veg Thali\n'     # the same person
+        )
+        self.assertEqual(result['created_subscriptions'], 1)
+        self.assertEqual([line for line, _ in result['errors']], [2])
+        self.assertIn('taken by another account', result['errors'][0][1])
+        self.assertFalse(CustomerSubscription.objects.filter(customer__username='stranger').exists())
+
+    def test_rolled_back_batch_does_not_block_later_rows(self):
+        bulk_create = CustomerSubscription.objects.bulk_create
+        calls = []
+
+        def conflict_once(objs, *args, **kwargs):
+            calls.append(objs)
+            if len(calls) == 1:
+                raise IntegrityError('concurrent payment')
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(CustomerSubscription.objects, 'bulk_create', side_effect=conflict_once):
+            result = self.run_import('username,menu\nasha,Veg Thali\nravi,Veg Thali\nasha,Veg Thali\n')
+        self.assertEqual([line for line, _ in result['errors']], [2, 3])
+        self.assertIn('concurrent change', result['errors'][0][1])
+        self.assertEqual(result['created_subscriptions'], 1)
+        self.assertTrue(CustomerSubscription.objects.filter(customer__username='asha', is_active=True).exists())
+
+    def test_dry_run_writes_nothing(self):
+        result = self.run_import('username,menu\nasha,Veg Thali\nasha,Veg Thali\nravi,Veg Thali\n', dry_run=True)
+        self.assertEqual((result['created_subscriptions'], result['created_customers']), (2, 2))
+        self.assertEqual(len(result['errors']), 1)
+        self.assertFalse(User.objects.filter(username__in=['asha', 'ravi']).exists())
+
+    def test_missing_columns(self):
+        result = self.run_import('name,plan\nasha,Monthly\n')
+        self.assertEqual(result['errors'], [(1, 'Missing column(s): username, menu.')])
+
+    def test_owner_upload_and_command(self):
+        self.client.login(username='owner', password='pass')
+        upload = SimpleUploadedFile('customers.csv', b'\xef\xbb\xbfusername,menu\nasha,Veg Thali\n', content_type='text/csv')
+        response = self.client.post(reverse('import_subscriptions'), {'csv_file': upload})
+        self.assertContains(response, 'Imported 1 subscription(s) and 1 new customer(s).')
+
+        path = os.path.join(tempfile.mkdtemp(), 'customers.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), ignore_errors=True)
+        Path(path).write_text('username,menu\nravi,Veg Thali\nasha,Veg Thali\n')
+        out = StringIO()
+        call_command('import_subscriptions', 'owner', path, stdout=out)
+        self.assertIn('line 3:', out.getvalue())
+        self.assertIn('Imported 1 subscription(s) and 1 new customer(s) from 2 row(s); 1 error(s).', out.getvalue())
+
+
+class MealArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.subscription = make_customer_subscription(self.customer, self.plan)
+        self.today = date(2026, 10, 17)
+        # Every day from 2026-01-01 to today; every fifth meal skipped
+        start = date(2026, 1, 1)
+        DailyMealTracking.objects.bulk_create([
+            DailyMealTracking(
+                subscription=self.subscription, date=start + timedelta(days=i),
+                status='Skipped' if i % 5 == 0 else 'Taken', taken=i % 5 != 0,
+            )
+            for i in range((self.today - start).days + 1)
+        ])
+        self.history = get_meal_history(self.subscription, start, self.today)
+        self.report = get_owner_meal_report(self.owner, months=12, today=self.today)
+
+    def test_archive_moves_old_months_in_chunks(self):
+        cutoff = archive_cutoff(self.today, hot_months=3)
+        self.assertEqual(cutoff, date(2026, 7, 1))
+        self.assertEqual(archive_meal_tracking(cutoff, chunk_size=40), 181)  # January to June
+
+        self.assertFalse(DailyMealTracking.objects.filter(date__lt=cutoff).exists())
+        self.assertEqual(MonthlyMealRollup.objects.count(), 6)
+        january = MonthlyMealRollup.objects.get(month=date(2026, 1, 1))
+        self.assertEqual((january.taken, january.skipped, len(january.history)), (24, 7, 31))
+        self.assertEqual(archive_meal_tracking(cutoff), 0)
+
+    def test_history_and_report_combine_hot_rows_and_rollups(self):
+        archive_meal_tracking(archive_cutoff(self.today, hot_months=3))
+        start = date(2026, 1, 1)
+        self.assertEqual(get_meal_history(self.subscription, start, self.today), self.history)
+        self.assertEqual(
+            get_meal_history(self.subscription, date(2026, 6, 20), date(2026, 7, 5)),
+            self.history[(date(2026, 6, 20) - start).days:(date(2026, 7, 5) - start).days + 1],
+        )
+        self.assertEqual(
+            async_to_sync(aget_meal_history)(self.subscription, start, self.today), self.history
+        )
+        self.assertEqual(get_owner_meal_report(self.owner, months=12, today=self.today), self.report)
+
+    def test_report_covers_the_requested_months(self):
+        report = get_owner_meal_report(self.owner, months=6, today=self.today)
+        self.assertEqual([row['month'] for row in report], [date(2026, month, 1) for month in range(5, 11)])
+
+    def test_late_meal_in_archived_month_is_merged(self):
+        archive_meal_tracking(archive_cutoff(self.today, hot_months=3))
+        late = date(2026, 2, 1)
+        DailyMealTracking.objects.create(subscription=self.subscription, date=late, status='Taken')
+        self.assertEqual(get_meal_history(self.subscription, late, late), 'T')
+
+        call_command('archive_meal_tracking', '--months', '3', stdout=StringIO())
+        february = MonthlyMealRollup.objects.get(month=date(2026, 2, 1))
+        self.assertEqual(february.history[0], 'T')
+        self.assertEqual(february.taken + february.skipped, 28)
+
+
+class KitchenManifestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.menu.saturday = 'Paneer, rice, roti'
+        self.menu.save()
+        self.weekly = Subscription.objects.create(
+            menu=self.menu, title='Weekly', duration_in_days=7, price=Decimal('600')
+        )
+        other_owner, self.other_menu, self.other_plan = make_owner_menu(username='other', title='Jain Thali')
+        DailyMenu.objects.create(menu=self.other_menu, day='Saturday', food_description='Khichdi')
+
+        self.day = timezone.localdate()
+        subscriptions = []
+        for i in range(5):
+            customer = User.objects.create_user(username=f'customer{i}')
+            subscriptions.append(make_customer_subscription(customer, self.weekly if i == 4 else self.plan))
+            make_customer_subscription(customer, self.other_plan)
+        # Not running today
+        later = User.objects.create_user(username='later')
+        make_customer_subscription(
+            later, self.plan, start_date=timezone.now() + timedelta(days=3),
+            end_date=timezone.now() + timedelta(days=33),
+        )
+        DailyMealTracking.objects.bulk_create([
+            DailyMealTracking(subscription=subscriptions[0], date=self.day, status='Skipped', taken=False),
+            DailyMealTracking(subscription=subscriptions[1], date=self.day, status='Taken'),
+            # Other days never count
+            DailyMealTracking(subscription=subscriptions[2], date=self.day - timedelta(days=1), status='Skipped', taken=False),
+        ])
+
+    def test_counts_net_of_skips_in_one_query_once_dishes_are_cached(self):
+        with self.assertNumQueries(3):
+            build_manifest(self.day, owner=self.owner)
+        with self.assertNumQueries(1):
+            kitchens = build_manifest(self.day, owner=self.owner)
+        [kitchen] = kitchens
+        [menu] = kitchen['menus']
+        self.assertEqual((menu['subscribers'], menu['skipped'], menu['to_cook']), (5, 1, 4))
+        self.assertEqual(
+            [(plan['title'], plan['to_cook']) for plan in menu['plans']],
+            [('Monthly', 3), ('Weekly', 1)],
+        )
+
+    def test_platform_wide_run_and_dishes(self):
+        saturday = self.day + timedelta(days=(5 - self.day.weekday()) % 7)
+        kitchens = build_manifest(saturday)
+        self.assertEqual([kitchen['service'] for kitchen in kitchens], ['other', 'owner'])
+        self.assertEqual(kitchens[0]['menus'][0]['dish'], 'Khichdi')
+        self.assertEqual(kitchens[1]['menus'][0]['dish'], 'Paneer, rice, roti')
+
+    def test_owner_view_and_command(self):
+        self.client.login(username='owner', password='pass')
+        response = self.client.get(reverse('kitchen_manifest'))
+        self.assertContains(response, 'Total to cook: 4')
+        self.assertNotContains(response, 'Jain Thali')
+
+        out = StringIO()
+        call_command('kitchen_manifest', '--date', self.day.isoformat(), stdout=out)
+        self.assertIn('owner: 4 to cook', out.getvalue())
+        self.assertIn('other: 5 to cook', out.getvalue())
+
+    def test_dates_at_the_ends_of_the_calendar_are_invalid(self):
+        self.client.login(username='owner', password='pass')
+        for value in ('9999-12-31', '0001-01-01', 'tomorrow'):
+            response = self.client.get(reverse('kitchen_manifest'), {'date': value})
+            self.assertEqual(response.context['day'], timezone.localdate())
+        with self.assertRaises(CommandError):
+            call_command('kitchen_manifest', '--date', '9999-12-31', stdout=StringIO())
+        self.assertEqual(build_manifest(date(9999, 12, 30)), [])
+
+
+class WeekPlanTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.menu.monday = 'Poha'
+        self.menu.saturday = 'Paneer, rice, roti'
+        self.menu.save()
+        DailyMenu.objects.create(
+            menu=self.menu, day='Saturday', food_description='Chole bhature',
+            image='daily_menu_images/chole.jpg',
+        )
+        self.today = WEEKDAYS[timezone.localdate().weekday()]
+
+    def test_daily_menu_overrides_weekday_field(self):
+        plan = get_week_plans([self.menu.pk])[self.menu.pk]
+        self.assertEqual(plan['Monday'], {'dish': 'Poha', 'image': ''})
+        self.assertEqual(plan['Saturday'], {'dish': 'Chole bhature', 'image': 'daily_menu_images/chole.jpg'})
+        self.assertEqual(plan['Sunday']['dish'], '')
+
+        saturday = timezone.localdate() + timedelta(days=(5 - timezone.localdate().weekday()) % 7)
+        [menu] = attach_todays_dish(Menu.objects.filter(pk=self.menu.pk), day=saturday)
+        self.assertEqual(menu.today['dish'], 'Chole bhature')
+        self.assertEqual(menu.today['image'].url, '/media/daily_menu_images/chole.jpg')
+
+    def test_cached_until_menu_or_daily_menu_changes(self):
+        get_week_plans([self.menu.pk])
+        with self.assertNumQueries(0):
+            get_week_plans([self.menu.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DailyMenu.objects.filter(menu=self.menu, day='Saturday').get().delete()
+            # Still cached until the delete commits
+            self.assertEqual(get_week_plans([self.menu.pk])[self.menu.pk]['Saturday']['dish'], 'Chole bhature')
+        self.assertEqual(get_week_plans([self.menu.pk])[self.menu.pk]['Saturday']['dish'], 'Paneer, rice, roti')
+        self.menu.saturday = 'Veg biryani'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.menu.save()
+        self.assertEqual(get_week_plans([self.menu.pk])[self.menu.pk]['Saturday']['dish'], 'Veg biryani')
+
+    def test_many_menus_resolve_without_queries_per_card(self):
+        for i in range(30):
+            _, menu, _ = make_owner_menu(username=f'owner{i}', title=f'Thali {i}')
+            DailyMenu.objects.create(menu=menu, day=self.today, food_description=f'Special {i}')
+        menus = list(Menu.objects.all())
+        with self.assertNumQueries(2):
+            attach_todays_dish(menus)
+        with self.assertNumQueries(0):
+            menus = attach_todays_dish(menus)
+        self.assertEqual(
+            {menu.today['dish'] for menu in menus if menu.pk != self.menu.pk},
+            {f'Special {i}' for i in range(30)},
+        )
+
+    def test_pages_show_todays_dish(self):
+        DailyMenu.objects.update_or_create(menu=self.menu, day=self.today, defaults={'food_description': 'Rajma chawal'})
+        self.client.login(username='owner', password='pass')
+        self.assertContains(self.client.get(reverse('home')), 'Rajma chawal')
+
+        User.objects.create_user(username='customer', password='pass')
+        self.client.login(username='customer', password='pass')
+        self.assertContains(self.client.get(reverse('menu')), 'Rajma chawal')
+        self.assertContains(self.client.get(reverse('customer_dashboard')), 'Rajma chawal')
+
+
+@override_settings(**CACHED_SESSIONS)
+class UserSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.client.login(username='owner', password='pass')
+
+    def get_warm(self, name):
+        """Response to a repeated request and its session/user queries."""
+        self.client.get(reverse(name))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name))
+        auth_queries = [
+            query['sql'] for query in queries
+            if 'django_session' in query['sql'] or 'FROM "auth_user"' in query['sql']
+        ]
+        return response, auth_queries
+
+    def test_authenticated_requests_skip_session_and_user_queries(self):
+        for name in ('kitchen_manifest', 'owner_dashboard'):
+            response, auth_queries = self.get_warm(name)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(auth_queries, [])
+        self.assertEqual(response.wsgi_request.user.tiffin_service_id, self.menu.tiffin_service_id)
+
+        User.objects.create_user(username='customer', password='pass')
+        self.client.login(username='customer', password='pass')
+        for name in ('menu', 'customer_dashboard'):
+            response, auth_queries = self.get_warm(name)
+            self.assertContains(response, 'Veg Thali')
+            self.assertEqual(auth_queries, [])
+
+    def test_password_change_ends_other_sessions(self):
+        self.get_warm('kitchen_manifest')
+        self.owner.set_password('changed')
+        self.owner.save()
+        self.assertRedirects(
+            self.client.get(reverse('kitchen_manifest')),
+            f"{reverse('login')}?next={reverse('kitchen_manifest')}", fetch_redirect_response=False,
+        )
+
+    def test_role_change_and_logout_drop_the_snapshot(self):
+        self.get_warm('kitchen_manifest')
+        self.owner.is_staff = False
+        self.owner.save()
+        self.assertRedirects(self.client.get(reverse('kitchen_manifest')), reverse('home'), fetch_redirect_response=False)
+
+        self.assertIsNotNone(cache.get(f'user-snapshot:{self.owner.pk}'))
+        self.client.get(reverse('logout'))
+        self.assertIsNone(cache.get(f'user-snapshot:{self.owner.pk}'))
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions(self):
+        self.client.login(username='owner', password='pass')
+        response, auth_queries = self.get_warm('owner_dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(auth_queries, [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_not_used_with_a_per_process_cache(self):
+        # Invalidation would only reach this worker: every request loads the user
+        response, auth_queries = self.get_warm('kitchen_manifest')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('FROM "auth_user"' in sql for sql in auth_queries))
+        self.assertNotIsInstance(response.wsgi_request.user._wrapped, SnapshotUser)
+
+
+@override_settings(**CACHED_SESSIONS)
+class OwnerScopedViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.subscription = make_customer_subscription(self.customer, self.plan)
+        self.client.login(username='owner', password='pass')
+        self.client.get(reverse('owner_dashboard'))  # Caches the session and user snapshot
+
+    def test_menu_views_fetch_and_authorize_in_one_query(self):
+        for name in ('edit_menu', 'add_subscription', 'add_daily_menu'):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse(name, args=[self.menu.pk]))
+            self.assertContains(response, 'Veg Thali')
+
+    def test_toggle_meal_status_queries(self):
+        # 1 to fetch and authorize (with the customer and menu the rest
+        # use); the others record the meal and extend the subscription
+        # (including the revenue ledger's read of the stored row)
+        with self.assertNumQueries(15):
+            response = self.client.get(reverse('toggle_meal', args=[self.subscription.pk]))
+        self.assertRedirects(response, reverse('owner_dashboard'), fetch_redirect_response=False)
+        self.assertTrue(DailyMealTracking.objects.filter(subscription=self.subscription).exists())
+
+    def test_other_owners_objects_are_not_found(self):
+        make_owner_menu(username='intruder')
+        self.client.login(username='intruder', password='pass')
+        for name, pk in (
+            ('edit_menu', self.menu.pk), ('delete_menu', self.menu.pk), ('add_subscription', self.menu.pk),
+            ('add_daily_menu', self.menu.pk), ('toggle_meal', self.subscription.pk),
+        ):
+            self.assertEqual(self.client.get(reverse(name, args=[pk])).status_code, 404)
+            self.assertEqual(self.client.post(reverse(name, args=[pk]), {'title': 'Hacked'}).status_code, 404)
+        self.assertEqual(Menu.objects.get(pk=self.menu.pk).title, 'Veg Thali')
+        self.assertFalse(DailyMealTracking.objects.exists())
+
+    def test_owner_can_delete_own_menu(self):
+        response = self.client.get(reverse('delete_menu', args=[self.menu.pk]))
+        self.assertRedirects(response, reverse('owner_dashboard'), fetch_redirect_response=False)
+        self.assertFalse(Menu.objects.filter(pk=self.menu.pk).exists())
+
+    def test_delete_menu_queries_do_not_grow_with_meal_tracking(self):
+        # Tracking rows have no signal receivers, so the cascade removes
+        # them with one DELETE however many there are
+        today = timezone.localdate()
+        DailyMealTracking.objects.bulk_create([
+            DailyMealTracking(subscription=self.subscription, date=today - timedelta(days=i), status='Taken')
+            for i in range(20)
+        ])
+        with self.assertNumQueries(16):
+            self.client.get(reverse('delete_menu', args=[self.menu.pk]))
+        self.assertFalse(DailyMealTracking.objects.exists())
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner, self.menu, self.plan = make_owner_menu()
+        self.client.login(username='owner', password='pass')
+
+    def subscribe(self, count):
+        customers = User.objects.bulk_create([
+            User(username=f'customer{i}', email=f'c{i}@example.com') for i in range(count)
+        ])
+        now = timezone.now()
+        return CustomerSubscription.objects.bulk_create([
+            CustomerSubscription(
+                customer=customer, subscription=self.plan, menu=self.menu, start_date=now,
+                end_date=now + timedelta(days=10), is_active=True,
+            )
+            for customer in customers
+        ])
+
+    def test_subscriber_export_formats(self):
+        self.subscribe(3)
+        other_owner, other_menu, other_plan = make_owner_menu(username='other', title='Other')
+        make_customer_subscription(User.objects.create_user(username='not_mine'), other_plan)
+
+        response = self.client.get(reverse('export_subscribers'))
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="subscribers-', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'customer,email,menu,plan,start_date,end_date,days_remaining,status')
+        self.assertEqual(len(lines), 4)
+        self.assertIn(',Veg Thali,Monthly,', lines[1])
+        self.assertTrue(lines[1].endswith(',10,Active'))
+
+        response = self.client.get(reverse('export_subscribers'), {'format': 'jsonl'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual({row['customer'] for row in rows}, {'customer0', 'customer1', 'customer2'})
+
+    async def test_asgi_export_streams_from_async_iterator(self):
+        await sync_to_async(self.subscribe)(3)
+        await self.async_client.aforce_login(self.owner)
+
+        response = await self.async_client.get(reverse('export_subscribers'), {'format': 'jsonl'})
+        # A synchronous iterator would be collected into a list first
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual({row['customer'] for row in rows}, {'customer0', 'customer1', 'customer2'})
+
+    def test_meal_history_includes_archived_months(self):
+        [subscription] = self.subscribe(1)
+        DailyMealTracking.objects.bulk_create([
+            DailyMealTracking(subscription=subscription, date=date(2026, 1, 31), status='Skipped', taken=False),
+            DailyMealTracking(subscription=subscription, date=date(2026, 2, 1), status='Taken'),
+            DailyMealTracking(subscription=subscription, date=date(2026, 9, 1), status='Taken'),
+        ])
+        archive_meal_tracking(date(2026, 3, 1))
+
+        response = self.client.get(reverse('export_meal_history'), {'start': '2026-01-31', 'end': '2026-09-01'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([line.split(',')[0] + ',' + line.split(',')[-1] for line in lines[1:]], [
+            '2026-01-31,Skipped', '2026-02-01,Taken', '2026-09-01,Taken',
+        ])
+
+    def test_million_row_export_streams_in_constant_memory(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Seeds the rows with a SQLite recursive CTE.')
+        subscriptions = self.subscribe(1000)
+        with connection.cursor() as cursor:
+            # 1000 days x 1000 subscriptions, generated inside the database
+            cursor.execute(
+                f"""
+                WITH RECURSIVE days(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM days WHERE n < 999)
+                INSERT INTO {DailyMealTracking._meta.db_table} (subscription_id, date, status, taken, created_at)
+                SELECT s.id, date('2024-01-01', '+' || days.n || ' days'),
+                       CASE WHEN (s.id + days.n) % 7 = 0 THEN 'Skipped' ELSE 'Taken' END, 1, NULL
+                FROM days, {CustomerSubscription._meta.db_table} s
+                WHERE s.id BETWEEN %s AND %s
+                """,
+                [subscriptions[0].pk, subscriptions[-1].pk],
+            )
+        response = self.client.get(reverse('export_meal_history'), {'start': '2024-01-01', 'end': '2026-12-31'})
+
+        # Trace allocations over rows 100k-300k: anything kept per row would
+        # show up as retained memory (tracing the whole export is too slow)
+        lines = 0
+        try:
+            for chunk in response.streaming_content:
+                lines += chunk.count(b'\n')
+                if 100_000 <= lines < 300_000 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                elif lines >= 300_000 and tracemalloc.is_tracing():
+                    retained, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(lines, 1_000_001)
+        # At most about one chunk of rows in flight (a leak of 200k rows
+        # would retain tens of MB)
+        self.assertLess(retained, 2 * 1024 * 1024)
+        self.assertLess(peak, 4 * 1024 * 1024)
@@ -13,7 +13,10 @@ urlpatterns = [
     path('customer-dashboard/', views.customer_dashboard, name='customer_dashboard'),
     path('subscribe/<int:subscription_id>/', views.subscribe, name='subscribe'),
     path('payment/<int:subscription_id>/', views.payment_page, name='payment_page'),
+    path('payment/status/<int:intent_id>/', views.payment_status, name='payment_status'),
+    path('payment/status/<int:intent_id>/json/', views.payment_status_json, name='payment_status_json'),
     path('toggle-meal/<int:subscription_id>/', views.toggle_meal_status, name='toggle_meal'),
+    path('toggle-meal/bulk/', views.bulk_mark_meal_status, name='bulk_mark_meals'),
 
 
 
@@ -31,6 +34,12 @@ urlpatterns = [
     name='select_menu_for_subscription'
 ),
     path('add-daily-menu/<int:menu_id>/', views.add_daily_menu, name='add_daily_menu'),
+    path('import-subscriptions/', views.import_subscriptions, name='import_subscriptions'),
+    path('kitchen-manifest/', views.kitchen_manifest, name='kitchen_manifest'),
+    path('export/subscribers/', views.export_subscribers, name='export_subscribers'),
+    path('export/meal-history/', views.export_meal_history, name='export_meal_history'),
+
+    path('metrics/', views.metrics, name='metrics'),
 
 
 
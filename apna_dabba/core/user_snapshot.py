@@ -0,0 +1,205 @@
+"""
+Authenticated users resolved from a cached snapshot.
+
+Django's AuthenticationMiddleware fetches the auth_user row on every
+authenticated request. UserSnapshotMiddleware (placed after it) resolves
+request.user / request.auser to a SnapshotUser instead: pk, username,
+is_staff, is_active and the owner's TiffinService id come from a per-user
+cache entry, so login_required, the role decorators in core.decorators and
+ownership filters (`owner=request.user`) need no query. Any other attribute
+loads the real User once.
+
+The snapshot holds the user's session auth hash and is only used while it
+matches the session's (the check django.contrib.auth.get_user makes), so a
+password change still logs the user's other sessions out. Signal handlers
+drop it when the User or their TiffinService changes and on logout.
+
+The snapshot needs a cache shared by all workers, otherwise invalidation
+only reaches the worker that made the change; with LocMemCache the
+middleware is not used.
+
+Reading the session itself needs no query with SESSION_MODE cached_db or
+signed_cookies (see settings).
+"""
+from functools import partial
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject, empty
+
+from .models import TiffinService
+
+
+PROCESS_LOCAL_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+def snapshot_enabled():
+    """USER_SNAPSHOT is on and the default cache is shared between workers."""
+    return (
+        getattr(settings, 'USER_SNAPSHOT', False)
+        and settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+    )
+
+
+def get_user_snapshot_timeout():
+    """Seconds a user snapshot lives (USER_SNAPSHOT_TIMEOUT, default 1 hour)."""
+    return getattr(settings, 'USER_SNAPSHOT_TIMEOUT', 60 * 60)
+
+
+def _snapshot_key(user_id):
+    return f'user-snapshot:{user_id}'
+
+
+def invalidate_user_snapshot(user_id):
+    """Drop a user's cached snapshot."""
+    cache.delete(_snapshot_key(user_id))
+
+
+def _snapshot(user, tiffin_service_id):
+    return {
+        'id': user.pk,
+        'username': user.get_username(),
+        'is_staff': user.is_staff,
+        'is_active': user.is_active,
+        'tiffin_service_id': tiffin_service_id,
+        'session_hash': user.get_session_auth_hash(),
+    }
+
+
+def build_snapshot(user):
+    """The cached fields of user (one query for an owner's TiffinService)."""
+    tiffin_service_id = None
+    if user.is_staff:
+        tiffin_service_id = TiffinService.objects.filter(owner=user).values_list('id', flat=True).first()
+    return _snapshot(user, tiffin_service_id)
+
+
+async def abuild_snapshot(user):
+    """Async build_snapshot()."""
+    tiffin_service_id = None
+    if user.is_staff:
+        tiffin_service_id = await TiffinService.objects.filter(owner=user).values_list('id', flat=True).afirst()
+    return _snapshot(user, tiffin_service_id)
+
+
+# User attributes set on instances rather than defined on the class
+INSTANCE_ATTRIBUTES = {'_state', '_password', 'backend'}
+
+
+class SnapshotUser(SimpleLazyObject):
+    """
+    A User answering from a snapshot; anything else loads the User.
+
+    Passes isinstance(user, User), compares equal to the same User and can
+    be used as a query value.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, snapshot, load_user):
+        super().__init__(load_user)
+        self.__dict__['snapshot'] = snapshot
+
+    pk = id = property(lambda self: self.snapshot['id'])
+    username = property(lambda self: self.snapshot['username'])
+    is_staff = property(lambda self: self.snapshot['is_staff'])
+    is_active = property(lambda self: self.snapshot['is_active'])
+    tiffin_service_id = property(lambda self: self.snapshot['tiffin_service_id'])
+    _meta = property(lambda self: get_user_model()._meta)
+
+    @property
+    def __class__(self):
+        return get_user_model()
+
+    def __getattr__(self, name):
+        # Probes for attributes no User has (the ORM's hasattr(value,
+        # 'resolve_expression') on query values) must not load the user
+        if self._wrapped is empty and name not in INSTANCE_ATTRIBUTES and not hasattr(get_user_model(), name):
+            raise AttributeError(name)
+        return super().__getattr__(name)
+
+    def get_username(self):
+        return self.username
+
+    def _is_pk_set(self, meta=None):
+        return self.pk is not None
+
+    def __getitem__(self, key):
+        # Templates try user[name] before user.name; a User has no items
+        raise TypeError(f"'{get_user_model().__name__}' object is not subscriptable")
+
+    def __eq__(self, other):
+        if isinstance(other, get_user_model()):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.username
+
+
+def _session_user_id(request):
+    """User ID of a logged-in session, without loading the user."""
+    try:
+        user_id = get_user_model()._meta.pk.to_python(request.session[SESSION_KEY])
+        backend = request.session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return None
+    return user_id if backend in settings.AUTHENTICATION_BACKENDS else None
+
+
+def _valid(request, snapshot):
+    return snapshot is not None and constant_time_compare(
+        request.session.get(HASH_SESSION_KEY, ''), snapshot['session_hash']
+    )
+
+
+def get_user(request):
+    """request.user: a SnapshotUser when logged in, else auth.get_user()."""
+    if not hasattr(request, '_cached_user'):
+        user_id = _session_user_id(request)
+        snapshot = cache.get(_snapshot_key(user_id)) if user_id is not None else None
+        if _valid(request, snapshot):
+            user = SnapshotUser(snapshot, partial(auth.get_user, request))
+        else:
+            # auth.get_user() verifies the session (and flushes a stale one)
+            user = loaded = auth.get_user(request)
+            if loaded.is_authenticated:
+                snapshot = build_snapshot(loaded)
+                cache.set(_snapshot_key(loaded.pk), snapshot, get_user_snapshot_timeout())
+                user = SnapshotUser(snapshot, lambda: loaded)
+        request._cached_user = user
+    return request._cached_user
+
+
+async def aget_user(request):
+    """request.auser(): async get_user()."""
+    if not hasattr(request, '_acached_user'):
+        user_id = await request.session.aget(SESSION_KEY)
+        backend = await request.session.aget(BACKEND_SESSION_KEY)
+        snapshot = None
+        if user_id is not None and backend in settings.AUTHENTICATION_BACKENDS:
+            snapshot = await cache.aget(_snapshot_key(get_user_model()._meta.pk.to_python(user_id)))
+        if snapshot is not None and constant_time_compare(
+            await request.session.aget(HASH_SESSION_KEY, ''), snapshot['session_hash']
+        ):
+            user = SnapshotUser(snapshot, partial(auth.get_user, request))
+        else:
+            user = loaded = await auth.aget_user(request)
+            if loaded.is_authenticated:
+                snapshot = await abuild_snapshot(loaded)
+                await cache.aset(_snapshot_key(loaded.pk), snapshot, get_user_snapshot_timeout())
+                user = SnapshotUser(snapshot, lambda: loaded)
+        request._acached_user = user
+    return request._acached_user
+
+
+def install(request):
+    """Replace AuthenticationMiddleware's request.user and request.auser."""
+    request.user = SimpleLazyObject(partial(get_user, request))
+    request.auser = partial(aget_user, request)
@@ -1,11 +1,77 @@
 """
 Business logic utilities for Apna Dabba SaaS system.
+
+Functions prefixed with `a` (acalculate_owner_revenue, ...) are async
+counterparts for the ASGI dashboard views; they use the async ORM and run
+independent queries concurrently.
 """
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction, IntegrityError
 from django.utils import timezone
-from datetime import date, timedelta
-from django.db.models import Sum, Count, Q
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from django.db.models import Sum, Count, Q, F
+from django.db.models.functions import TruncMonth
 from decimal import Decimal
-from .models import CustomerSubscription, DailyMealTracking
+from .models import (
+    CustomerSubscription, DailyMealTracking, MonthlyMealRollup, ScheduledJob,
+    OwnerRevenueSummary, OwnerMonthlyRevenue,
+)
+from .dashboard_cache import bump_owner_version
+from .metrics import inc_event
+from .revenue import (
+    record_subscriptions_deactivated,
+    rebuild_owner_revenue,
+)
+
+
+EXPIRY_JOB_NAME = 'subscription_expiry'
+
+# Owner dashboard subscriber list
+SUBSCRIBERS_PAGE_SIZE = 50
+EXPIRING_SOON_DAYS = 7
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# One character per day in compact meal history strings
+MEAL_HISTORY_CODES = {'Taken': 'T', 'Skipped': 'S'}
+MEAL_HISTORY_EMPTY = '-'
+
+
+def shift_months(month, months):
+    """First day of the month `months` after (or before, if negative) month."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def deactivate_subscriptions(queryset):
+    """
+    Deactivate the active subscriptions in queryset and remove them from the
+    owner revenue ledger.
+
+    Returns: number of deactivated subscriptions
+    """
+    with transaction.atomic():
+        rows = list(queryset.filter(is_active=True).order_by().values(
+            'id', 'customer_id', 'created_at',
+            price=F('subscription__price'),
+            owner_id=F('menu__tiffin_service__owner_id'),
+        ))
+        ids = [row['id'] for row in rows]
+
+        deactivated = 0
+        for i in range(0, len(ids), 500):
+            deactivated += CustomerSubscription.objects.filter(
+                pk__in=ids[i:i + 500]
+            ).update(is_active=False)
+
+        record_subscriptions_deactivated(rows)
+
+    for owner_id in {row['owner_id'] for row in rows}:
+        bump_owner_version(owner_id)
+
+    return deactivated
 
 
 def deactivate_expired_subscriptions():
@@ -13,15 +79,46 @@ def deactivate_expired_subscriptions():
     Auto-expiry rule: Deactivate subscriptions where end_date has passed.
     This should be called periodically (via middleware or cron).
     """
-    expired_count = CustomerSubscription.objects.filter(
-        end_date__lt=timezone.now(),
-        is_active=True
-    ).update(is_active=False)
+    expired_count = deactivate_subscriptions(
+        CustomerSubscription.objects.filter(end_date__lt=timezone.now())
+    )
+    inc_event('subscription_expiries', expired_count)
     
     return expired_count
 
 
-def handle_payment_success(customer, subscription):
+def get_expiry_interval():
+    """Seconds between expiry runs (SUBSCRIPTION_EXPIRY_INTERVAL, default 5 min)."""
+    return getattr(settings, 'SUBSCRIPTION_EXPIRY_INTERVAL', 300)
+
+
+def run_expiry_if_due(now=None, interval=None):
+    """
+    Throttled auto-expiry: run deactivate_expired_subscriptions() at most once
+    per interval across all worker processes.
+
+    The ScheduledJob row acts as the shared "last run" marker; a conditional
+    UPDATE claims the run, so only one process wins per interval.
+
+    Returns: number of expired subscriptions, or None if the run was not due
+    """
+    if now is None:
+        now = timezone.now()
+    if interval is None:
+        interval = get_expiry_interval()
+
+    job, _ = ScheduledJob.objects.get_or_create(name=EXPIRY_JOB_NAME)
+    claimed = ScheduledJob.objects.filter(pk=job.pk).filter(
+        Q(last_run_at__isnull=True) | Q(last_run_at__lte=now - timedelta(seconds=interval))
+    ).update(last_run_at=now)
+
+    if not claimed:
+        return None  # Another worker already ran it
+
+    return deactivate_expired_subscriptions()
+
+
+def handle_payment_success(customer, subscription, idempotency_key=None):
     """
     Rule 1: On Payment Success
     - Create CustomerSubscription
@@ -29,39 +126,60 @@ def handle_payment_success(customer, subscription):
     - end_date = today + duration_days
     - is_active = True
     
+    The INSERT itself is the duplicate check: the
+    unique_active_subscription_per_customer_menu constraint lets exactly one
+    of several concurrent submissions succeed, without a read-then-write
+    race. With an idempotency_key, a retried or double-submitted payment
+    returns the subscription the first attempt created.
+    
     Returns: CustomerSubscription instance or None if duplicate exists
     """
-    # Prevent duplicate active subscription
-    existing = CustomerSubscription.objects.filter(
-        customer=customer,
-        menu=subscription.menu,
-        is_active=True
-    ).first()
-    
-    if existing:
-        return None  # Already subscribed
-    
-    # Deactivate any other active subscriptions for this customer+menu
-    CustomerSubscription.objects.filter(
-        customer=customer,
-        menu=subscription.menu,
-        is_active=True
-    ).update(is_active=True)
-    
-    # Create new subscription
-    customer_subscription = CustomerSubscription.objects.create(
+    now = timezone.now()
+    customer_subscription = CustomerSubscription(
         customer=customer,
         subscription=subscription,
-        menu=subscription.menu,
-        start_date=timezone.now(),
-        end_date=timezone.now() + timedelta(days=subscription.duration_in_days),
+        menu_id=subscription.menu_id,
+        start_date=now,
+        end_date=now + timedelta(days=subscription.duration_in_days),
         is_active=True,
-        payment_status="Paid"
+        payment_status="Paid",
+        idempotency_key=idempotency_key or None,
     )
     
+    with transaction.atomic():
+        if not _insert_subscription(customer_subscription):
+            if idempotency_key:
+                existing = CustomerSubscription.objects.filter(idempotency_key=idempotency_key).first()
+                if existing is not None:
+                    # A retry of an earlier payment (never another customer's)
+                    return existing if existing.customer_id == customer.pk else None
+            
+            # Lapsed subscriptions the expiry job has not reached yet still
+            # hold the constraint; deactivate them and try once more
+            lapsed = deactivate_subscriptions(CustomerSubscription.objects.filter(
+                customer=customer,
+                menu_id=subscription.menu_id,
+                end_date__lt=now
+            ))
+            if not lapsed or not _insert_subscription(customer_subscription):
+                return None  # Already subscribed
+    # The post_save handler in core.signals adds it to the revenue ledger
+    inc_event('payments')
+    
     return customer_subscription
 
 
+def _insert_subscription(customer_subscription):
+    """INSERT relying on database constraints; False on a unique violation."""
+    try:
+        with transaction.atomic():
+            customer_subscription.save(force_insert=True, validate=False)
+    except IntegrityError:
+        customer_subscription.pk = None
+        return False
+    return True
+
+
 def handle_skip_extension(customer_subscription, tracking_date=None):
     """
     Rule 2: Skip Extension
@@ -72,7 +190,7 @@ def handle_skip_extension(customer_subscription, tracking_date=None):
         tracking_date: Date to mark as skipped (defaults to today)
     """
     if tracking_date is None:
-        tracking_date = date.today()
+        tracking_date = timezone.localdate()
     
     # Create or update tracking entry
     tracking, created = DailyMealTracking.objects.get_or_create(
@@ -84,6 +202,7 @@ def handle_skip_extension(customer_subscription, tracking_date=None):
     # If marking as skipped for first time, extend subscription
     if created and tracking.status == 'Skipped':
         customer_subscription.extend_by_days(1)
+        inc_event('meal_skips')
     
     # If updating existing entry to skipped, extend
     elif tracking.status != 'Skipped':
@@ -91,58 +210,334 @@ def handle_skip_extension(customer_subscription, tracking_date=None):
         tracking.taken = False
         tracking.save()
         customer_subscription.extend_by_days(1)
+        inc_event('meal_skips')
     
     return tracking
 
 
+def bulk_mark_meals(owner, subscription_ids, status, tracking_date=None):
+    """
+    Mark many subscriptions' meals as Taken/Skipped for one date in a single
+    transaction (bulk counterpart of toggle_meal_status).
+
+    Only the owner's active subscriptions are touched. Subscriptions newly
+    marked Skipped get their end_date extended by 1 day in one UPDATE.
+    
+    Returns dict with created, updated and extended counts
+    """
+    if tracking_date is None:
+        tracking_date = timezone.localdate()
+    taken = (status == 'Taken')
+    
+    with transaction.atomic():
+        owned_ids = list(CustomerSubscription.objects.active().for_owner(owner).filter(
+            id__in=subscription_ids
+        ).values_list('id', flat=True))
+        
+        existing = {
+            tracking.subscription_id: tracking
+            for tracking in DailyMealTracking.objects.filter(
+                subscription_id__in=owned_ids,
+                date=tracking_date
+            )
+        }
+        
+        to_create = [
+            DailyMealTracking(subscription_id=sub_id, date=tracking_date, status=status, taken=taken)
+            for sub_id in owned_ids if sub_id not in existing
+        ]
+        to_update = [tracking for tracking in existing.values() if tracking.status != status]
+        for tracking in to_update:
+            tracking.status = status
+            tracking.taken = taken
+        
+        DailyMealTracking.objects.bulk_create(to_create, batch_size=500)
+        DailyMealTracking.objects.bulk_update(to_update, ['status', 'taken'], batch_size=500)
+        
+        # Rule 2: every newly skipped meal extends its subscription by a day
+        extended = 0
+        if status == 'Skipped':
+            skipped_ids = [tracking.subscription_id for tracking in to_create + to_update]
+            for i in range(0, len(skipped_ids), 500):
+                extended += CustomerSubscription.objects.filter(
+                    pk__in=skipped_ids[i:i + 500]
+                ).update(end_date=F('end_date') + timedelta(days=1), updated_at=timezone.now())
+    
+    bump_owner_version(owner.pk)
+    inc_event('meal_skips', extended)
+    
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'extended': extended,
+    }
+
+
+def get_meal_history(customer_subscription, start_date, end_date):
+    """
+    Compact taken/skipped history for a date window: one range query on the
+    hot DailyMealTracking rows plus one for archived months (MonthlyMealRollup).
+
+    Returns a string with one character per day from start_date to end_date
+    (inclusive): 'T' = Taken, 'S' = Skipped, '-' = no record.
+    """
+    days = (end_date - start_date).days + 1
+    if days <= 0:
+        return ''
+
+    return _encode_meal_history(
+        _meal_history_rows(customer_subscription, start_date, end_date), start_date, days,
+        rollups=_meal_history_rollups(customer_subscription, start_date, end_date),
+    )
+
+
+async def aget_meal_history(customer_subscription, start_date, end_date):
+    """Async get_meal_history(); hot rows and rollups are read concurrently."""
+    days = (end_date - start_date).days + 1
+    if days <= 0:
+        return ''
+
+    rows, rollups = await asyncio.gather(
+        _alist(_meal_history_rows(customer_subscription, start_date, end_date)),
+        _alist(_meal_history_rollups(customer_subscription, start_date, end_date)),
+    )
+    return _encode_meal_history(rows, start_date, days, rollups)
+
+
+async def _alist(queryset):
+    return [row async for row in queryset]
+
+
+def _meal_history_rows(customer_subscription, start_date, end_date):
+    return DailyMealTracking.objects.filter(
+        subscription=customer_subscription,
+        date__range=(start_date, end_date)
+    ).order_by().values_list('date', 'status')
+
+
+def _meal_history_rollups(customer_subscription, start_date, end_date):
+    return MonthlyMealRollup.objects.filter(
+        subscription=customer_subscription,
+        month__range=(start_date.replace(day=1), end_date)
+    ).order_by().values_list('month', 'history')
+
+
+def _encode_meal_history(rows, start_date, days, rollups=()):
+    history = bytearray(MEAL_HISTORY_EMPTY.encode() * days)
+    # Archived months first, so a day's hot row (recorded late) wins
+    for month, month_history in rollups:
+        offset = (month - start_date).days
+        first, last = max(0, -offset), min(len(month_history), days - offset)
+        if first < last:
+            history[offset + first:offset + last] = month_history[first:last].encode()
+    for tracked_date, status in rows:
+        history[(tracked_date - start_date).days] = ord(MEAL_HISTORY_CODES[status])
+    return history.decode()
+
+
+def build_calendar_grid(history, start_date):
+    """Expand a compact meal history string into calendar grid cells."""
+    statuses = {code: status for status, code in MEAL_HISTORY_CODES.items()}
+    return [
+        {
+            "date": start_date + timedelta(days=offset),
+            "taken": code == MEAL_HISTORY_CODES['Taken'],
+            "status": statuses.get(code),
+        }
+        for offset, code in enumerate(history)
+    ]
+
+
+def get_owner_meal_report(owner, months=12, today=None):
+    """
+    Meals taken and skipped per month across an owner's subscriptions for
+    the last `months` months (the current month included), from
+    MonthlyMealRollup for archived months and DailyMealTracking for the rest.
+
+    Returns a list of dicts (month, taken, skipped), oldest month first
+    """
+    if today is None:
+        today = timezone.localdate()
+    current_month = today.replace(day=1)
+    first_month = shift_months(current_month, 1 - months)
+
+    report = {}
+    rolled_up = MonthlyMealRollup.objects.filter(
+        subscription__menu__tiffin_service__owner=owner,
+        month__range=(first_month, current_month)
+    ).order_by().values('month').annotate(taken_meals=Sum('taken'), skipped_meals=Sum('skipped'))
+    hot = DailyMealTracking.objects.filter(
+        subscription__menu__tiffin_service__owner=owner,
+        date__range=(first_month, today)
+    ).order_by().annotate(month=TruncMonth('date')).values('month').annotate(
+        taken_meals=Count('id', filter=Q(status='Taken')),
+        skipped_meals=Count('id', filter=Q(status='Skipped')),
+    )
+    for row in list(rolled_up) + list(hot):
+        totals = report.setdefault(row['month'], {'month': row['month'], 'taken': 0, 'skipped': 0})
+        totals['taken'] += row['taken_meals']
+        totals['skipped'] += row['skipped_meals']
+    return [report[month] for month in sorted(report)]
+
+
 def calculate_owner_revenue(owner):
     """
     Calculate revenue metrics for owner dashboard.
     
+    Reads the incrementally maintained ledger (see core.revenue) instead of
+    aggregating subscriptions; the ledger is built on first use. Lapsed
+    subscriptions are deactivated first, so only .active() ones count.
+    
     Returns dict with:
     - total_revenue: Sum of all active subscription prices
     - monthly_revenue: Revenue from subscriptions created this month
     - active_subscribers: Count of active subscriptions
     - total_menus: Count of menus owned
     """
-    from .models import Menu
+    lapsed = _lapsed_subscriptions(owner)
+    if lapsed.exists():
+        deactivate_subscriptions(lapsed)
     
-    # Get owner's menus
-    menus = Menu.objects.filter(tiffin_service__owner=owner)
+    summary = OwnerRevenueSummary.objects.filter(owner=owner).first()
+    if summary is None:
+        summary = rebuild_owner_revenue(owner.pk)
     
-    # Get active subscriptions for owner's menus
-    active_subscriptions = CustomerSubscription.objects.filter(
-        menu__tiffin_service__owner=owner,
-        is_active=True
+    # Revenue of still-active subscriptions created this month
+    current_month_start = timezone.localdate().replace(day=1)
+    monthly_revenue = OwnerMonthlyRevenue.objects.filter(
+        owner=owner,
+        month=current_month_start
+    ).values_list('revenue', flat=True).first() or Decimal('0.00')
+    
+    return _revenue_stats(summary, monthly_revenue)
+
+
+async def acalculate_owner_revenue(owner):
+    """Async calculate_owner_revenue(); both ledger rows are read concurrently."""
+    lapsed = _lapsed_subscriptions(owner)
+    if await lapsed.aexists():
+        await sync_to_async(deactivate_subscriptions)(lapsed)
+    
+    current_month_start = timezone.localdate().replace(day=1)
+    monthly_revenue_query = OwnerMonthlyRevenue.objects.filter(
+        owner=owner,
+        month=current_month_start
+    ).values_list('revenue', flat=True)
+
+    summary, monthly_revenue = await asyncio.gather(
+        OwnerRevenueSummary.objects.filter(owner=owner).afirst(),
+        monthly_revenue_query.afirst(),
     )
+    if summary is None:
+        summary = await sync_to_async(rebuild_owner_revenue)(owner.pk)
+        monthly_revenue = await monthly_revenue_query.afirst()
     
-    # Calculate total revenue (sum of subscription prices)
-    total_revenue = active_subscriptions.aggregate(
-        total=Sum('subscription__price')
-    )['total'] or Decimal('0.00')
+    return _revenue_stats(summary, monthly_revenue or Decimal('0.00'))
+
+
+def _lapsed_subscriptions(owner):
+    """
+    The owner's subscriptions still marked active past their end_date.
     
-    # Calculate monthly revenue (subscriptions created this month)
-    current_month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    monthly_subscriptions = CustomerSubscription.objects.filter(
+    The ledger counts is_active rows; these are expired by .active() rules
+    but stay in the ledger until the expiry job reaches them, so the revenue
+    readers deactivate them first.
+    """
+    return CustomerSubscription.objects.filter(
         menu__tiffin_service__owner=owner,
-        created_at__gte=current_month_start,
-        is_active=True
+        is_active=True,
+        end_date__lt=timezone.now()
     )
-    monthly_revenue = monthly_subscriptions.aggregate(
-        total=Sum('subscription__price')
-    )['total'] or Decimal('0.00')
+
+
+def _revenue_stats(summary, monthly_revenue):
+    return {
+        'total_revenue': summary.total_revenue,
+        'monthly_revenue': monthly_revenue,
+        'active_subscribers': summary.active_subscribers,
+        'total_menus': summary.total_menus,
+    }
+
+
+def encode_subscription_cursor(customer_subscription):
+    """Keyset cursor for (created_at, id): '<epoch microseconds>.<id>' ('n' for no created_at)."""
+    created_at = customer_subscription.created_at
+    if created_at is None:
+        return f"n.{customer_subscription.pk}"
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1)}.{customer_subscription.pk}"
+
+
+def decode_subscription_cursor(cursor):
+    """Parse a cursor from encode_subscription_cursor(); returns (created_at, id) or None."""
+    try:
+        created_at, pk = cursor.split('.')
+        pk = int(pk)
+        if created_at == 'n':
+            return None, pk
+        return EPOCH + timedelta(microseconds=int(created_at)), pk
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_owner_subscriptions_page(owner, cursor=None, menu_id=None, expiring_soon=False,
+                                 page_size=SUBSCRIBERS_PAGE_SIZE):
+    """
+    One page of an owner's active subscribers, newest first.
+
+    Uses keyset pagination on (created_at, id) so page latency stays flat
+    however deep the owner pages; rows without created_at sort last.
     
-    # Count active subscribers (unique customers)
-    active_subscribers = active_subscriptions.values('customer').distinct().count()
+    Returns dict with:
+    - subscriptions: list of CustomerSubscription
+    - next_cursor: cursor for the following page, or None on the last page
+    """
+    subscriptions = _owner_subscriptions_query(owner, cursor, menu_id, expiring_soon)
+    return _subscriptions_page(list(subscriptions[:page_size + 1]), page_size)
+
+
+async def aget_owner_subscriptions_page(owner, cursor=None, menu_id=None, expiring_soon=False,
+                                        page_size=SUBSCRIBERS_PAGE_SIZE):
+    """Async get_owner_subscriptions_page()."""
+    subscriptions = _owner_subscriptions_query(owner, cursor, menu_id, expiring_soon)
+    return _subscriptions_page([cs async for cs in subscriptions[:page_size + 1]], page_size)
+
+
+def _owner_subscriptions_query(owner, cursor, menu_id, expiring_soon):
+    subscriptions = CustomerSubscription.objects.active().for_owner(owner).select_related('customer', 'subscription', 'menu').order_by(
+        F('created_at').desc(nulls_last=True), '-id'
+    )
     
-    # Count total menus
-    total_menus = menus.count()
+    if menu_id:
+        subscriptions = subscriptions.filter(menu_id=menu_id)
+    if expiring_soon:
+        # Same rule as CustomerSubscription.status: at most 7 days remaining,
+        # counted in local dates
+        cutoff = datetime.combine(timezone.localdate() + timedelta(days=EXPIRING_SOON_DAYS + 1), time.min)
+        subscriptions = subscriptions.filter(end_date__lt=timezone.make_aware(cutoff))
+    
+    position = decode_subscription_cursor(cursor) if cursor else None
+    if position:
+        created_at, pk = position
+        if created_at is None:
+            subscriptions = subscriptions.filter(created_at__isnull=True, id__lt=pk)
+        else:
+            subscriptions = subscriptions.filter(
+                Q(created_at__lt=created_at)
+                | Q(created_at=created_at, id__lt=pk)
+                | Q(created_at__isnull=True)
+            )
+    return subscriptions
+
+
+def _subscriptions_page(page, page_size):
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_subscription_cursor(page[-1])
     
     return {
-        'total_revenue': total_revenue,
-        'monthly_revenue': monthly_revenue,
-        'active_subscribers': active_subscribers,
-        'total_menus': total_menus,
+        'subscriptions': page,
+        'next_cursor': next_cursor,
     }
 
 
@@ -155,11 +550,7 @@ def get_customer_dashboard_stats(customer):
     - total_subscriptions: Count of all subscriptions
     - days_remaining: Days remaining in primary subscription
     """
-    active_subscriptions = CustomerSubscription.objects.filter(
-        customer=customer,
-        is_active=True
-    ).select_related('subscription', 'menu').order_by('-created_at')
-    
+    active_subscriptions = _customer_active_subscriptions(customer)
     primary_subscription = active_subscriptions.first()
     
     return {
@@ -170,3 +561,32 @@ def get_customer_dashboard_stats(customer):
         'primary_subscription': primary_subscription,
         'days_remaining': primary_subscription.days_remaining if primary_subscription else 0,
     }
+
+
+async def aget_customer_dashboard_stats(customer):
+    """
+    Async get_customer_dashboard_stats(). The active subscriptions are
+    returned as a list (fetched concurrently with the total count), so
+    templates never hit the database from the event loop.
+    """
+    async def active_list():
+        return [cs async for cs in _customer_active_subscriptions(customer)]
+
+    active_subscriptions, total_subscriptions = await asyncio.gather(
+        active_list(),
+        CustomerSubscription.objects.filter(customer=customer).acount(),
+    )
+    primary_subscription = active_subscriptions[0] if active_subscriptions else None
+    
+    return {
+        'active_subscriptions': active_subscriptions,
+        'total_subscriptions': total_subscriptions,
+        'primary_subscription': primary_subscription,
+        'days_remaining': primary_subscription.days_remaining if primary_subscription else 0,
+    }
+
+
+def _customer_active_subscriptions(customer):
+    return CustomerSubscription.objects.active().filter(
+        customer=customer
+    ).select_related('subscription', 'menu').order_by('-created_at')
@@ -1,30 +1,75 @@
 """
 Enhanced views with business logic, security, and SaaS-level features.
 """
+import asyncio
+import io
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from datetime import date, timedelta
 
 from .models import (
     Menu, TiffinService, Subscription, DailyMenu,
-    CustomerSubscription, DailyMealTracking, Order, Review
+    CustomerSubscription, Order, Review, PaymentIntent
 )
 from .utils import (
-    handle_payment_success,
     handle_skip_extension,
-    calculate_owner_revenue,
-    get_customer_dashboard_stats,
+    acalculate_owner_revenue,
+    aget_customer_dashboard_stats,
+    aget_meal_history,
+    build_calendar_grid,
+    aget_owner_subscriptions_page,
+    get_owner_meal_report,
+    bulk_mark_meals,
 )
 from .decorators import owner_required, customer_required
+from .search import search_menus
+from .dashboard_cache import acached_for_owner, bump_owner_version
+from .conditional import catalogue_page
+from .db_router import replica_reads
+from .payments import create_payment_intent, confirm_inline
+from .subscription_import import import_subscriptions as bulk_import_subscriptions
+from .manifest import build_manifest, parse_day
+from .week_plan import attach_todays_dish, aattach_todays_dish
+from .exports import (
+    EXPORT_FORMATS, MEAL_HISTORY_COLUMNS, SUBSCRIBER_COLUMNS,
+    export_response, meal_history_rows, subscriber_rows,
+)
+from . import metrics as app_metrics
+
+
+# Calendar history windows (days) offered on the customer dashboard
+DEFAULT_HISTORY_DAYS = 30
+MAX_HISTORY_DAYS = 3650
+HISTORY_WINDOWS = ['30', '90', '365']
+
+# Months of meals taken/skipped shown on the owner dashboard
+MEAL_REPORT_MONTHS = 6
+
+# Row errors listed after a CSV subscription import
+IMPORT_ERRORS_SHOWN = 200
+
+
+async def alist(queryset):
+    """Evaluate a queryset with the async ORM."""
+    return [obj async for obj in queryset]
 
 
 # ==================== PUBLIC VIEWS ====================
 
+@replica_reads
+@catalogue_page
 def home(request):
     """Home page with role-based content."""
     owner_menus = None
@@ -33,14 +78,11 @@ def home(request):
 
     if request.user.is_authenticated:
         if request.user.is_staff:
-            owner_menus = Menu.objects.filter(
-                tiffin_service__owner=request.user
-            ).select_related('tiffin_service')
+            owner_menus = attach_todays_dish(Menu.objects.owned_by(request.user))
         else:
             customer_menus = Menu.objects.all()[:6]  # Show limited menus
-            active_subscriptions = CustomerSubscription.objects.filter(
-                customer=request.user,
-                is_active=True
+            active_subscriptions = CustomerSubscription.objects.active().filter(
+                customer=request.user
             ).select_related('subscription', 'menu')
 
     return render(request, "core/home.html", {
@@ -163,43 +205,50 @@ def logout_user(request):
 
 @login_required
 @customer_required
-def customer_dashboard(request):
-    """Customer dashboard with subscription stats and calendar."""
-    stats = get_customer_dashboard_stats(request.user)
+@replica_reads
+async def customer_dashboard(request):
+    """
+    Customer dashboard with subscription stats and calendar.
+
+    Async: the stats, the menu cards and then the meal history are read with
+    the async ORM, independent queries concurrently.
+    """
+    user = await request.auser()
+    stats, menus = await asyncio.gather(
+        aget_customer_dashboard_stats(user),
+        alist(Menu.objects.all()[:6]),
+    )
+    await aattach_todays_dish(menus)
     
     primary_subscription = stats['primary_subscription']
     grid_data = []
+    history_days = request.GET.get('days', str(DEFAULT_HISTORY_DAYS))
     
     if primary_subscription:
-        # Generate calendar grid for last 30 days
-        start_date = max(
-            primary_subscription.start_date.date(),
-            date.today() - timedelta(days=30)
-        )
-        today = date.today()
+        # Generate calendar grid for the requested window (or full subscription)
+        today = timezone.localdate()
+        subscription_start = primary_subscription.start_date.date()
+        if history_days == 'all':
+            start_date = subscription_start
+        else:
+            try:
+                days = min(max(int(history_days), 1), MAX_HISTORY_DAYS)
+            except ValueError:
+                days = DEFAULT_HISTORY_DAYS
+            history_days = str(days)
+            start_date = max(subscription_start, today - timedelta(days=days))
         
-        current = start_date
-        while current <= today:
-            tracking = DailyMealTracking.objects.filter(
-                subscription=primary_subscription,
-                date=current
-            ).first()
-            
-            grid_data.append({
-                "date": current,
-                "taken": tracking.taken if tracking else False,
-                "status": tracking.status if tracking else None,
-            })
-            current += timedelta(days=1)
+        history = await aget_meal_history(primary_subscription, start_date, today)
+        grid_data = build_calendar_grid(history, start_date)
     
-    # Get available menus
-    menus = Menu.objects.all()[:6]
-    
-    return render(request, "core/customer_dashboard.html", {
+    # Rendering may touch the session (messages), so it runs off the event loop
+    return await sync_to_async(render)(request, "core/customer_dashboard.html", {
         "active_subscriptions": stats['active_subscriptions'],
         "primary_subscription": primary_subscription,
         "days_remaining": stats['days_remaining'],
         "grid_data": grid_data,
+        "history_days": history_days,
+        "history_windows": HISTORY_WINDOWS,
         "menus": menus,
         "total_subscriptions": stats['total_subscriptions'],
     })
@@ -207,23 +256,28 @@ def customer_dashboard(request):
 
 @login_required
 @customer_required
+@replica_reads
+@catalogue_page
 def menu(request):
     """Menu browsing page for customers."""
-    menus = Menu.objects.all().select_related('tiffin_service').prefetch_related('subscriptions')
+    menus = Menu.objects.all().select_related('tiffin_service').prefetch_related(
+        'subscriptions', 'daily_menus'
+    )
     
     query = request.GET.get("q")
     if query:
-        menus = menus.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        menus = search_menus(menus, query)
     
-    # Mark subscriptions as subscribed if customer has active subscription
+    # Resolve the customer's active plans once, then mark prefetched plans
+    subscribed_ids = set(
+        CustomerSubscription.objects.active().filter(
+            customer=request.user
+        ).values_list('subscription_id', flat=True)
+    )
+    menus = attach_todays_dish(menus)
     for menu in menus:
         for sub in menu.subscriptions.all():
-            active = CustomerSubscription.objects.filter(
-                customer=request.user,
-                subscription=sub,
-                is_active=True
-            ).exists()
-            sub.is_subscribed = active
+            sub.is_subscribed = sub.id in subscribed_ids
     
     return render(request, "core/menu.html", {
         "menus": menus,
@@ -239,10 +293,9 @@ def subscribe(request, subscription_id):
     subscription = get_object_or_404(Subscription, id=subscription_id)
     
     # Check if already subscribed
-    already_subscribed = CustomerSubscription.objects.filter(
+    already_subscribed = CustomerSubscription.objects.active().filter(
         customer=request.user,
-        subscription=subscription,
-        is_active=True
+        subscription=subscription
     ).exists()
     
     if already_subscribed:
@@ -255,42 +308,88 @@ def subscribe(request, subscription_id):
 @login_required
 @customer_required
 def payment_page(request, subscription_id):
-    """Payment page with simulated payment processing."""
+    """
+    Payment page. A submitted payment is recorded as a PaymentIntent and
+    confirmed by a `process_payments` worker (inline when PAYMENTS_ASYNC is
+    False); the customer is sent to payment_status to wait for it.
+    """
     subscription = get_object_or_404(Subscription, id=subscription_id)
     
-    # Check if already subscribed
-    existing = CustomerSubscription.objects.filter(
+    # Check if already subscribed (a POST is checked when its intent is
+    # created, so a double-submitted payment still reaches its status page)
+    if request.method != "POST" and CustomerSubscription.objects.active().filter(
         customer=request.user,
-        subscription=subscription,
-        is_active=True
-    ).first()
-    
-    if existing:
+        subscription=subscription
+    ).exists():
         messages.info(request, 'You already have an active subscription.')
         return redirect('customer_dashboard')
     
+    # One key per rendered form: a double-click or browser retry of the same
+    # submission resolves to the same intent and subscription
+    idempotency_key = request.POST.get("idempotency_key", "")[:64] or uuid.uuid4().hex
+    
     if request.method == "POST":
         card = request.POST.get("card_number")
         expiry = request.POST.get("expiry")
         cvv = request.POST.get("cvv")
         
         if card and expiry and cvv:
-            # Process payment using utility function
-            customer_subscription = handle_payment_success(request.user, subscription)
+            intent = create_payment_intent(request.user, subscription, idempotency_key)
             
-            if customer_subscription:
-                messages.success(
-                    request,
-                    f'Payment successful! Your subscription is active until {customer_subscription.end_date.strftime("%B %d, %Y")}.'
-                )
-                return redirect("customer_dashboard")
+            if intent:
+                if not getattr(settings, 'PAYMENTS_ASYNC', True):
+                    intent = confirm_inline(intent)
+                return redirect("payment_status", intent_id=intent.pk)
             else:
                 messages.error(request, 'Subscription failed. You may already have an active subscription.')
         else:
             messages.error(request, 'Please fill all payment fields.')
     
     return render(request, "core/payment.html", {
-        "subscription": subscription
+        "subscription": subscription,
+        "idempotency_key": idempotency_key,
+    })
+
+
+@login_required
+@customer_required
+def payment_status(request, intent_id):
+    """
+    Waits for a payment intent to be confirmed. The page polls
+    payment_status_json and reloads once the intent is final; a succeeded
+    intent then redirects to the dashboard.
+    """
+    intent = get_object_or_404(
+        PaymentIntent.objects.select_related('subscription__menu', 'customer_subscription'),
+        id=intent_id, customer=request.user,
+    )
+    
+    if intent.status == 'succeeded':
+        messages.success(
+            request,
+            f'Payment successful! Your subscription is active until {intent.customer_subscription.end_date.strftime("%B %d, %Y")}.'
+            if intent.customer_subscription else 'Payment successful!'
+        )
+        return redirect("customer_dashboard")
+    
+    return render(request, "core/payment_status.html", {
+        "intent": intent,
+        "poll_interval_ms": int(getattr(settings, 'PAYMENT_STATUS_POLL_INTERVAL', 2) * 1000),
+    })
+
+
+@login_required
+@customer_required
+def payment_status_json(request, intent_id):
+    """Polled by the payment status page."""
+    intent = get_object_or_404(
+        PaymentIntent.objects.only('status', 'error'),
+        id=intent_id, customer=request.user,
+    )
+    return JsonResponse({
+        'status': intent.status,
+        'final': intent.is_final,
+        'error': intent.error,
     })
 
 
@@ -306,26 +405,79 @@ def order(request):
 
 @login_required
 @owner_required
-def owner_dashboard(request):
-    """Owner dashboard with revenue aggregation and stats."""
-    # Calculate revenue metrics
-    revenue_stats = calculate_owner_revenue(request.user)
-    
-    # Get owner's menus
-    menus = Menu.objects.filter(
-        tiffin_service__owner=request.user
-    ).select_related('tiffin_service')
-    
-    # Get active subscriptions for owner's menus
-    subscriptions = CustomerSubscription.objects.filter(
-        menu__tiffin_service__owner=request.user,
-        is_active=True
-    ).select_related('customer', 'subscription', 'menu').order_by('-created_at')
-    
-    return render(request, 'core/owner_dashboard.html', {
-        'menus': menus,
-        'subscriptions': subscriptions,
+@replica_reads
+async def owner_dashboard(request):
+    """
+    Owner dashboard with revenue aggregation and stats.
+
+    Async: the cached sections are resolved concurrently, and on a cache
+    miss their queries (revenue ledger, meal report, subscriber page, menus)
+    run side by side.
+    """
+    user = await request.auser()
+    owner_id = user.pk
+    
+    # Get owner's menus (fetched once, and only when a cached section misses)
+    menus_task = None
+    
+    def owner_menus():
+        nonlocal menus_task
+        if menus_task is None:
+            menus_task = asyncio.ensure_future(alist(
+                Menu.objects.owned_by(user)
+            ))
+        return menus_task
+    
+    # Get one keyset page of active subscriptions for owner's menus
+    menu_filter = request.GET.get('menu')
+    expiring_soon = request.GET.get('expiring') == '1'
+    cursor = request.GET.get('after')
+    
+    async def render_subscribers():
+        page, menus = await asyncio.gather(
+            aget_owner_subscriptions_page(
+                user,
+                cursor=cursor,
+                menu_id=menu_filter if menu_filter and menu_filter.isdigit() else None,
+                expiring_soon=expiring_soon,
+            ),
+            owner_menus(),
+        )
+        return render_to_string('core/owner_subscribers.html', {
+            'menus': menus,
+            'subscriptions': page['subscriptions'],
+            'next_cursor': page['next_cursor'],
+            'menu_filter': menu_filter,
+            'expiring_soon': expiring_soon,
+            'is_paginated': bool(cursor),
+        })
+    
+    async def render_menus():
+        return render_to_string('core/owner_menus.html', {'menus': await owner_menus()})
+    
+    # Revenue metrics and both sections are cached per owner data version;
+    # days remaining change daily, so the subscriber list also varies by date
+    revenue_stats, meal_report, subscribers_html, menus_html = await asyncio.gather(
+        acached_for_owner(owner_id, 'revenue_stats', lambda: acalculate_owner_revenue(user)),
+        acached_for_owner(
+            owner_id, 'meal_report', lambda: sync_to_async(get_owner_meal_report)(user, MEAL_REPORT_MONTHS),
+            vary=(timezone.localdate().replace(day=1),),
+        ),
+        acached_for_owner(
+            owner_id, 'subscribers', render_subscribers,
+            vary=(timezone.localdate(), menu_filter, expiring_soon, cursor),
+        ),
+        acached_for_owner(owner_id, 'menus', render_menus),
+    )
+    
+    return await sync_to_async(render)(request, 'core/owner_dashboard.html', {
+        'subscribers_html': mark_safe(subscribers_html),
+        'menus_html': mark_safe(menus_html),
+        'menu_filter': menu_filter,
+        'expiring_soon': expiring_soon,
+        'is_paginated': bool(cursor),
         'revenue_stats': revenue_stats,
+        'meal_report': meal_report,
     })
 
 
@@ -372,13 +524,8 @@ def add_menu(request):
 @login_required
 @owner_required
 def edit_menu(request, menu_id):
-    """Edit menu (owner only, with ownership validation)."""
-    menu = get_object_or_404(Menu, id=menu_id)
-    
-    # Security: Verify ownership
-    if menu.tiffin_service.owner != request.user:
-        messages.error(request, 'Access denied. You do not own this menu.')
-        return redirect('owner_dashboard')
+    """Edit menu (owner only; other owners' menus are not found)."""
+    menu = get_object_or_404(Menu.objects.owned_by(request.user), id=menu_id)
     
     if request.method == "POST":
         menu.title = request.POST.get('title')
@@ -398,13 +545,8 @@ def edit_menu(request, menu_id):
 @login_required
 @owner_required
 def delete_menu(request, menu_id):
-    """Delete menu (owner only, with ownership validation)."""
-    menu = get_object_or_404(Menu, id=menu_id)
-    
-    # Security: Verify ownership
-    if menu.tiffin_service.owner != request.user:
-        messages.error(request, 'Access denied. You do not own this menu.')
-        return redirect('owner_dashboard')
+    """Delete menu (owner only; other owners' menus are not found)."""
+    menu = get_object_or_404(Menu.objects.owned_by(request.user), id=menu_id)
     
     menu_title = menu.title
     menu.delete()
@@ -416,12 +558,7 @@ def delete_menu(request, menu_id):
 @owner_required
 def add_subscription(request, menu_id):
     """Add subscription plan to menu (owner only)."""
-    menu = get_object_or_404(Menu, id=menu_id)
-    
-    # Security: Verify ownership
-    if menu.tiffin_service.owner != request.user:
-        messages.error(request, 'Access denied. You do not own this menu.')
-        return redirect('owner_dashboard')
+    menu = get_object_or_404(Menu.objects.owned_by(request.user), id=menu_id)
     
     if request.method == 'POST':
         Subscription.objects.create(
@@ -441,9 +578,7 @@ def add_subscription(request, menu_id):
 @owner_required
 def select_menu_for_subscription(request):
     """Select menu to add subscription plan."""
-    menus = Menu.objects.filter(
-        tiffin_service__owner=request.user
-    ).select_related('tiffin_service')
+    menus = Menu.objects.owned_by(request.user)
     
     return render(
         request,
@@ -452,16 +587,98 @@ def select_menu_for_subscription(request):
     )
 
 
+@login_required
+@owner_required
+def kitchen_manifest(request):
+    """How many tiffins of each menu and plan to cook on a date (default today)."""
+    day = parse_day(request.GET.get('date', '')) or timezone.localdate()
+    
+    kitchens = build_manifest(day, owner=request.user)
+    return render(request, 'core/kitchen_manifest.html', {
+        'day': day,
+        'kitchen': kitchens[0] if kitchens else None,
+        'previous_day': day - timedelta(days=1),
+        'next_day': day + timedelta(days=1),
+    })
+
+
+def _export_format(request):
+    export_format = request.GET.get('format', 'csv')
+    return export_format if export_format in EXPORT_FORMATS else 'csv'
+
+
+@login_required
+@owner_required
+def export_subscribers(request):
+    """Stream all of the owner's subscribers as CSV (or ?format=jsonl)."""
+    return export_response(
+        request,
+        f'subscribers-{timezone.localdate():%Y-%m-%d}',
+        SUBSCRIBER_COLUMNS,
+        subscriber_rows(request.user),
+        _export_format(request),
+    )
+
+
+@login_required
+@owner_required
+def export_meal_history(request):
+    """Stream meal tracking between ?start= and ?end= (default: the last 30 days)."""
+    today = timezone.localdate()
+    try:
+        end_date = date.fromisoformat(request.GET.get('end', ''))
+    except ValueError:
+        end_date = today
+    try:
+        start_date = date.fromisoformat(request.GET.get('start', ''))
+    except ValueError:
+        start_date = end_date - timedelta(days=DEFAULT_HISTORY_DAYS)
+    
+    return export_response(
+        request,
+        f'meal-history-{start_date:%Y-%m-%d}-to-{end_date:%Y-%m-%d}',
+        MEAL_HISTORY_COLUMNS,
+        meal_history_rows(request.user, start_date, end_date),
+        _export_format(request),
+    )
+
+
+@login_required
+@owner_required
+def import_subscriptions(request):
+    """Bulk-import existing customers and subscriptions from a CSV upload."""
+    result = None
+    
+    if request.method == 'POST':
+        upload = request.FILES.get('csv_file')
+        if not upload:
+            messages.error(request, 'Please choose a CSV file.')
+        else:
+            result = bulk_import_subscriptions(
+                request.user,
+                io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline=''),
+                dry_run=bool(request.POST.get('dry_run')),
+            )
+            if result['created_subscriptions'] and not request.POST.get('dry_run'):
+                messages.success(
+                    request,
+                    f"Imported {result['created_subscriptions']} subscription(s) and "
+                    f"{result['created_customers']} new customer(s)."
+                )
+    
+    return render(request, 'core/import_subscriptions.html', {
+        'result': result,
+        'errors': result['errors'][:IMPORT_ERRORS_SHOWN] if result else [],
+        'hidden_errors': max(0, len(result['errors']) - IMPORT_ERRORS_SHOWN) if result else 0,
+        'menus': Menu.objects.owned_by(request.user).prefetch_related('subscriptions'),
+    })
+
+
 @login_required
 @owner_required
 def add_daily_menu(request, menu_id):
     """Add daily menu (owner only)."""
-    menu = get_object_or_404(Menu, id=menu_id)
-    
-    # Security: Verify ownership
-    if menu.tiffin_service.owner != request.user:
-        messages.error(request, 'Access denied. You do not own this menu.')
-        return redirect('owner_dashboard')
+    menu = get_object_or_404(Menu.objects.owned_by(request.user), id=menu_id)
     
     if request.method == "POST":
         day = request.POST.get('day')
@@ -487,14 +704,11 @@ def add_daily_menu(request, menu_id):
 @owner_required
 def toggle_meal_status(request, subscription_id):
     """Toggle meal status (Taken/Skipped) with skip extension logic."""
-    subscription = get_object_or_404(CustomerSubscription, id=subscription_id)
-    
-    # Security: Verify ownership
-    if subscription.menu.tiffin_service.owner != request.user:
-        messages.error(request, 'Access denied.')
-        return redirect('owner_dashboard')
+    subscription = get_object_or_404(
+        CustomerSubscription.objects.for_owner(request.user).select_related('customer', 'menu'), id=subscription_id
+    )
     
-    today = date.today()
+    today = timezone.localdate()
     
     # Use utility function for skip extension logic
     tracking = handle_skip_extension(subscription, today)
@@ -508,6 +722,7 @@ def toggle_meal_status(request, subscription_id):
         tracking.taken = True
     
     tracking.save()
+    bump_owner_version(request.user.pk)
     
     status_text = "marked as taken" if tracking.taken else "marked as skipped (subscription extended)"
     messages.success(request, f'Meal for {subscription.customer.username} {status_text}.')
@@ -515,6 +730,38 @@ def toggle_meal_status(request, subscription_id):
     return redirect('owner_dashboard')
 
 
+@login_required
+@owner_required
+def bulk_mark_meal_status(request):
+    """Mark meals Taken/Skipped for many subscriptions at once."""
+    if request.method != 'POST':
+        return redirect('owner_dashboard')
+    
+    status = request.POST.get('status')
+    subscription_ids = [
+        sub_id for sub_id in request.POST.getlist('subscription_ids') if sub_id.isdigit()
+    ]
+    if status not in ('Taken', 'Skipped') or not subscription_ids:
+        messages.error(request, 'Select at least one subscription and a meal status.')
+        return redirect('owner_dashboard')
+    
+    tracking_date = timezone.localdate()
+    if request.POST.get('date'):
+        try:
+            tracking_date = date.fromisoformat(request.POST['date'])
+        except ValueError:
+            messages.error(request, 'Invalid date.')
+            return redirect('owner_dashboard')
+    
+    result = bulk_mark_meals(request.user, subscription_ids, status, tracking_date)
+    
+    marked = result['created'] + result['updated']
+    status_text = "taken" if status == 'Taken' else "skipped (subscriptions extended)"
+    messages.success(request, f'{marked} meal(s) for {tracking_date:%b %d} marked as {status_text}.')
+    
+    return redirect('owner_dashboard')
+
+
 @login_required
 def dashboard_redirect(request):
     """Redirect to appropriate dashboard based on role."""
@@ -526,7 +773,29 @@ def dashboard_redirect(request):
 
 # ==================== PUBLIC VIEWS ====================
 
+@replica_reads
+@catalogue_page
 def reviews(request):
     """Public reviews page."""
     reviews_list = Review.objects.all().select_related('user', 'tiffin_service').order_by('-created_at')[:10]
     return render(request, 'core/reviews.html', {'reviews': reviews_list})
+
+
+# ==================== MONITORING ====================
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint: requires "Authorization: Bearer
+    <METRICS_TOKEN>" or a superuser session (owners are staff here).
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    has_token = bool(token) and constant_time_compare(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    )
+    if not has_token and not request.user.is_superuser:
+        return HttpResponseForbidden('Forbidden')
+    
+    return HttpResponse(
+        app_metrics.render_prometheus(app_metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
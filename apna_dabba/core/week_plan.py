@@ -0,0 +1,125 @@
+"""
+"What is served today" for menus.
+
+A menu's dishes live in two places: the Menu.monday..sunday text fields and
+DailyMenu rows (with an optional image), which take precedence. Both are
+merged into a week plan per menu,
+
+    {'Monday': {'dish': 'Dal, rice', 'image': 'daily_menu_images/dal.jpg'}, ...}
+
+cached per menu until a Menu or DailyMenu save/delete invalidates it (see
+core.signals). Pages showing many menu cards resolve all of them with one
+cache.get_many(); only plans missing from the cache cost two queries in
+total, however many menus there are.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from .db_router import use_primary
+from .models import Menu, DailyMenu
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+WEEKDAY_FIELDS = tuple(day.lower() for day in WEEKDAYS)
+
+
+def get_week_plan_cache_timeout():
+    """Seconds a cached week plan lives (WEEK_PLAN_CACHE_TIMEOUT, default 1 day)."""
+    return getattr(settings, 'WEEK_PLAN_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _plan_key(menu_id):
+    return f'menu-week-plan:{menu_id}'
+
+
+def invalidate_week_plan(menu_id):
+    """Drop a menu's cached week plan."""
+    cache.delete(_plan_key(menu_id))
+
+
+def _merge(weekday_rows, daily_rows):
+    plans = {
+        menu_id: {day: {'dish': dish, 'image': ''} for day, dish in zip(WEEKDAYS, dishes)}
+        for menu_id, *dishes in weekday_rows
+    }
+    for menu_id, day, dish, image in daily_rows:
+        if menu_id in plans and day in plans[menu_id]:
+            plans[menu_id][day] = {'dish': dish or plans[menu_id][day]['dish'], 'image': image or ''}
+    return plans
+
+
+def build_week_plans(menu_ids):
+    """Week plans of menu_ids from the database (two queries)."""
+    # Cached until the next change: never build them from a lagging replica
+    with use_primary():
+        weekday_rows = Menu.objects.filter(pk__in=menu_ids).order_by().values_list('id', *WEEKDAY_FIELDS)
+        daily_rows = DailyMenu.objects.filter(menu_id__in=menu_ids).order_by().values_list(
+            'menu_id', 'day', 'food_description', 'image'
+        )
+        return _merge(list(weekday_rows), list(daily_rows))
+
+
+async def abuild_week_plans(menu_ids):
+    """Async build_week_plans()."""
+    with use_primary():
+        weekday_rows = Menu.objects.filter(pk__in=menu_ids).order_by().values_list('id', *WEEKDAY_FIELDS)
+        daily_rows = DailyMenu.objects.filter(menu_id__in=menu_ids).order_by().values_list(
+            'menu_id', 'day', 'food_description', 'image'
+        )
+        return _merge([row async for row in weekday_rows], [row async for row in daily_rows])
+
+
+def get_week_plans(menu_ids):
+    """{menu_id: week plan}, from the cache where possible."""
+    menu_ids = set(menu_ids)
+    if not menu_ids:
+        return {}
+    cached = cache.get_many([_plan_key(menu_id) for menu_id in menu_ids])
+    plans = {menu_id: cached[_plan_key(menu_id)] for menu_id in menu_ids if _plan_key(menu_id) in cached}
+    missing = menu_ids - plans.keys()
+    if missing:
+        built = build_week_plans(missing)
+        cache.set_many({_plan_key(menu_id): plan for menu_id, plan in built.items()}, get_week_plan_cache_timeout())
+        plans.update(built)
+    return plans
+
+
+async def aget_week_plans(menu_ids):
+    """Async get_week_plans()."""
+    menu_ids = set(menu_ids)
+    if not menu_ids:
+        return {}
+    cached = await cache.aget_many([_plan_key(menu_id) for menu_id in menu_ids])
+    plans = {menu_id: cached[_plan_key(menu_id)] for menu_id in menu_ids if _plan_key(menu_id) in cached}
+    missing = menu_ids - plans.keys()
+    if missing:
+        built = await abuild_week_plans(missing)
+        await cache.aset_many({_plan_key(menu_id): plan for menu_id, plan in built.items()}, get_week_plan_cache_timeout())
+        plans.update(built)
+    return plans
+
+
+def _attach(menus, plans, day):
+    image_field = DailyMenu._meta.get_field('image')
+    weekday = WEEKDAYS[(day or timezone.localdate()).weekday()]
+    for menu in menus:
+        today = dict(plans.get(menu.pk, {}).get(weekday) or {'dish': '', 'image': ''})
+        # An ImageField value, so {% responsive_image %} works on it
+        today['image'] = FieldFile(None, image_field, today['image']) if today['image'] else None
+        menu.today = today
+    return menus
+
+
+def attach_todays_dish(menus, day=None):
+    """
+    Set menu.today ({'dish', 'image'}) on each of menus for day (default
+    today). Returns menus as a list.
+    """
+    menus = list(menus)
+    return _attach(menus, get_week_plans(menu.pk for menu in menus), day)
+
+
+async def aattach_todays_dish(menus, day=None):
+    """Async attach_todays_dish() for already evaluated menus."""
+    return _attach(menus, await aget_week_plans(menu.pk for menu in menus), day)